@@ -0,0 +1,37 @@
+from flask import Flask
+from models import db, Cart
+from cart import merge_duplicate_items
+from sqlalchemy import text
+
+app = Flask(__name__)
+app.config['SQLALCHEMY_DATABASE_URI'] = 'mysql+pymysql://root:@localhost/kukuhub'
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+db.init_app(app)
+
+def add_cart_constraints():
+    """Add the carts version table and the unique (user_id, product_id) key on cart_items"""
+    with app.app_context():
+        try:
+            Cart.__table__.create(db.engine, checkfirst=True)
+            print("Ensured 'carts' table exists")
+        except Exception as e:
+            print(f"Error creating carts table: {e}")
+        
+        try:
+            with db.engine.connect() as conn:
+                result = conn.execute(text("SHOW INDEX FROM cart_items WHERE Key_name = 'uq_cart_items_user_product'"))
+                if result.fetchone():
+                    print("Unique key 'uq_cart_items_user_product' already exists")
+                else:
+                    merge_duplicate_items(conn)
+                    conn.execute(text("CREATE UNIQUE INDEX uq_cart_items_user_product ON cart_items (user_id, product_id)"))
+                    conn.commit()
+                    print("Added unique key 'uq_cart_items_user_product' to cart_items table")
+        except Exception as e:
+            print(f"Error adding cart_items unique key: {e}")
+        
+        print("Database migration completed!")
+
+if __name__ == '__main__':
+    add_cart_constraints()
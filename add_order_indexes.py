@@ -0,0 +1,38 @@
+from flask import Flask
+from models import db
+from sqlalchemy import text
+
+app = Flask(__name__)
+app.config['SQLALCHEMY_DATABASE_URI'] = 'mysql+pymysql://root:@localhost/kukuhub'
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+db.init_app(app)
+
+# (index name, column list) - must match Order.__table_args__ in models.py
+ORDER_INDEXES = [
+    ('ix_orders_created', 'created_at'),
+    ('ix_orders_status_created', 'status, created_at'),
+    ('ix_orders_user_created', 'user_id, created_at'),
+]
+
+def add_order_indexes():
+    """Add the order listing indexes to an existing orders table"""
+    with app.app_context():
+        with db.engine.connect() as conn:
+            for name, columns in ORDER_INDEXES:
+                try:
+                    result = conn.execute(text("SHOW INDEX FROM orders WHERE Key_name = :name"), {'name': name})
+                    if result.fetchone():
+                        print(f"Index '{name}' already exists on orders table")
+                        continue
+                    
+                    conn.execute(text(f"CREATE INDEX {name} ON orders ({columns})"))
+                    conn.commit()
+                    print(f"Added '{name}' index to orders table")
+                except Exception as e:
+                    print(f"Error adding '{name}' index: {e}")
+        
+        print("Database migration completed!")
+
+if __name__ == '__main__':
+    add_order_indexes()
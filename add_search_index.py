@@ -0,0 +1,36 @@
+from flask import Flask
+from models import db
+from sqlalchemy import text
+
+app = Flask(__name__)
+app.config['SQLALCHEMY_DATABASE_URI'] = 'mysql+pymysql://root:@localhost/kukuhub'
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+db.init_app(app)
+
+# Must match the ft_products_search index in Product.__table_args__ and
+# SEARCH_COLUMNS in search.py
+SEARCH_INDEX = ('ft_products_search', 'name, description, category')
+
+def add_search_index():
+    """Add the product search FULLTEXT index to an existing products table"""
+    name, columns = SEARCH_INDEX
+    with app.app_context():
+        with db.engine.connect() as conn:
+            try:
+                result = conn.execute(text("SHOW INDEX FROM products WHERE Key_name = :name"), {'name': name})
+                if result.fetchone():
+                    print(f"Index '{name}' already exists on products table")
+                else:
+                    # Builds the index over every existing product; can take a
+                    # while on a large catalogue
+                    conn.execute(text(f"CREATE FULLTEXT INDEX {name} ON products ({columns})"))
+                    conn.commit()
+                    print(f"Added '{name}' index to products table")
+            except Exception as e:
+                print(f"Error adding '{name}' index: {e}")
+        
+        print("Database migration completed!")
+
+if __name__ == '__main__':
+    add_search_index()
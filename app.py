@@ -1,29 +1,128 @@
-from flask import Flask, request, jsonify, session
+from flask import Flask, Response, request, jsonify, session, stream_with_context
 from flask_cors import CORS
 from models import db, User, SellerProfile, AdminProfile, Product, Message, CartItem, Order, OrderItem
-from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime
+from datetime import datetime, timedelta
 import os
-from app_auth import check_admin_auth, check_seller_auth
+from app_auth import check_admin_auth, check_seller_auth, current_admin, current_seller, current_seller_id, admin_required, seller_required
+from cart import CartConflict, apply_cart_ops, empty_cart, get_cart_version, sync_cart
+from catalog import catalog_query, list_products, get_catalog_product, get_cart_items, seller_name
+from compression import init_compression
+from conditional import catalog_conditional, catalog_response
+from credentials import CredentialsBusy, check_password, hash_password, init_credentials
+from events import buyer_channel, event_stream, init_events, publish, seller_channel, subscribe, unsubscribe
+from images import queue_variants
+from inbox import buyer_inbox_changes, buyer_inbox_page, change_token
+from inventory import StockError, reserve_stock, with_deadlock_retry
+from media import MediaError, MediaRequest, acquire, media_url, release, store_upload
+from orders import admin_orders_page, change_order_status, user_orders_page
+from pagination import MAX_PAGE_SIZE, PaginationError, parse_limit
+from payments import init_payments
+from cache import cache, init_cache
+from reports import category_sales, record_order, sales_report, top_sellers, user_report
+from search import SearchError, search_products, search_terms, suggest_products
+from serializers import ADMIN_ORDER, ORDER, ORDER_ITEM, PRODUCT, SELLER, SELLER_MESSAGE, BUYER_MESSAGE, USER, json_response
+from sessions import init_sessions
+from videos import MAX_CHUNK_SIZE
+from routes.media_files import media_routes
 from routes.mpesa import mpesa_routes
+from routes.video_uploads import video_upload_routes
 import uuid
 
 app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'mysql+pymysql://root:@localhost/kukuhub'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'mysql+pymysql://root:@localhost/kukuhub')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.secret_key = 'your_secret_key'  # Change this to a secure key in production
+app.secret_key = os.environ.get('SECRET_KEY', 'your_secret_key')  # Set SECRET_KEY in production
+# Sessions are kept server side (sessions.py) - in the sessions table, or in
+# a local Redis-compatible server when SESSION_REDIS_URL is set. The cookie
+# only carries a random token. A session ends after SESSION_IDLE_TIMEOUT
+# without requests; activity extends it, written at most once per
+# SESSION_TOUCH_INTERVAL.
+app.config['SESSION_REDIS_URL'] = os.environ.get('SESSION_REDIS_URL')
+app.config['SESSION_IDLE_TIMEOUT'] = timedelta(days=7)
+app.config['SESSION_TOUCH_INTERVAL'] = timedelta(minutes=5)
+# Seconds a resolved seller/admin profile is reused across requests (0 disables).
+# Local profile updates evict the entry immediately; other workers may see the
+# old profile for at most this long.
+app.config['AUTH_CACHE_TTL'] = 30
+# Shared cache for expensive read-mostly data: in-process LRU by default, or
+# a local Redis-compatible server (shared by all workers) when a URL is set
+app.config['CACHE_REDIS_URL'] = os.environ.get('CACHE_REDIS_URL')
+app.config['CACHE_MAX_ENTRIES'] = 1024
+# Dashboard counts are fresh for DASHBOARD_STATS_TTL seconds, then served
+# stale for up to DASHBOARD_STATS_STALE_TTL more while they are recomputed
+app.config['DASHBOARD_STATS_TTL'] = 30
+app.config['DASHBOARD_STATS_STALE_TTL'] = 300
+# Message events are fanned out in-process; set a Redis-compatible URL to
+# relay them between workers
+app.config['EVENTS_REDIS_URL'] = os.environ.get('EVENTS_REDIS_URL')
+# Stored M-Pesa callbacks are applied this many per transaction; the consumer
+# also polls every MPESA_CALLBACK_POLL_INTERVAL seconds for ones stored by
+# other workers
+app.config['MPESA_CALLBACK_BATCH_SIZE'] = 100
+app.config['MPESA_CALLBACK_POLL_INTERVAL'] = 1.0
+# The consumer starts with the first request a worker serves; set
+# MPESA_CALLBACK_CONSUMER=0 for workers that should never run it
+app.config['MPESA_CALLBACK_CONSUMER'] = os.environ.get('MPESA_CALLBACK_CONSUMER', '1') != '0'
 
 # Configure upload folder for product images
 UPLOAD_FOLDER = 'static/uploads'
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Uploaded files are spooled straight into the content-addressed media store
+app.request_class = MediaRequest
+app.config['MEDIA_MAX_IMAGE_BYTES'] = 10 * 1024 * 1024
+# Videos arrive in chunks through /api/uploads/video
+app.config['MEDIA_MAX_VIDEO_BYTES'] = 500 * 1024 * 1024
+# Largest request body accepted: an image or one video chunk, plus room for
+# form fields. Bigger requests are refused with a 413 before being read.
+app.config['MAX_CONTENT_LENGTH'] = max(app.config['MEDIA_MAX_IMAGE_BYTES'], MAX_CHUNK_SIZE) + 1024 * 1024
+# Uploads are served from /static/uploads by routes/media_files.py. Set
+# MEDIA_SENDFILE to 'x-sendfile' (Apache, lighttpd) or 'x-accel-redirect'
+# (nginx, with an internal location at MEDIA_ACCEL_PREFIX aliased to the
+# upload folder) to let the fronting server send the bytes.
+app.config['MEDIA_SENDFILE'] = os.environ.get('MEDIA_SENDFILE')
+app.config['MEDIA_ACCEL_PREFIX'] = os.environ.get('MEDIA_ACCEL_PREFIX', '/protected-media/')
+
+# JSON and text responses of at least COMPRESS_MIN_SIZE bytes are gzip or
+# (with the brotli package installed) brotli encoded
+app.config['COMPRESS_MIN_SIZE'] = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+app.config['COMPRESS_LEVEL'] = 6
+app.config['COMPRESS_BROTLI_QUALITY'] = 5
+
+# Part of every catalogue ETag; change it when the product payload format
+# changes so clients don't revalidate old bodies against new code
+app.config['CATALOG_ETAG_SALT'] = 'c1'
+
+# Passwords are hashed with PASSWORD_HASH_METHOD (a Werkzeug method string,
+# e.g. 'scrypt' or 'pbkdf2:sha256:600000'); existing hashes are upgraded at
+# the owner's next login. Checks run on CREDENTIALS_WORKERS threads (default
+# half the cores) with at most CREDENTIALS_MAX_PENDING running or queued; a
+# login waiting longer than CREDENTIALS_WAIT seconds for a slot gets a 503.
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
+app.config['PASSWORD_SALT_LENGTH'] = 16
+app.config['CREDENTIALS_WORKERS'] = int(os.environ.get('CREDENTIALS_WORKERS', 0)) or None
+app.config['CREDENTIALS_MAX_PENDING'] = 32
+app.config['CREDENTIALS_WAIT'] = 2.0
 
 CORS(app, supports_credentials=True)
 db.init_app(app)
+init_cache(app)
+init_sessions(app)
+init_compression(app)
+init_credentials(app)
+init_events(app)
+init_payments(app)
 
 # Register blueprints
+app.register_blueprint(media_routes, url_prefix='/static/uploads')
 app.register_blueprint(mpesa_routes, url_prefix='/api/mpesa')
+app.register_blueprint(video_upload_routes, url_prefix='/api/uploads/video')
+
+@app.errorhandler(413)
+def request_too_large(e):
+    """Request bodies over MAX_CONTENT_LENGTH and files over their limit"""
+    return jsonify({'success': False, 'message': e.description}), 413
 
 # User registration and authentication routes
 @app.route('/api/register', methods=['POST'])
@@ -37,7 +136,7 @@ def register():
     
     try:
         # Create new buyer user
-        hashed_password = generate_password_hash(data['password'])
+        hashed_password = hash_password(data['password'])
         new_user = User(
             username=data['username'],
             email=data['email'],
@@ -62,7 +161,12 @@ def login():
     # Find user (buyer) by email
     user = User.query.filter_by(email=data['email']).first()
     
-    if not user or not check_password_hash(user.password_hash, data['password']):
+    try:
+        valid = check_password(user, data['password'])
+    except CredentialsBusy as e:
+        return jsonify({'success': False, 'message': str(e)}), 503
+    
+    if not valid:
         return jsonify({'success': False, 'message': 'Invalid credentials'})
     
     # Set session data for the user
@@ -110,7 +214,7 @@ def seller_register():
     
     try:
         # Create new seller directly in SellerProfile
-        hashed_password = generate_password_hash(data['password'])
+        hashed_password = hash_password(data['password'])
         new_seller = SellerProfile(
             username=data['username'],
             email=data['email'],
@@ -138,11 +242,21 @@ def seller_login():
     # Find seller by email
     seller = SellerProfile.query.filter_by(email=data['email']).first()
     
-    if not seller or not check_password_hash(seller.password_hash, data['password']):
+    try:
+        valid = check_password(seller, data['password'])
+    except CredentialsBusy as e:
+        return jsonify({'success': False, 'message': str(e)}), 503
+    
+    if not valid:
         return jsonify({'success': False, 'message': 'Invalid credentials'})
     
-    # Set session data for the seller
+    if seller.approval_status == 'rejected':
+        return jsonify({'success': False, 'message': 'Your seller account has been rejected'})
+    
+    # Set session data for the seller; the approval status is kept in the
+    # session record so auth checks need no profile lookup
     session['seller_id'] = seller.seller_id
+    session['approval_status'] = seller.approval_status
     session.permanent = True  # Make session permanent
     
     return jsonify({
@@ -157,19 +271,16 @@ def seller_login():
 
 @app.route('/api/seller/check-auth', methods=['GET'])
 def seller_auth_check():
-    if 'seller_id' in session:
-        seller_id = session['seller_id']
-        seller = SellerProfile.query.get(seller_id)
-        
-        if seller:
-            return jsonify({
-                'isAuthenticated': True,
-                'seller_id': seller.seller_id,
-                'username': seller.username,
-                'email': seller.email,
-                'business_name': seller.business_name,
-                'approval_status': seller.approval_status
-            })
+    seller = current_seller()
+    if seller:
+        return jsonify({
+            'isAuthenticated': True,
+            'seller_id': seller.seller_id,
+            'username': seller.username,
+            'email': seller.email,
+            'business_name': seller.business_name,
+            'approval_status': seller.approval_status
+        })
     
     return jsonify({'isAuthenticated': False})
 
@@ -181,7 +292,12 @@ def admin_login():
     # Find admin by email
     admin = AdminProfile.query.filter_by(email=data['email']).first()
     
-    if not admin or not check_password_hash(admin.password_hash, data['password']):
+    try:
+        valid = check_password(admin, data['password'])
+    except CredentialsBusy as e:
+        return jsonify({'success': False, 'message': str(e)}), 503
+    
+    if not valid:
         return jsonify({'success': False, 'message': 'Invalid admin credentials'})
     
     # Set session data for the admin
@@ -202,135 +318,65 @@ def admin_auth_check():
     return check_admin_auth()
 
 @app.route('/api/admin/dashboard-stats', methods=['GET'])
+@admin_required
 def admin_dashboard_stats():
     """Get dashboard statistics for admin"""
-    # First check if admin is authenticated
-    auth_check = check_admin_auth()
-    auth_data = auth_check.get_json()
-    
-    if not auth_data.get('isAuthenticated'):
-        return jsonify({'success': False, 'message': 'Admin not authenticated'})
-    
     try:
-        # Get real counts from database
-        total_products = Product.query.count()
-        total_users = User.query.count()
-        total_sellers = SellerProfile.query.count()
-        total_orders = Order.query.count()
-        total_messages = Message.query.count()
+        # Counts are cached and refreshed in the background once stale, so
+        # dashboard polling does not run five COUNT(*) scans every time
+        stats = cache.get_or_load(
+            'admin:dashboard-stats',
+            _load_dashboard_stats,
+            ttl=app.config['DASHBOARD_STATS_TTL'],
+            stale_ttl=app.config['DASHBOARD_STATS_STALE_TTL'],
+            app=app
+        )
         
         return jsonify({
             'success': True,
-            'stats': {
-                'totalUsers': total_users,
-                'totalSellers': total_sellers,
-                'totalProducts': total_products,
-                'totalOrders': total_orders,
-                'totalMessages': total_messages
-            }
+            'stats': stats
         })
     
     except Exception as e:
         print(f"Error fetching dashboard stats: {str(e)}")
         return jsonify({'success': False, 'message': f'Error fetching dashboard statistics: {str(e)}'})
 
+def _load_dashboard_stats():
+    # Get real counts from database
+    return {
+        'totalUsers': User.query.count(),
+        'totalSellers': SellerProfile.query.count(),
+        'totalProducts': Product.query.count(),
+        'totalOrders': Order.query.count(),
+        'totalMessages': Message.query.count()
+    }
+
+@app.route('/api/admin/cache-stats', methods=['GET'])
+@admin_required
+def admin_cache_stats():
+    """Hit/miss counters for the shared cache"""
+    return jsonify({
+        'success': True,
+        'cache': cache.stats()
+    })
+
 @app.route('/api/admin/reports/data', methods=['GET'])
+@admin_required
 def admin_reports_data():
     """Get comprehensive report data for admin"""
-    # First check if admin is authenticated
-    auth_check = check_admin_auth()
-    auth_data = auth_check.get_json()
-    
-    if not auth_data.get('isAuthenticated'):
-        return jsonify({'success': False, 'message': 'Admin not authenticated'})
-    
     try:
-        # Sales Report Data
-        total_orders = Order.query.count()
-        total_sales = db.session.query(db.func.sum(Order.total)).scalar() or 0
+        # Sales and user figures come from the daily rollup tables. Sales
+        # totals leave out Cancelled orders (see reports.py).
+        total_orders, total_sales, monthly_sales_data = sales_report()
         avg_order_value = total_sales / total_orders if total_orders > 0 else 0
         
-        # Monthly sales data (last 6 months)
-        monthly_sales = db.session.query(
-            db.func.date_format(Order.created_at, '%b').label('month'),
-            db.func.sum(Order.total).label('sales'),
-            db.func.count(Order.order_id).label('orders')
-        ).filter(
-            Order.created_at >= db.func.date_sub(db.func.now(), db.text('INTERVAL 6 MONTH'))
-        ).group_by(
-            db.func.date_format(Order.created_at, '%Y-%m')
-        ).order_by(
-            db.func.date_format(Order.created_at, '%Y-%m')
-        ).all()
-        
-        monthly_sales_data = [
-            {
-                'month': sale.month,
-                'sales': float(sale.sales) if sale.sales else 0,
-                'orders': sale.orders
-            } for sale in monthly_sales
-        ]
-        
-        # User Report Data
-        total_users = User.query.count()
-        total_sellers = SellerProfile.query.count()
-        new_users_this_month = User.query.filter(
-            User.created_at >= db.func.date_sub(db.func.now(), db.text('INTERVAL 1 MONTH'))
-        ).count()
-        
-        # User growth data (last 6 months)
-        user_growth = db.session.query(
-            db.func.date_format(User.created_at, '%b').label('month'),
-            db.func.count(User.user_id).label('users')
-        ).filter(
-            User.created_at >= db.func.date_sub(db.func.now(), db.text('INTERVAL 6 MONTH'))
-        ).group_by(
-            db.func.date_format(User.created_at, '%Y-%m')
-        ).order_by(
-            db.func.date_format(User.created_at, '%Y-%m')
-        ).all()
-        
-        seller_growth = db.session.query(
-            db.func.date_format(SellerProfile.created_at, '%b').label('month'),
-            db.func.count(SellerProfile.seller_id).label('sellers')
-        ).filter(
-            SellerProfile.created_at >= db.func.date_sub(db.func.now(), db.text('INTERVAL 6 MONTH'))
-        ).group_by(
-            db.func.date_format(SellerProfile.created_at, '%Y-%m')
-        ).order_by(
-            db.func.date_format(SellerProfile.created_at, '%Y-%m')
-        ).all()
-        
-        # Combine user and seller growth data
-        growth_dict = {}
-        for user in user_growth:
-            growth_dict[user.month] = {'month': user.month, 'users': user.users, 'sellers': 0}
-        
-        for seller in seller_growth:
-            if seller.month in growth_dict:
-                growth_dict[seller.month]['sellers'] = seller.sellers
-            else:
-                growth_dict[seller.month] = {'month': seller.month, 'users': 0, 'sellers': seller.sellers}
-        
-        user_growth_data = list(growth_dict.values())
+        total_users, total_sellers, new_users_this_month, user_growth_data = user_report()
         
         # Product Report Data
         total_products = Product.query.count()
-        
-        # Category distribution
-        category_data = db.session.query(
-            Product.category,
-            db.func.count(Product.product_id).label('count')
-        ).group_by(Product.category).all()
-        
-        total_category_products = sum([cat.count for cat in category_data])
-        top_categories = [
-            {
-                'category': cat.category,
-                'count': cat.count,
-                'percentage': round((cat.count / total_category_products) * 100) if total_category_products > 0 else 0
-            } for cat in category_data
-        ]
+        # Categories by units sold, from the per-category daily rollup; their
+        # 'count' is units sold and 'percentage' their share of all units
+        top_categories = category_sales()
         
         # Low stock products (stock <= 10)
         low_stock_products = Product.query.filter(Product.stock <= 10).limit(10).all()
@@ -343,37 +389,23 @@ def admin_reports_data():
         ]
         
         # Seller Report Data
-        active_sellers = SellerProfile.query.filter_by(approval_status='approved').count()
-        pending_sellers = SellerProfile.query.filter_by(approval_status='pending').count()
-        
-        # Top sellers by order value
-        top_sellers_query = db.session.query(
-            SellerProfile.business_name,
-            db.func.sum(Order.total).label('total_sales'),
-            db.func.count(Product.product_id).label('product_count')
-        ).join(
-            Product, Product.seller_id == SellerProfile.seller_id
-        ).join(
-            OrderItem, OrderItem.product_id == Product.product_id
-        ).join(
-            Order, Order.order_id == OrderItem.order_id
-        ).group_by(
-            SellerProfile.seller_id
-        ).order_by(
-            db.func.sum(Order.total).desc()
-        ).limit(5).all()
-        
-        top_sellers_data = [
-            {
-                'name': seller.business_name,
-                'sales': float(seller.total_sales) if seller.total_sales else 0,
-                'products': seller.product_count
-            } for seller in top_sellers_query
-        ]
+        approval_counts = dict(db.session.query(
+            SellerProfile.approval_status,
+            db.func.count(SellerProfile.seller_id)
+        ).group_by(SellerProfile.approval_status).all())
+        active_sellers = approval_counts.get('approved', 0)
+        pending_sellers = approval_counts.get('pending', 0)
+        
+        # Top sellers by revenue, from the per-seller daily rollup; their
+        # 'products' figure is the number of units sold
+        top_sellers_data = top_sellers()
         
         # System Report Data
-        total_messages = Message.query.count()
-        unread_messages = Message.query.filter_by(is_read=False).count()
+        total_messages, unread_messages = db.session.query(
+            db.func.count(Message.message_id),
+            db.func.sum(db.case((Message.is_read == False, 1), else_=0))
+        ).one()
+        unread_messages = int(unread_messages or 0)
         
         # Recent activity (last 10 activities)
         recent_users = User.query.order_by(User.created_at.desc()).limit(3).all()
@@ -453,48 +485,18 @@ def admin_reports_data():
         return jsonify({'success': False, 'message': f'Error fetching report data: {str(e)}'})
 
 @app.route('/api/admin/users', methods=['GET'])
+@admin_required
 def admin_get_users():
     """Get all users and sellers for admin"""
-    # First check if admin is authenticated
-    auth_check = check_admin_auth()
-    auth_data = auth_check.get_json()
-    
-    if not auth_data.get('isAuthenticated'):
-        return jsonify({'success': False, 'message': 'Admin not authenticated'})
-    
     try:
-        # Get all buyers (users)
-        users = User.query.all()
-        user_list = []
+        # Only the listed columns are read - no password hashes
+        users = db.session.query(*USER.columns).all()
+        sellers = db.session.query(*SELLER.columns).all()
         
-        for user in users:
-            user_list.append({
-                'user_id': user.user_id,
-                'username': user.username,
-                'email': user.email,
-                'phone_number': user.phone_number,
-                'created_at': user.created_at.isoformat()
-            })
-        
-        # Get all sellers
-        sellers = SellerProfile.query.all()
-        seller_list = []
-        
-        for seller in sellers:
-            seller_list.append({
-                'seller_id': seller.seller_id,
-                'username': seller.username,
-                'email': seller.email,
-                'business_name': seller.business_name,
-                'approval_status': seller.approval_status,
-                'phone_number': seller.phone_number,
-                'created_at': seller.created_at.isoformat()
-            })
-        
-        return jsonify({
+        return json_response({
             'success': True,
-            'users': user_list,
-            'sellers': seller_list
+            'users': USER.dump_rows(users),
+            'sellers': SELLER.dump_rows(sellers)
         })
     
     except Exception as e:
@@ -502,70 +504,93 @@ def admin_get_users():
         return jsonify({'success': False, 'message': f'Error fetching users: {str(e)}'})
 
 @app.route('/api/admin/orders', methods=['GET'])
+@admin_required
 def admin_get_orders():
-    """Get all orders for admin"""
-    # First check if admin is authenticated
-    auth_check = check_admin_auth()
-    auth_data = auth_check.get_json()
-    
-    if not auth_data.get('isAuthenticated'):
-        return jsonify({'success': False, 'message': 'Admin not authenticated'})
+    """Get a page of orders for admin
     
+    Query parameters: status, from and to (ISO dates, `to` inclusive),
+    page (1-based) and pageSize.
+    """
     try:
-        orders = Order.query.order_by(Order.created_at.desc()).all()
+        args = request.args
+        page = max(1, args.get('page', 1, type=int))
+        page_size = parse_limit(args.get('pageSize'), maximum=200)
+        
+        date_from = datetime.fromisoformat(args['from']) if args.get('from') else None
+        date_to = None
+        if args.get('to'):
+            date_to = datetime.fromisoformat(args['to'])
+            # A bare date means "up to the end of that day"
+            if len(args['to']) == 10:
+                date_to += timedelta(days=1)
+        
+        # Buyers, items and products are bulk-loaded with the page
+        orders, total = admin_orders_page(
+            status=args.get('status') or None,
+            date_from=date_from,
+            date_to=date_to,
+            page=page,
+            page_size=page_size
+        )
         order_list = []
         
         for order in orders:
-            # Get user info
-            user = User.query.get(order.user_id)
-            user_name = user.username if user else "Unknown User"
-            user_email = user.email if user else "Unknown Email"
-            
-            # Get order items
-            order_items = OrderItem.query.filter_by(order_id=order.order_id).all()
-            items = []
-            
-            for item in order_items:
-                product = Product.query.get(item.product_id)
-                if product:
-                    items.append({
-                        'id': str(product.product_id),
-                        'name': product.name,
-                        'price': item.price,
-                        'quantity': item.quantity
-                    })
-            
-            order_list.append({
-                'id': str(order.order_id),
-                'user_name': user_name,
-                'user_email': user_email,
-                'items': items,
-                'total': order.total,
-                'status': order.status,
-                'created_at': order.created_at.isoformat()
-            })
+            data = ADMIN_ORDER.dump(order)
+            data['items'] = ORDER_ITEM.dump_many(item for item in order.items if item.product)
+            order_list.append(data)
         
-        return jsonify({
+        return json_response({
             'success': True,
-            'orders': order_list
+            'orders': order_list,
+            'total': total,
+            'page': page,
+            'pageSize': page_size
         })
     
+    except (PaginationError, ValueError) as e:
+        return jsonify({'success': False, 'message': f'Invalid order filter: {str(e)}'})
     except Exception as e:
         print(f"Error fetching orders: {str(e)}")
         return jsonify({'success': False, 'message': f'Error fetching orders: {str(e)}'})
 
+@app.route('/api/admin/sellers/<int:seller_id>/approval', methods=['PUT'])
+@admin_required
+def admin_set_seller_approval(seller_id):
+    """Approve or reject a seller
+    
+    Body: {"status": "approved" | "rejected" | "pending"}. Rejecting a
+    seller logs them out of every session.
+    """
+    try:
+        status = (request.json or {}).get('status')
+        if status not in ('approved', 'rejected', 'pending'):
+            return jsonify({'success': False, 'message': 'Status must be approved, rejected or pending'})
+        
+        seller = SellerProfile.query.get(seller_id)
+        if not seller:
+            return jsonify({'success': False, 'message': 'Seller not found'})
+        
+        # The seller's sessions are revoked or updated once this commits
+        seller.approval_status = status
+        db.session.commit()
+        
+        return jsonify({
+            'success': True,
+            'message': f'Seller {status}',
+            'approval_status': status
+        })
+    
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error updating seller approval: {str(e)}")
+        return jsonify({'success': False, 'message': f'Error updating seller approval: {str(e)}'})
+
 @app.route('/api/admin/update-profile', methods=['PUT'])
+@admin_required
 def update_admin_profile():
     """Update admin profile information"""
-    # First check if admin is authenticated
-    auth_check = check_admin_auth()
-    auth_data = auth_check.get_json()
-    
-    if not auth_data.get('isAuthenticated'):
-        return jsonify({'success': False, 'message': 'Admin not authenticated'})
-    
     try:
-        admin_id = auth_data.get('admin_id')
+        admin_id = current_admin().admin_id
         admin = AdminProfile.query.get(admin_id)
         
         if not admin:
@@ -594,21 +619,17 @@ def update_admin_profile():
         return jsonify({'success': False, 'message': f'Update failed: {str(e)}'})
 
 @app.route('/api/admin/products/<product_id>', methods=['DELETE'])
+@admin_required
 def admin_delete_product(product_id):
     """Admin delete a product"""
-    # First check if admin is authenticated
-    auth_check = check_admin_auth()
-    auth_data = auth_check.get_json()
-    
-    if not auth_data.get('isAuthenticated'):
-        return jsonify({'success': False, 'message': 'Admin not authenticated'})
-    
     try:
         product = Product.query.get(product_id)
         
         if not product:
             return jsonify({'success': False, 'message': 'Product not found'})
         
+        release(product.image_url)
+        release(product.video_url)
         db.session.delete(product)
         db.session.commit()
         
@@ -624,67 +645,134 @@ def admin_delete_product(product_id):
 
 # Product routes
 @app.route('/api/products', methods=['GET'])
+@catalog_conditional()
 def get_products():
-    """Get all products for public viewing"""
+    """Get a page of products for public viewing
+    
+    Query parameters: category, minPrice, maxPrice, sellerId, inStock,
+    sort (newest, oldest, price_asc, price_desc), limit and cursor (the
+    nextCursor value returned with the previous page).
+    """
     try:
-        products = Product.query.all()
-        product_list = []
-        
-        for product in products:
-            # Get seller info
-            seller = SellerProfile.query.get(product.seller_id)
-            seller_name = seller.business_name if seller else "Unknown Seller"
-            
-            product_list.append({
-                'id': str(product.product_id),
-                'name': product.name,
-                'description': product.description,
-                'price': product.price,
-                'stock': product.stock,
-                'category': product.category,
-                'image': product.image_url,
-                'sellerId': str(product.seller_id),
-                'sellerName': seller_name,
-                'createdAt': product.created_at.isoformat()
-            })
+        args = request.args
+        min_price = args.get('minPrice', type=float)
+        max_price = args.get('maxPrice', type=float)
+        seller_id = args.get('sellerId', type=int)
+        in_stock = args.get('inStock', '').lower() in ('1', 'true', 'yes')
+        
+        # Only the payload's columns are read, with sellers joined in
+        products, next_cursor = list_products(
+            category=args.get('category') or None,
+            min_price=min_price,
+            max_price=max_price,
+            seller_id=seller_id,
+            in_stock=in_stock,
+            sort=args.get('sort', 'newest'),
+            cursor=args.get('cursor'),
+            limit=parse_limit(args.get('limit')),
+            columns=PRODUCT.columns
+        )
         
-        return jsonify({
+        return catalog_response({
             'success': True,
-            'products': product_list
+            'products': PRODUCT.dump_rows(products),
+            'nextCursor': next_cursor
         })
     
+    except PaginationError as e:
+        return jsonify({'success': False, 'message': str(e)})
     except Exception as e:
         print(f"Error fetching products: {str(e)}")
         return jsonify({'success': False, 'message': f'Error fetching products: {str(e)}'})
 
+@app.route('/api/products/search', methods=['GET'])
+@catalog_conditional()
+def search_products_route():
+    """Search products by name, description and category
+    
+    Query parameters: q (the search text), sort (relevance - the default -
+    or any /api/products sort option), plus the /api/products filters,
+    limit and cursor.
+    """
+    try:
+        args = request.args
+        min_price = args.get('minPrice', type=float)
+        max_price = args.get('maxPrice', type=float)
+        seller_id = args.get('sellerId', type=int)
+        in_stock = args.get('inStock', '').lower() in ('1', 'true', 'yes')
+        
+        products, next_cursor = search_products(
+            args.get('q', ''),
+            category=args.get('category') or None,
+            min_price=min_price,
+            max_price=max_price,
+            seller_id=seller_id,
+            in_stock=in_stock,
+            sort=args.get('sort', 'relevance'),
+            cursor=args.get('cursor'),
+            limit=parse_limit(args.get('limit')),
+            columns=PRODUCT.columns
+        )
+        
+        return catalog_response({
+            'success': True,
+            'products': PRODUCT.dump_rows(products),
+            'nextCursor': next_cursor
+        })
+    
+    except (SearchError, PaginationError) as e:
+        return jsonify({'success': False, 'message': str(e)})
+    except Exception as e:
+        print(f"Error searching products: {str(e)}")
+        return jsonify({'success': False, 'message': f'Error searching products: {str(e)}'})
+
+@app.route('/api/products/suggest', methods=['GET'])
+def suggest_products_route():
+    """Autocomplete: product names matching the words typed so far
+    
+    Query parameters: q, optional category and limit (at most 20).
+    """
+    try:
+        args = request.args
+        if not search_terms(args.get('q')):
+            return jsonify({'success': True, 'suggestions': []})
+        
+        rows = suggest_products(
+            args.get('q'),
+            category=args.get('category') or None,
+            limit=parse_limit(args.get('limit'), default=10, maximum=20)
+        )
+        
+        return jsonify({
+            'success': True,
+            'suggestions': [
+                {'id': str(product_id), 'name': name, 'category': category}
+                for product_id, name, category in rows
+            ]
+        })
+    
+    except PaginationError as e:
+        return jsonify({'success': False, 'message': str(e)})
+    except Exception as e:
+        print(f"Error suggesting products: {str(e)}")
+        return jsonify({'success': False, 'message': f'Error suggesting products: {str(e)}'})
+
 @app.route('/api/products/<product_id>', methods=['GET'])
+@catalog_conditional()
 def get_product(product_id):
     """Get a specific product by ID"""
     try:
-        product = Product.query.get(product_id)
+        product = get_catalog_product(product_id)
         
         if not product:
             return jsonify({'success': False, 'message': 'Product not found'})
         
-        # Get seller info
-        seller = SellerProfile.query.get(product.seller_id)
-        seller_name = seller.business_name if seller else "Unknown Seller"
-        
-        product_data = {
-            'id': str(product.product_id),
-            'name': product.name,
-            'description': product.description,
-            'price': product.price,
-            'stock': product.stock,
-            'category': product.category,
-            'image': product.image_url,
-            'sellerId': str(product.seller_id),
-            'sellerName': seller_name,
-            'sellerEmail': seller.email if seller else None,
-            'createdAt': product.created_at.isoformat()
-        }
+        seller = product.seller
         
-        return jsonify({
+        product_data = PRODUCT.dump(product)
+        product_data['sellerEmail'] = seller.email if seller else None
+        
+        return catalog_response({
             'success': True,
             'product': product_data
         })
@@ -694,37 +782,17 @@ def get_product(product_id):
         return jsonify({'success': False, 'message': f'Error fetching product: {str(e)}'})
 
 @app.route('/api/seller/products', methods=['GET'])
+@seller_required
+@catalog_conditional(scope=lambda: str(current_seller_id()))
 def get_seller_products():
     """Get products for the authenticated seller"""
-    # First check if seller is authenticated
-    auth_check = check_seller_auth()
-    auth_data = auth_check.get_json()
-    
-    if not auth_data.get('isAuthenticated'):
-        return jsonify({'success': False, 'message': 'Seller not authenticated'})
-    
     try:
-        seller_id = auth_data.get('seller_id')
-        products = Product.query.filter_by(seller_id=seller_id).all()
-        product_list = []
-        
-        for product in products:
-            product_list.append({
-                'id': str(product.product_id),
-                'name': product.name,
-                'description': product.description,
-                'price': product.price,
-                'stock': product.stock,
-                'category': product.category,
-                'image': product.image_url,
-                'sellerId': str(product.seller_id),
-                'sellerName': auth_data.get('business_name'),
-                'createdAt': product.created_at.isoformat()
-            })
+        seller_id = current_seller_id()
+        rows = catalog_query(PRODUCT.columns).filter(Product.seller_id == seller_id).all()
         
-        return jsonify({
+        return catalog_response({
             'success': True,
-            'products': product_list
+            'products': PRODUCT.dump_rows(rows)
         })
     
     except Exception as e:
@@ -732,15 +800,9 @@ def get_seller_products():
         return jsonify({'success': False, 'message': f'Error fetching products: {str(e)}'})
 
 @app.route('/api/products/create', methods=['POST'])
+@seller_required
 def add_product():
     """Add a new product (seller only)"""
-    # First check if seller is authenticated
-    auth_check = check_seller_auth()
-    auth_data = auth_check.get_json()
-    
-    if not auth_data.get('isAuthenticated'):
-        return jsonify({'success': False, 'message': 'Seller not authenticated'})
-    
     try:
         # Check if we have form data (multipart/form-data) or JSON
         if request.form:
@@ -749,25 +811,15 @@ def add_product():
             price = float(request.form.get('price', 0))
             stock = int(request.form.get('stock', 0))
             category = request.form.get('category')
-            seller_id = auth_data.get('seller_id')
+            seller_id = current_seller_id()
             
             # Handle image upload
             image_url = None
             if 'image' in request.files:
                 file = request.files['image']
                 if file and file.filename != '':
-                    # Generate unique filename
-                    filename = f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{file.filename}"
-                    file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                    
-                    # Ensure directory exists
-                    os.makedirs(os.path.dirname(file_path), exist_ok=True)
-                    
-                    # Save file
-                    file.save(file_path)
-                    
-                    # Generate URL
-                    image_url = f"/static/uploads/{filename}"
+                    blob = store_upload(file, app.config['MEDIA_MAX_IMAGE_BYTES'])
+                    image_url = media_url(blob)
             
             # Create new product
             new_product = Product(
@@ -782,7 +834,7 @@ def add_product():
         else:
             # Handle JSON data
             data = request.json
-            seller_id = auth_data.get('seller_id')
+            seller_id = current_seller_id()
             
             # Create new product
             new_product = Product(
@@ -795,8 +847,10 @@ def add_product():
                 seller_id=seller_id
             )
         
+        acquire(new_product.image_url)
         db.session.add(new_product)
         db.session.commit()
+        queue_variants(new_product.image_url)
         
         return jsonify({
             'success': True,
@@ -804,23 +858,20 @@ def add_product():
             'productId': new_product.product_id
         })
     
+    except MediaError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)})
     except Exception as e:
         db.session.rollback()
         print(f"Error adding product: {str(e)}")
         return jsonify({'success': False, 'message': f'Error adding product: {str(e)}'})
 
 @app.route('/api/products/<product_id>', methods=['PUT'])
+@seller_required
 def update_product(product_id):
     """Update product details (seller only)"""
-    # First check if seller is authenticated
-    auth_check = check_seller_auth()
-    auth_data = auth_check.get_json()
-    
-    if not auth_data.get('isAuthenticated'):
-        return jsonify({'success': False, 'message': 'Seller not authenticated'})
-    
     try:
-        seller_id = auth_data.get('seller_id')
+        seller_id = current_seller_id()
         product = Product.query.get(product_id)
         
         if not product:
@@ -843,8 +894,19 @@ def update_product(product_id):
             product.stock = int(data['stock'])
         if 'category' in data:
             product.category = data['category']
-        if 'image' in data and data['image']:
+        if 'image' in data and data['image'] and data['image'] != product.image_url:
+            acquire(data['image'])
+            release(product.image_url)
             product.image_url = data['image']
+        if 'video' in data and data['video'] != product.video_url:
+            # An empty value removes the video
+            acquire(data['video'])
+            release(product.video_url)
+            product.video_url = data['video'] or None
+        if product.video_url:
+            product.media_type = 'both' if product.image_url else 'video'
+        else:
+            product.media_type = 'image'
             
         product.updated_at = datetime.utcnow()
         db.session.commit()
@@ -854,23 +916,20 @@ def update_product(product_id):
             'message': 'Product updated successfully',
         })
     
+    except MediaError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)})
     except Exception as e:
         db.session.rollback()
         print(f"Error updating product: {str(e)}")
         return jsonify({'success': False, 'message': f'Error updating product: {str(e)}'})
 
 @app.route('/api/products/<product_id>', methods=['DELETE'])
+@seller_required
 def delete_product(product_id):
     """Delete a product (seller only)"""
-    # First check if seller is authenticated
-    auth_check = check_seller_auth()
-    auth_data = auth_check.get_json()
-    
-    if not auth_data.get('isAuthenticated'):
-        return jsonify({'success': False, 'message': 'Seller not authenticated'})
-    
     try:
-        seller_id = auth_data.get('seller_id')
+        seller_id = current_seller_id()
         product = Product.query.get(product_id)
         
         if not product:
@@ -880,6 +939,8 @@ def delete_product(product_id):
         if product.seller_id != int(seller_id):
             return jsonify({'success': False, 'message': 'You do not own this product'})
         
+        release(product.image_url)
+        release(product.video_url)
         db.session.delete(product)
         db.session.commit()
         
@@ -894,15 +955,9 @@ def delete_product(product_id):
         return jsonify({'success': False, 'message': f'Error deleting product: {str(e)}'})
 
 @app.route('/api/upload/product-image', methods=['POST'])
+@seller_required
 def upload_product_image():
     """Upload a product image and return the URL"""
-    # Check authentication first
-    auth_check = check_seller_auth()
-    auth_data = auth_check.get_json()
-    
-    if not auth_data.get('isAuthenticated'):
-        return jsonify({'success': False, 'message': 'Seller not authenticated'})
-    
     if 'image' not in request.files:
         return jsonify({'success': False, 'message': 'No image file provided'})
     
@@ -911,26 +966,39 @@ def upload_product_image():
         if file.filename == '':
             return jsonify({'success': False, 'message': 'No image selected'})
         
-        # Generate unique filename
-        filename = f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{file.filename}"
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        
-        # Save file
-        file.save(file_path)
-        
-        # Generate URL
-        image_url = f"/static/uploads/{filename}"
+        # Stored unreferenced until a product is saved with this URL
+        blob = store_upload(file, app.config['MEDIA_MAX_IMAGE_BYTES'])
+        db.session.commit()
+        queue_variants(media_url(blob))
         
         return jsonify({
             'success': True,
-            'imageUrl': image_url
+            'imageUrl': media_url(blob)
         })
     
+    except MediaError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)})
     except Exception as e:
+        db.session.rollback()
         print(f"Error uploading image: {str(e)}")
         return jsonify({'success': False, 'message': f'Error uploading image: {str(e)}'})
 
 # Message Endpoints
+def _seller_message_dict(msg):
+    return SELLER_MESSAGE.dump(msg)
+
+def _buyer_message_dict(msg, business_name):
+    data = BUYER_MESSAGE.dump(msg)
+    data['sellerName'] = business_name or "Unknown Seller"
+    return data
+
+def _publish_message(event, msg, business_name):
+    # Push the committed message to the seller's and the buyer's open streams
+    publish(seller_channel(msg.seller_id), event, _seller_message_dict(msg))
+    if msg.senderEmail:
+        publish(buyer_channel(msg.senderEmail), event, _buyer_message_dict(msg, business_name), change_token(msg))
+
 @app.route('/api/messages/send', methods=['POST'])
 def send_message():
     """Send a message to a seller"""
@@ -955,6 +1023,8 @@ def send_message():
         db.session.add(new_message)
         db.session.commit()
         
+        _publish_message('message', new_message, seller.business_name)
+        
         return jsonify({
             'success': True,
             'message': 'Message sent successfully',
@@ -967,31 +1037,16 @@ def send_message():
         return jsonify({'success': False, 'message': f'Error sending message: {str(e)}'})
 
 @app.route('/api/seller/messages', methods=['GET'])
+@seller_required
 def get_seller_messages():
     """Get messages for the authenticated seller"""
-    if 'seller_id' not in session:
-        return jsonify({'success': False, 'message': 'Seller not authenticated'})
-    
     try:
-        seller_id = session['seller_id']
+        seller_id = current_seller_id()
         messages = Message.query.filter_by(seller_id=seller_id).order_by(Message.created_at.desc()).all()
-        message_list = []
         
-        for msg in messages:
-            message_list.append({
-                'id': str(msg.message_id),
-                'senderName': msg.senderName,
-                'senderEmail': msg.senderEmail,
-                'content': msg.content,
-                'productName': msg.productName,
-                'createdAt': msg.created_at.isoformat(),
-                'reply': msg.reply,
-                'repliedAt': msg.replied_at.isoformat() if msg.replied_at else None
-            })
-        
-        return jsonify({
+        return json_response({
             'success': True,
-            'messages': message_list
+            'messages': SELLER_MESSAGE.dump_many(messages)
         })
     
     except Exception as e:
@@ -999,14 +1054,12 @@ def get_seller_messages():
         return jsonify({'success': False, 'message': f'Error fetching messages: {str(e)}'})
 
 @app.route('/api/messages/<message_id>/reply', methods=['POST'])
+@seller_required
 def reply_to_message(message_id):
     """Reply to a customer message"""
-    if 'seller_id' not in session:
-        return jsonify({'success': False, 'message': 'Seller not authenticated'})
-    
     try:
         data = request.json
-        seller_id = session['seller_id']
+        seller_id = current_seller_id()
         
         # Find the message
         message = Message.query.get(message_id)
@@ -1022,6 +1075,9 @@ def reply_to_message(message_id):
         message.replied_at = datetime.utcnow()
         db.session.commit()
         
+        seller = current_seller()
+        _publish_message('reply', message, seller.business_name if seller else None)
+        
         return jsonify({
             'success': True,
             'message': 'Reply sent successfully'
@@ -1034,40 +1090,96 @@ def reply_to_message(message_id):
 
 @app.route('/api/user/messages', methods=['GET'])
 def get_user_messages():
-    """Get messages for a user by email"""
+    """Get messages for a user by email
+    
+    Without `since`, returns the newest page (older pages via `cursor`).
+    Every response carries a `since` token; passing it back returns only
+    messages sent or replied to after that point, oldest change first.
+    """
     email = request.args.get('email')
     if not email:
         return jsonify({'success': False, 'message': 'Email parameter required'})
     
     try:
-        # Find messages sent by this email
-        messages = Message.query.filter_by(senderEmail=email).order_by(Message.created_at.desc()).all()
+        limit = parse_limit(request.args.get('limit'))
+        next_cursor = None
+        
+        if request.args.get('since'):
+            rows, since = buyer_inbox_changes(email, request.args['since'], limit)
+        else:
+            rows, next_cursor, since = buyer_inbox_page(email, request.args.get('cursor'), limit)
+        
         message_list = []
         
-        for msg in messages:
-            # Get seller info
-            seller = SellerProfile.query.get(msg.seller_id)
-            seller_name = seller.business_name if seller else "Unknown Seller"
-            
-            message_list.append({
-                'id': str(msg.message_id),
-                'productName': msg.productName,
-                'sellerName': seller_name,
-                'content': msg.content,
-                'reply': msg.reply,
-                'createdAt': msg.created_at.isoformat(),
-                'repliedAt': msg.replied_at.isoformat() if msg.replied_at else None
-            })
+        for msg, business_name in rows:
+            message_list.append(_buyer_message_dict(msg, business_name))
         
         return jsonify({
             'success': True,
-            'messages': message_list
+            'messages': message_list,
+            'nextCursor': next_cursor,
+            'since': since
         })
     
+    except PaginationError as e:
+        return jsonify({'success': False, 'message': str(e)})
     except Exception as e:
         print(f"Error fetching user messages: {str(e)}")
         return jsonify({'success': False, 'message': f'Error fetching user messages: {str(e)}'})
 
+def _sse_response(subscription, replay=()):
+    return Response(
+        stream_with_context(event_stream(subscription, replay)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/seller/messages/stream', methods=['GET'])
+@seller_required
+def stream_seller_messages():
+    """Server-sent events for new messages and replies in the seller's inbox"""
+    return _sse_response(subscribe(seller_channel(current_seller_id())))
+
+def _buyer_replay(email, since):
+    """Events for the changes a buyer's stream missed after `since`
+
+    Too many changes, or a token we can't read, get a single resync event
+    so the client refetches instead.
+    """
+    try:
+        rows, _ = buyer_inbox_changes(email, since, MAX_PAGE_SIZE + 1)
+    except PaginationError:
+        return [('resync', {}, None)]
+    if len(rows) > MAX_PAGE_SIZE:
+        return [('resync', {}, None)]
+    return [
+        ('reply' if msg.reply else 'message', _buyer_message_dict(msg, business_name), change_token(msg))
+        for msg, business_name in rows
+    ]
+
+@app.route('/api/user/messages/stream', methods=['GET'])
+def stream_user_messages():
+    """Server-sent events for a buyer's messages and the replies to them
+    
+    Each event's id is an inbox `since` token. The changes after the
+    reconnecting browser's Last-Event-ID (or, on the first connection, the
+    `since` returned by /api/user/messages) are replayed before live events.
+    """
+    email = request.args.get('email')
+    if not email:
+        return jsonify({'success': False, 'message': 'Email parameter required'})
+    
+    # Subscribe before reading the missed changes so nothing falls between
+    # the two; an event sent by both is applied twice, harmlessly
+    subscription = subscribe(buyer_channel(email))
+    since = request.headers.get('Last-Event-ID') or request.args.get('since')
+    try:
+        replay = _buyer_replay(email, since) if since else []
+    except Exception:
+        unsubscribe(subscription)
+        raise
+    return _sse_response(subscription, replay)
+
 # For testing
 @app.route('/api/test/users', methods=['GET'])
 def test_get_users():
@@ -1102,14 +1214,13 @@ def get_cart():
     
     try:
         user_id = session['user_id']
-        cart_items = CartItem.query.filter_by(user_id=user_id).all()
+        # Products and sellers are joined into the same query
+        cart_items = get_cart_items(user_id)
         cart = []
         
         for item in cart_items:
-            product = Product.query.get(item.product_id)
+            product = item.product
             if product:
-                seller = SellerProfile.query.get(product.seller_id)
-                
                 cart.append({
                     'id': str(product.product_id),
                     'name': product.name,
@@ -1118,13 +1229,14 @@ def get_cart():
                     'image': product.image_url,
                     'quantity': item.quantity,
                     'sellerId': str(product.seller_id),
-                    'sellerName': seller.business_name if seller else "Unknown",
+                    'sellerName': seller_name(product, "Unknown"),
                     'category': product.category
                 })
         
         return jsonify({
             'success': True,
-            'cart': cart
+            'cart': cart,
+            'version': get_cart_version(user_id)
         })
     
     except Exception as e:
@@ -1133,7 +1245,12 @@ def get_cart():
 
 @app.route('/api/cart/update', methods=['POST'])
 def update_cart():
-    """Update cart items for the authenticated user"""
+    """Replace the authenticated user's cart with a full list of items
+    
+    Only the rows that differ from the stored cart are written. Send the
+    last seen 'version' to have a stale update rejected rather than applied.
+    Items for products that don't exist are skipped and listed in 'errors'.
+    """
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'User not authenticated'})
     
@@ -1141,25 +1258,52 @@ def update_cart():
         user_id = session['user_id']
         data = request.json
         
-        # Clear existing cart items for this user
-        CartItem.query.filter_by(user_id=user_id).delete()
+        version, errors = sync_cart(user_id, data['items'], data.get('version'))
+        db.session.commit()
         
-        # Add new cart items
-        for item in data['items']:
-            cart_item = CartItem(
-                user_id=user_id,
-                product_id=int(item['id']),
-                quantity=item['quantity']
-            )
-            db.session.add(cart_item)
+        return jsonify({
+            'success': True,
+            'message': 'Cart updated successfully',
+            'version': version,
+            'errors': errors
+        })
+    
+    except CartConflict as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'conflict': True, 'version': e.version, 'message': str(e)})
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error updating cart: {str(e)}")
+        return jsonify({'success': False, 'message': f'Error updating cart: {str(e)}'})
+
+@app.route('/api/cart/items', methods=['PATCH'])
+def patch_cart():
+    """Apply add / set / remove operations to the authenticated user's cart
+    
+    Body: {"version": <last seen, optional>, "ops": [{"op": "add" | "set" |
+    "remove", "id": <product id>, "quantity": <n>}]}. Ops for products that
+    don't exist are skipped and listed in 'errors'.
+    """
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'User not authenticated'})
+    
+    try:
+        user_id = session['user_id']
+        data = request.json
         
+        version, errors = apply_cart_ops(user_id, data.get('ops', []), data.get('version'))
         db.session.commit()
         
         return jsonify({
             'success': True,
-            'message': 'Cart updated successfully'
+            'message': 'Cart updated successfully',
+            'version': version,
+            'errors': errors
         })
     
+    except CartConflict as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'conflict': True, 'version': e.version, 'message': str(e)})
     except Exception as e:
         db.session.rollback()
         print(f"Error updating cart: {str(e)}")
@@ -1175,7 +1319,7 @@ def clear_cart():
         user_id = session['user_id']
         
         # Delete all cart items for this user
-        CartItem.query.filter_by(user_id=user_id).delete()
+        empty_cart(user_id)
         db.session.commit()
         
         return jsonify({
@@ -1189,96 +1333,157 @@ def clear_cart():
         return jsonify({'success': False, 'message': f'Error clearing cart: {str(e)}'})
 
 # Order endpoints
+ORDER_STATUSES = ('Pending', 'Processing', 'Dispatched', 'Delivered', 'Cancelled')
+
 @app.route('/api/orders/create', methods=['POST'])
 def create_order():
-    """Create a new order"""
+    """Create a new order
+    
+    Stock is checked and decremented, and items are priced from the
+    database, in the same transaction that inserts the order. The client's
+    price and totalAmount fields are ignored.
+    """
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'User not authenticated'})
     
     try:
         data = request.json
         user_id = session['user_id']
+        items = [(item['id'], item['quantity']) for item in data['items']]
         
-        # Generate UUID for order ID
-        order_id = str(uuid.uuid4())
-        
-        # Create new order
-        new_order = Order(
-            order_id=order_id,
-            user_id=user_id,
-            total=float(data['totalAmount']),
-            status='Pending'
-        )
-        
-        db.session.add(new_order)
-        db.session.flush()  # Get the order ID
-        
-        # Add order items
-        for item in data['items']:
-            order_item = OrderItem(
-                order_id=new_order.order_id,
-                product_id=int(item['id']),
-                quantity=item['quantity'],
-                price=float(item['price'])
-            )
-            db.session.add(order_item)
-        
-        # Clear the user's cart after creating order
-        CartItem.query.filter_by(user_id=user_id).delete()
-        
-        db.session.commit()
+        order_id = with_deadlock_retry(lambda: _place_order(user_id, items))
         
         return jsonify({
             'success': True,
             'message': 'Order created successfully',
-            'orderId': new_order.order_id
+            'orderId': order_id
         })
     
+    except StockError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)})
     except Exception as e:
         db.session.rollback()
         print(f"Error creating order: {str(e)}")
         return jsonify({'success': False, 'message': f'Error creating order: {str(e)}'})
 
+def _place_order(user_id, items):
+    # Lock the product rows (in product_id order), check and take the stock
+    lines = reserve_stock(items)
+    
+    # Generate UUID for order ID
+    order_id = str(uuid.uuid4())
+    
+    # Create new order
+    new_order = Order(
+        order_id=order_id,
+        user_id=user_id,
+        total=sum(product.price * quantity for product, quantity in lines),
+        status='Pending'
+    )
+    
+    db.session.add(new_order)
+    db.session.flush()  # Get the order ID
+    
+    # Add order items at the current database price
+    order_items = []
+    for product, quantity in lines:
+        order_item = OrderItem(
+            order_id=new_order.order_id,
+            product_id=product.product_id,
+            quantity=quantity,
+            price=product.price
+        )
+        db.session.add(order_item)
+        order_items.append(order_item)
+    
+    # Queued for the report rollups, which are updated after the commit so
+    # checkouts don't queue up on the day's row while holding stock locks
+    record_order(new_order, order_items)
+    
+    # Clear the user's cart after creating order
+    empty_cart(user_id)
+    
+    db.session.commit()
+    return order_id
+
+@app.route('/api/orders/update-status/<order_id>', methods=['PUT'])
+def update_order_status(order_id):
+    """Change an order's status (admin, or a seller with items in the order)"""
+    admin = current_admin()
+    seller = current_seller()
+    if admin is None and seller is None:
+        return jsonify({'success': False, 'message': 'Not authenticated'})
+    
+    try:
+        status = request.json.get('status')
+        if status not in ORDER_STATUSES:
+            return jsonify({'success': False, 'message': f'Invalid status: {status}'})
+        
+        order = Order.query.get(order_id)
+        if not order:
+            return jsonify({'success': False, 'message': 'Order not found'})
+        
+        # Sellers may only update orders that contain their products
+        if admin is None:
+            owns_item = db.session.query(OrderItem.id).join(
+                Product, Product.product_id == OrderItem.product_id
+            ).filter(
+                OrderItem.order_id == order.order_id,
+                Product.seller_id == seller.seller_id
+            ).first()
+            if not owns_item:
+                return jsonify({'success': False, 'message': 'Unauthorized'})
+        
+        change_order_status(order, status)
+        db.session.commit()
+        
+        return jsonify({
+            'success': True,
+            'message': 'Order status updated successfully'
+        })
+    
+    except StockError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)})
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error updating order status: {str(e)}")
+        return jsonify({'success': False, 'message': f'Error updating order status: {str(e)}'})
+
 @app.route('/api/orders', methods=['GET'])
 def get_user_orders():
-    """Get orders for the authenticated user"""
+    """Get a page of orders for the authenticated user
+    
+    Query parameters: limit and cursor (the nextCursor value returned with
+    the previous page).
+    """
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'User not authenticated'})
     
     try:
         user_id = session['user_id']
-        orders = Order.query.filter_by(user_id=user_id).order_by(Order.created_at.desc()).all()
+        # Items and products are bulk-loaded with the page
+        orders, next_cursor = user_orders_page(
+            user_id,
+            cursor=request.args.get('cursor'),
+            limit=parse_limit(request.args.get('limit'))
+        )
         order_list = []
         
         for order in orders:
-            # Get order items
-            order_items = OrderItem.query.filter_by(order_id=order.order_id).all()
-            items = []
-            
-            for item in order_items:
-                product = Product.query.get(item.product_id)
-                if product:
-                    items.append({
-                        'id': str(product.product_id),
-                        'name': product.name,
-                        'price': item.price,
-                        'quantity': item.quantity,
-                        'image': product.image_url
-                    })
-            
-            order_list.append({
-                'id': str(order.order_id),
-                'items': items,
-                'totalAmount': order.total,
-                'status': order.status,
-                'createdAt': order.created_at.isoformat()
-            })
+            data = ORDER.dump(order)
+            data['items'] = ORDER_ITEM.dump_many(item for item in order.items if item.product)
+            order_list.append(data)
         
-        return jsonify({
+        return json_response({
             'success': True,
-            'orders': order_list
+            'orders': order_list,
+            'nextCursor': next_cursor
         })
     
+    except PaginationError as e:
+        return jsonify({'success': False, 'message': str(e)})
     except Exception as e:
         print(f"Error fetching orders: {str(e)}")
         return jsonify({'success': False, 'message': f'Error fetching orders: {str(e)}'})
@@ -1,44 +1,172 @@
+from functools import wraps
+from threading import Lock
+import time
+from flask import current_app, g, jsonify, session
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import object_session
+from models import on_outermost_commit, User, SellerProfile, AdminProfile
+from sessions import revoke_sessions, set_session_status
 
-from flask import jsonify, session
-from models import User, SellerProfile, AdminProfile
+class Principal(object):
+    """Plain snapshot of an authenticated profile, detached from the ORM"""
+    FIELDS = ()
+
+    def __init__(self, profile):
+        for name in self.FIELDS:
+            setattr(self, name, getattr(profile, name))
+
+    def to_dict(self):
+        data = {'isAuthenticated': True}
+        data.update((name, getattr(self, name)) for name in self.FIELDS)
+        return data
+
+class SellerPrincipal(Principal):
+    FIELDS = ('seller_id', 'username', 'email', 'business_name',
+              'business_description', 'approval_status', 'phone_number')
+
+class AdminPrincipal(Principal):
+    FIELDS = ('admin_id', 'username', 'email', 'role', 'department', 'phone_number')
+
+# Short-lived cache of principals shared by all requests in this process,
+# keyed by (kind, id). Enabled by setting AUTH_CACHE_TTL (seconds) > 0.
+_cache = {}
+_cache_lock = Lock()
+MAX_CACHED_PRINCIPALS = 1024
+
+def _cached(kind, principal_id):
+    with _cache_lock:
+        entry = _cache.get((kind, principal_id))
+    if entry and entry[0] > time.monotonic():
+        return entry[1]
+    return None
+
+def _store(kind, principal_id, principal, ttl):
+    now = time.monotonic()
+    with _cache_lock:
+        if len(_cache) >= MAX_CACHED_PRINCIPALS:
+            for key in [k for k, (expires, _) in _cache.items() if expires <= now]:
+                del _cache[key]
+            if len(_cache) >= MAX_CACHED_PRINCIPALS:
+                _cache.clear()
+        _cache[(kind, principal_id)] = (now + ttl, principal)
+
+def invalidate_principal(kind, principal_id):
+    """Drop a cached principal, e.g. after its profile or approval changed"""
+    with _cache_lock:
+        _cache.pop((kind, principal_id), None)
+
+def _resolve(kind, principal_class, model, principal_id):
+    ttl = current_app.config.get('AUTH_CACHE_TTL', 0)
+    if ttl:
+        principal = _cached(kind, principal_id)
+        if principal is not None:
+            return principal
+
+    profile = model.query.get(principal_id)
+    if not profile:
+        return None
+
+    principal = principal_class(profile)
+    if ttl:
+        _store(kind, principal_id, principal, ttl)
+    return principal
+
+def current_seller():
+    """The logged-in seller, resolved at most once per request"""
+    if 'seller_id' not in session:
+        return None
+    if '_seller' not in g:
+        g._seller = _resolve('seller', SellerPrincipal, SellerProfile, session['seller_id'])
+    return g._seller
+
+def current_seller_id():
+    """The logged-in seller's id, read from the session record alone"""
+    return session.get('seller_id')
+
+def current_admin():
+    """The logged-in admin, resolved at most once per request"""
+    if 'admin_id' not in session:
+        return None
+    if '_admin' not in g:
+        g._admin = _resolve('admin', AdminPrincipal, AdminProfile, session['admin_id'])
+    return g._admin
+
+# The decorators below only read the server-side session record. Sessions
+# are revoked when their seller is rejected or a profile is deleted, so a
+# live session is enough - no profile query per request.
+
+def seller_required(view):
+    """Reject the request unless a seller is logged in"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if 'seller_id' not in session:
+            return jsonify({'success': False, 'message': 'Seller not authenticated'}), 401
+        if session.get('approval_status') == 'rejected':
+            return jsonify({'success': False, 'message': 'Your seller account has been rejected'}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+def admin_required(view):
+    """Reject the request unless an admin is logged in"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if 'admin_id' not in session:
+            return jsonify({'success': False, 'message': 'Admin not authenticated'}), 401
+        return view(*args, **kwargs)
+    return wrapper
 
 def check_admin_auth():
-    if 'admin_id' in session:
-        admin_id = session['admin_id']
-        
-        # Get admin user details directly from AdminProfile
-        admin = AdminProfile.query.filter_by(admin_id=admin_id).first()
-        
-        if admin:
-            return jsonify({
-                'isAuthenticated': True,
-                'admin_id': admin.admin_id,
-                'username': admin.username,
-                'email': admin.email,
-                'role': admin.role,
-                'department': admin.department,
-                'phone_number': admin.phone_number
-            })
-    
+    admin = current_admin()
+    if admin:
+        return jsonify(admin.to_dict())
+
     return jsonify({'isAuthenticated': False})
 
 def check_seller_auth():
-    if 'seller_id' in session:
-        seller_id = session['seller_id']
-        
-        # Get seller profile directly from SellerProfile
-        seller = SellerProfile.query.filter_by(seller_id=seller_id).first()
-        
-        if seller:
-            return jsonify({
-                'isAuthenticated': True,
-                'seller_id': seller.seller_id,
-                'username': seller.username,
-                'email': seller.email,
-                'business_name': seller.business_name,
-                'business_description': seller.business_description,
-                'approval_status': seller.approval_status,
-                'phone_number': seller.phone_number
-            })
-    
+    seller = current_seller()
+    if seller:
+        return jsonify(seller.to_dict())
+
     return jsonify({'isAuthenticated': False})
+
+# Any flushed change to a profile (details, approval status, deletion)
+# evicts its cached principal. Deletions and approval changes also reach
+# the principal's sessions once the transaction commits: a rejected or
+# deleted principal is logged out everywhere.
+def _queue_session_change(target, change):
+    object_session(target).info.setdefault('session_changes', []).append(change)
+
+@event.listens_for(SellerProfile, 'after_update')
+def _evict_seller(mapper, connection, target):
+    invalidate_principal('seller', target.seller_id)
+    if inspect(target).attrs.approval_status.history.has_changes():
+        _queue_session_change(target, ('seller', target.seller_id, target.approval_status))
+
+@event.listens_for(SellerProfile, 'after_delete')
+def _delete_seller(mapper, connection, target):
+    invalidate_principal('seller', target.seller_id)
+    _queue_session_change(target, ('seller', target.seller_id, None))
+
+@event.listens_for(AdminProfile, 'after_update')
+def _evict_admin(mapper, connection, target):
+    invalidate_principal('admin', target.admin_id)
+
+@event.listens_for(AdminProfile, 'after_delete')
+def _delete_admin(mapper, connection, target):
+    invalidate_principal('admin', target.admin_id)
+    _queue_session_change(target, ('admin', target.admin_id, None))
+
+@event.listens_for(User, 'after_delete')
+def _delete_user(mapper, connection, target):
+    _queue_session_change(target, ('user', target.user_id, None))
+
+@on_outermost_commit('session_changes')
+def _apply_session_changes(db_session, changes):
+    for kind, principal_id, status in changes:
+        try:
+            if status is None or status == 'rejected':
+                revoke_sessions(kind, principal_id)
+            else:
+                set_session_status(kind, principal_id, status)
+        except Exception as e:
+            print(f"Error updating sessions for {kind} {principal_id}: {str(e)}")
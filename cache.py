@@ -0,0 +1,164 @@
+from collections import OrderedDict
+from threading import Lock, Thread
+import json
+import time
+
+try:
+    import redis
+except ImportError:  # optional - only needed for CACHE_REDIS_URL
+    redis = None
+
+class LRUCache(object):
+    """In-process LRU store; entries expire at their hard deadline"""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, fresh_until, expires_at = entry
+            if expires_at <= time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value, fresh_until
+
+    def set(self, key, value, fresh_until, expires_at):
+        with self._lock:
+            self._data[key] = (value, fresh_until, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+class RedisCache(object):
+    """Store shared by all workers on a host, for any Redis-compatible server
+
+    Values must be JSON-serialisable.
+    """
+
+    def __init__(self, url, prefix='kukuhub:cache:'):
+        if redis is None:
+            raise RuntimeError('CACHE_REDIS_URL is set but the redis package is not installed')
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            return None
+        entry = json.loads(raw)
+        return entry['v'], entry['f']
+
+    def set(self, key, value, fresh_until, expires_at):
+        ttl = max(1, int(expires_at - time.time()))
+        self.client.set(self.prefix + key, json.dumps({'v': value, 'f': fresh_until}), ex=ttl)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+class Cache(object):
+    """Read-through cache that serves stale values while refreshing them
+
+    A value younger than `ttl` is a hit. Once it is older, but still within
+    `ttl + stale_ttl`, the stale value is returned right away and one
+    background thread reloads it. Past that it is reloaded inline (a miss).
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or LRUCache()
+        self._refreshing = set()
+        self._lock = Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'stale_hits': 0, 'refreshes': 0, 'errors': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _store(self, key, value, ttl, stale_ttl):
+        now = time.time()
+        self.backend.set(key, value, now + ttl, now + ttl + stale_ttl)
+
+    def get_or_load(self, key, loader, ttl=30, stale_ttl=300, app=None):
+        """Return the cached value for `key`, calling `loader()` as needed
+
+        Pass the Flask `app` when the loader needs an application context,
+        so the background refresh can push one.
+        """
+        try:
+            entry = self.backend.get(key)
+        except Exception as e:
+            print(f"Cache read error for {key}: {str(e)}")
+            self._count('errors')
+            entry = None
+
+        if entry is None:
+            self._count('misses')
+            value = loader()
+            try:
+                self._store(key, value, ttl, stale_ttl)
+            except Exception as e:
+                print(f"Cache write error for {key}: {str(e)}")
+                self._count('errors')
+            return value
+
+        value, fresh_until = entry
+        if fresh_until > time.time():
+            self._count('hits')
+        else:
+            self._count('stale_hits')
+            self._refresh_in_background(key, loader, ttl, stale_ttl, app)
+        return value
+
+    def _refresh_in_background(self, key, loader, ttl, stale_ttl, app):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                if app is not None:
+                    with app.app_context():
+                        value = loader()
+                else:
+                    value = loader()
+                self._store(key, value, ttl, stale_ttl)
+                self._count('refreshes')
+            except Exception as e:
+                print(f"Cache refresh error for {key}: {str(e)}")
+                self._count('errors')
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        Thread(target=refresh, daemon=True).start()
+
+    def invalidate(self, key):
+        self.backend.delete(key)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        lookups = stats['hits'] + stats['stale_hits'] + stats['misses']
+        stats['hitRatio'] = round((stats['hits'] + stats['stale_hits']) / lookups, 4) if lookups else 0
+        stats['backend'] = type(self.backend).__name__
+        return stats
+
+cache = Cache()
+
+def init_cache(app):
+    """Switch the shared cache to Redis when CACHE_REDIS_URL is configured"""
+    url = app.config.get('CACHE_REDIS_URL')
+    if url:
+        cache.backend = RedisCache(url)
+    else:
+        cache.backend = LRUCache(app.config.get('CACHE_MAX_ENTRIES', 1024))
@@ -0,0 +1,174 @@
+from datetime import datetime
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+from models import db, Cart, CartItem
+
+class CartConflict(Exception):
+    """The client's cart version is behind the server's"""
+
+    def __init__(self, version):
+        super().__init__(f'Cart has changed (current version {version})')
+        self.version = version
+
+def get_cart_version(user_id):
+    version = db.session.query(Cart.version).filter(Cart.user_id == user_id).scalar()
+    return version or 0
+
+def _claim_version(user_id, expected_version):
+    """Bump the cart version, failing if it no longer matches
+
+    The UPDATE also row-locks the user's cart, so concurrent syncs for the
+    same user apply one after another.
+    """
+    table = Cart.__table__
+    conditions = [table.c.user_id == user_id]
+    if expected_version is not None:
+        conditions.append(table.c.version == expected_version)
+
+    if db.session.execute(
+        table.update().where(*conditions).values(version=table.c.version + 1)
+    ).rowcount:
+        return get_cart_version(user_id)
+
+    # No row yet - this is the user's first cart change
+    if expected_version in (None, 0):
+        try:
+            with db.session.begin_nested():
+                db.session.execute(table.insert().values(user_id=user_id, version=1))
+            return 1
+        except IntegrityError:
+            if expected_version is None:
+                return _claim_version(user_id, None)
+
+    raise CartConflict(get_cart_version(user_id))
+
+def _upsert_item(user_id, product_id, quantity, increment=False):
+    """Write one cart row; returns False if the product doesn't exist"""
+    table = CartItem.__table__
+    where = [table.c.user_id == user_id, table.c.product_id == product_id]
+    new_quantity = table.c.quantity + quantity if increment else quantity
+    values = {'quantity': new_quantity, 'updated_at': datetime.utcnow()}
+
+    if db.session.execute(table.update().where(*where).values(values)).rowcount:
+        return True
+    try:
+        with db.session.begin_nested():
+            db.session.add(CartItem(user_id=user_id, product_id=product_id, quantity=quantity))
+    except IntegrityError:
+        # Either inserted concurrently - the unique (user_id, product_id) key
+        # caught it - or the product foreign key failed, in which case there
+        # is still no row to update
+        return bool(db.session.execute(table.update().where(*where).values(values)).rowcount)
+    return True
+
+def _remove_items(user_id, product_ids):
+    if product_ids:
+        CartItem.query.filter(
+            CartItem.user_id == user_id,
+            CartItem.product_id.in_(product_ids)
+        ).delete(synchronize_session=False)
+
+def _check_version(user_id, expected_version):
+    version = get_cart_version(user_id)
+    if expected_version is not None and expected_version != version:
+        raise CartConflict(version)
+    return version
+
+def _apply(user_id, ops):
+    """Apply the ops; returns a list of errors for the ones that failed"""
+    removed = []
+    errors = []
+    for op in ops:
+        kind = op.get('op')
+        product_id = int(op['id'])
+        if kind == 'remove':
+            removed.append(product_id)
+            continue
+
+        quantity = int(op.get('quantity', 1))
+        if kind == 'add':
+            if quantity <= 0:
+                raise ValueError(f'Invalid quantity {quantity} for product {product_id}')
+            written = _upsert_item(user_id, product_id, quantity, increment=True)
+        elif kind == 'set':
+            if quantity <= 0:
+                removed.append(product_id)
+                continue
+            written = _upsert_item(user_id, product_id, quantity)
+        else:
+            raise ValueError(f'Unknown cart operation: {kind}')
+        if not written:
+            errors.append({'id': str(product_id), 'message': 'Product not found'})
+
+    _remove_items(user_id, removed)
+    return errors
+
+def apply_cart_ops(user_id, ops, expected_version=None):
+    """Apply add / set / remove operations to a user's cart
+
+    Each op is a dict with 'op', 'id' and, except for remove, 'quantity'.
+    Only the rows named by the ops are written. Returns (version, errors),
+    errors listing the ops for products that don't exist - the other ops
+    are still applied. The caller commits.
+    """
+    if not ops:
+        return _check_version(user_id, expected_version), []
+
+    version = _claim_version(user_id, expected_version)
+    return version, _apply(user_id, ops)
+
+def _diff(user_id, items):
+    wanted = {}
+    for item in items:
+        wanted[int(item['id'])] = int(item['quantity'])
+
+    current = dict(db.session.query(CartItem.product_id, CartItem.quantity).filter(
+        CartItem.user_id == user_id
+    ).all())
+
+    ops = [{'op': 'remove', 'id': product_id} for product_id in current if product_id not in wanted]
+    ops += [
+        {'op': 'set', 'id': product_id, 'quantity': quantity}
+        for product_id, quantity in wanted.items()
+        if current.get(product_id) != quantity
+    ]
+    return ops
+
+def sync_cart(user_id, items, expected_version=None):
+    """Make the stored cart match a full list of {'id', 'quantity'} items
+
+    Only rows that differ from what is stored are written, and nothing is
+    written when the cart is unchanged. Returns (version, errors) as
+    apply_cart_ops() does; the caller commits.
+    """
+    if not _diff(user_id, items):
+        return _check_version(user_id, expected_version), []
+
+    # Diff again once the cart is locked, in case another sync got in first
+    version = _claim_version(user_id, expected_version)
+    return version, _apply(user_id, _diff(user_id, items))
+
+def merge_duplicate_items(conn):
+    """Fold cart rows for the same (user, product) into the oldest one
+
+    Old carts could hold a product twice; run before adding the unique
+    (user_id, product_id) key. MySQL only.
+    """
+    conn.execute(text("""
+        UPDATE cart_items c
+        JOIN (
+            SELECT user_id, product_id, MIN(id) AS keep_id, SUM(quantity) AS total
+            FROM cart_items GROUP BY user_id, product_id HAVING COUNT(*) > 1
+        ) d ON c.id = d.keep_id
+        SET c.quantity = d.total
+    """))
+    conn.execute(text("""
+        DELETE c FROM cart_items c
+        JOIN cart_items k
+          ON k.user_id = c.user_id AND k.product_id = c.product_id AND k.id < c.id
+    """))
+
+def empty_cart(user_id):
+    """Delete every item in a user's cart; the caller commits"""
+    _claim_version(user_id, None)
+    CartItem.query.filter_by(user_id=user_id).delete(synchronize_session=False)
@@ -0,0 +1,142 @@
+from datetime import datetime
+from itertools import chain
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, joinedload
+from models import db, on_outermost_commit, Product, SellerProfile, CartItem, CatalogVersion
+from pagination import DEFAULT_PAGE_SIZE, PaginationError, decode_cursor, encode_cursor, keyset_condition
+
+# Seller columns the catalogue actually renders - keeps password hashes
+# and descriptions out of the joined rows
+SELLER_COLUMNS = (SellerProfile.business_name, SellerProfile.email)
+
+def _seller_option():
+    return joinedload(Product.seller).load_only(*SELLER_COLUMNS)
+
+def catalog_query(columns=None):
+    """Product query that loads each product's seller in the same SELECT
+
+    With `columns`, selects just those columns (seller columns included)
+    as row tuples instead of hydrating Product objects. The seller is
+    outer joined, so a product whose seller row is missing is still listed
+    (as "Unknown Seller").
+    """
+    if columns:
+        return db.session.query(*columns).select_from(Product).outerjoin(Product.seller)
+    return Product.query.options(_seller_option())
+
+def select_columns(columns, keys):
+    """`columns` with any of the sort key columns it lacks appended"""
+    return list(columns) + [key for key in keys if not any(key is column for column in columns)]
+
+def key_values(result, keys):
+    """Sort key values of a Product or of a row selected with select_columns()"""
+    if isinstance(result, Product):
+        return [getattr(result, key.key) for key in keys]
+    return [result._mapping[key] for key in keys]
+
+def get_catalog_product(product_id):
+    """Get a single product together with its seller in one query"""
+    return catalog_query().filter(Product.product_id == product_id).first()
+
+def get_cart_items(user_id):
+    """Get a user's cart items with product and seller in one query"""
+    return CartItem.query.filter_by(user_id=user_id).options(
+        joinedload(CartItem.product).options(_seller_option())
+    ).all()
+
+def seller_name(product, default="Unknown Seller"):
+    """Business name of the product's seller, or a placeholder"""
+    return product.seller.business_name if product.seller else default
+
+# sort name -> (key columns, key types, descending)
+SORT_OPTIONS = {
+    'newest': ((Product.created_at, Product.product_id), (datetime, int), True),
+    'oldest': ((Product.created_at, Product.product_id), (datetime, int), False),
+    'price_asc': ((Product.price, Product.product_id), (float, int), False),
+    'price_desc': ((Product.price, Product.product_id), (float, int), True),
+}
+
+def filter_products(query, category=None, min_price=None, max_price=None, seller_id=None, in_stock=False):
+    """Apply the catalogue's listing filters to a product query"""
+    if category:
+        query = query.filter(Product.category == category)
+    if min_price is not None:
+        query = query.filter(Product.price >= min_price)
+    if max_price is not None:
+        query = query.filter(Product.price <= max_price)
+    if seller_id is not None:
+        query = query.filter(Product.seller_id == seller_id)
+    if in_stock:
+        query = query.filter(Product.stock > 0)
+    return query
+
+def list_products(category=None, min_price=None, max_price=None, seller_id=None,
+                  in_stock=False, sort='newest', cursor=None, limit=DEFAULT_PAGE_SIZE, columns=None):
+    """Get one page of the catalogue using keyset pagination
+
+    Returns (products, next_cursor); next_cursor is None on the last page.
+    With `columns` the products are row tuples starting with those columns.
+    """
+    if sort not in SORT_OPTIONS:
+        raise PaginationError(f'Unknown sort option: {sort}')
+    keys, types, descending = SORT_OPTIONS[sort]
+    
+    query = catalog_query(select_columns(columns, keys) if columns else None)
+    query = filter_products(query, category, min_price, max_price, seller_id, in_stock)
+    
+    # Resume after the last row of the previous page instead of using OFFSET
+    if cursor:
+        values = decode_cursor(cursor, sort, types)
+        query = query.filter(keyset_condition(keys, values, descending))
+    
+    order = [c.desc() if descending else c.asc() for c in keys]
+    # Fetch one extra row to find out whether another page exists
+    products = query.order_by(*order).limit(limit + 1).all()
+    
+    next_cursor = None
+    if len(products) > limit:
+        products = products[:limit]
+        next_cursor = encode_cursor(sort, key_values(products[-1], keys))
+    
+    return products, next_cursor
+
+# Changes to these show up in catalogue responses
+CATALOG_MODELS = (Product, SellerProfile)
+
+def get_catalog_version():
+    return db.session.query(CatalogVersion.version).filter(CatalogVersion.id == 1).scalar() or 0
+
+def bump_catalog_version():
+    """Advance the catalogue version in its own short transaction
+
+    Runs after the change itself has committed, so the single version row
+    is only locked for an instant rather than for the whole of every
+    checkout.
+    """
+    table = CatalogVersion.__table__
+    with db.engine.begin() as conn:
+        if conn.execute(
+            table.update().where(table.c.id == 1).values(version=table.c.version + 1)
+        ).rowcount:
+            return
+        try:
+            with conn.begin_nested():
+                conn.execute(table.insert().values(id=1, version=1))
+        except IntegrityError:
+            # Created concurrently - the primary key caught it
+            conn.execute(table.update().where(table.c.id == 1).values(version=table.c.version + 1))
+
+@event.listens_for(Session, 'after_flush')
+def _note_catalog_change(session, flush_context):
+    if not session.info.get('catalog_changed') and any(
+        isinstance(obj, CATALOG_MODELS) for obj in chain(session.new, session.dirty, session.deleted)
+    ):
+        session.info['catalog_changed'] = True
+
+@on_outermost_commit('catalog_changed')
+def _bump_after_commit(session, changed):
+    try:
+        bump_catalog_version()
+    except Exception as e:
+        print(f"Error bumping catalog version: {str(e)}")
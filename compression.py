@@ -0,0 +1,49 @@
+import gzip
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # optional - without it responses are gzipped
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'text/html', 'text/plain', 'text/css', 'application/javascript')
+
+def _encode(data, encoding, config):
+    if encoding == 'br':
+        return brotli.compress(data, quality=config['COMPRESS_BROTLI_QUALITY'])
+    return gzip.compress(data, compresslevel=config['COMPRESS_LEVEL'], mtime=0)
+
+def compress_response(response, config):
+    """gzip or brotli encode a response body of at least COMPRESS_MIN_SIZE bytes
+
+    Streams (server-sent events, files) and already-encoded or partial
+    responses are left alone.
+    """
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    if len(data) < config['COMPRESS_MIN_SIZE']:
+        return response
+
+    offered = ['br', 'gzip'] if brotli is not None else ['gzip']
+    encoding = request.accept_encodings.best_match(offered)
+    if encoding is None:
+        return response
+
+    response.set_data(_encode(data, encoding, config))
+    response.headers['Content-Encoding'] = encoding
+    # A strong ETag names exact bytes, so the encoded body needs its own
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(f'{etag}-{encoding}')
+    return response
+
+def init_compression(app):
+    """Compress every eligible response the app sends"""
+    @app.after_request
+    def _compress(response):
+        return compress_response(response, app.config)
@@ -0,0 +1,53 @@
+from functools import wraps
+from flask import current_app, g, request
+from catalog import get_catalog_version
+from serializers import json_response
+
+def _catalog_etag(scope):
+    salt = current_app.config['CATALOG_ETAG_SALT']
+    return f'{salt}.{get_catalog_version()}' + (f'.{scope}' if scope else '')
+
+def _cache_headers(response, etag, private):
+    response.set_etag(etag, weak=True)
+    # Clients keep the body but check back every time; the check is cheap
+    response.cache_control.no_cache = True
+    if private:
+        response.cache_control.private = True
+        response.vary.add('Cookie')
+    else:
+        response.cache_control.public = True
+    return response
+
+def catalog_conditional(scope=None):
+    """Answer If-None-Match for a catalogue view from the catalogue version
+
+    A client holding the current ETag gets a 304 after a single primary-key
+    lookup, without the view's queries running. `scope` returns a string
+    that separates per-user responses (e.g. the seller id) and marks them
+    private. The view returns catalog_response() to have its ETag set.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            # Read before the view's queries - a change landing in between
+            # only costs the client one extra full response
+            etag = _catalog_etag(scope() if scope else None)
+            if request.if_none_match.contains_weak(etag):
+                response = current_app.response_class(status=304)
+                return _cache_headers(response, etag, scope is not None)
+            g.catalog_etag = (etag, scope is not None)
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def catalog_response(payload):
+    """json_response() carrying the catalogue ETag
+
+    Responses listing images or videos whose variants or poster are still
+    being generated are sent without one.
+    """
+    response = json_response(payload)
+    if 'catalog_etag' in g and not g.get('media_pending'):
+        etag, private = g.catalog_etag
+        _cache_headers(response, etag, private)
+    return response
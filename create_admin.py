@@ -1,12 +1,14 @@
 
 from flask import Flask
-from werkzeug.security import generate_password_hash
+from credentials import hash_password
 from models import db, AdminProfile
+import os
 import sys
 
 app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = 'mysql+pymysql://root:@localhost/kukuhub'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
 db.init_app(app)
 
 def create_admin_user(username, email, password, role='general', department=None, phone_number=None):
@@ -19,7 +21,7 @@ def create_admin_user(username, email, password, role='general', department=None
         
         try:
             # Create new admin directly in AdminProfile
-            hashed_password = generate_password_hash(password)
+            hashed_password = hash_password(password)
             new_admin = AdminProfile(
                 username=username,
                 email=email,
@@ -0,0 +1,139 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+from threading import BoundedSemaphore, Lock
+from flask import current_app, has_app_context
+from sqlalchemy import inspect, update
+from werkzeug.security import check_password_hash, generate_password_hash
+from models import db
+
+# Werkzeug method string: 'scrypt[:n:r:p]' or 'pbkdf2[:hash[:iterations]]'.
+# Changing it (e.g. raising the iterations) rehashes each password the next
+# time its owner logs in.
+DEFAULT_METHOD = 'pbkdf2:sha256:600000'
+DEFAULT_SALT_LENGTH = 16
+
+class CredentialsBusy(Exception):
+    """No verification slot freed up in time - too many logins at once"""
+
+def _config(name, default):
+    return current_app.config.get(name, default) if has_app_context() else default
+
+def hash_password(password):
+    """Hash a password with the configured method and cost"""
+    return generate_password_hash(
+        password,
+        method=_config('PASSWORD_HASH_METHOD', DEFAULT_METHOD),
+        salt_length=_config('PASSWORD_SALT_LENGTH', DEFAULT_SALT_LENGTH)
+    )
+
+_full_methods = {}
+_methods_lock = Lock()
+
+def _full_method(method):
+    # Werkzeug fills in defaults ('scrypt' -> 'scrypt:32768:8:1'), so learn
+    # the stored form from one real hash
+    with _methods_lock:
+        if method not in _full_methods:
+            _full_methods[method] = generate_password_hash('', method=method, salt_length=1).split('$', 1)[0]
+        return _full_methods[method]
+
+def needs_rehash(pwhash, method=None):
+    """Whether a stored hash was made with another method or cost"""
+    method = method or _config('PASSWORD_HASH_METHOD', DEFAULT_METHOD)
+    return pwhash.split('$', 1)[0] != _full_method(method)
+
+def _verify(pwhash, password, method, salt_length):
+    # Runs on a pool thread. hashlib's pbkdf2 and scrypt release the GIL, so
+    # the pool's workers hash on separate cores.
+    if not check_password_hash(pwhash, password):
+        return False, None
+    if needs_rehash(pwhash, method):
+        return True, generate_password_hash(password, method=method, salt_length=salt_length)
+    return True, None
+
+class VerificationPool(object):
+    """Runs password checks on a fixed number of threads
+
+    At most `max_pending` checks run or queue at once. A login that finds
+    no free slot within `wait` seconds fails with CredentialsBusy instead
+    of piling up, so a login storm can't take every core from the rest of
+    the API.
+    """
+
+    def __init__(self, workers=2, max_pending=32, wait=2.0):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='credentials')
+        self.slots = BoundedSemaphore(max_pending)
+        self.wait = wait
+        self._lock = Lock()
+        self.counters = {'verified': 0, 'rehashed': 0, 'busy': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def run(self, func, *args):
+        if not self.slots.acquire(timeout=self.wait):
+            self._count('busy')
+            raise CredentialsBusy('Too many login attempts right now, please try again shortly')
+        try:
+            future = self.executor.submit(func, *args)
+        except Exception:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future.result()
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters)
+
+pool = VerificationPool()
+
+def _store_rehash(profile, new_hash):
+    # A plain UPDATE: flushing the profile would count as a catalogue change
+    # for sellers and invalidate every catalogue ETag
+    state = inspect(profile)
+    mapper = state.mapper
+    try:
+        db.session.execute(
+            update(mapper.class_)
+            .where(mapper.primary_key[0] == state.identity[0])
+            .values(password_hash=new_hash)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error rehashing password: {str(e)}")
+
+def check_password(profile, password):
+    """Verify a login password against a user, seller or admin profile
+
+    Runs on the verification pool (raising CredentialsBusy when it is
+    full). On success an outdated hash is replaced with one made with the
+    configured method.
+    """
+    if profile is None or not profile.password_hash or password is None:
+        return False
+    valid, new_hash = pool.run(
+        _verify,
+        profile.password_hash,
+        password,
+        _config('PASSWORD_HASH_METHOD', DEFAULT_METHOD),
+        _config('PASSWORD_SALT_LENGTH', DEFAULT_SALT_LENGTH)
+    )
+    pool._count('verified')
+    if new_hash:
+        _store_rehash(profile, new_hash)
+        pool._count('rehashed')
+    return valid
+
+def init_credentials(app):
+    """Size the verification pool from CREDENTIALS_WORKERS,
+    CREDENTIALS_MAX_PENDING and CREDENTIALS_WAIT"""
+    global pool
+    pool = VerificationPool(
+        workers=app.config.get('CREDENTIALS_WORKERS') or max(1, (os.cpu_count() or 2) // 2),
+        max_pending=app.config.get('CREDENTIALS_MAX_PENDING', 32),
+        wait=app.config.get('CREDENTIALS_WAIT', 2.0)
+    )
@@ -2,6 +2,8 @@
 from flask import Flask
 from models import db, User, SellerProfile, AdminProfile, Product, Message, CartItem, Order, OrderItem
 from sqlalchemy import text
+from cart import merge_duplicate_items
+from reports import backfill_summaries
 import os
 
 app = Flask(__name__)
@@ -10,6 +12,36 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 db.init_app(app)
 
+# Unique indexes that need existing duplicate rows merged first
+INDEX_CLEANUPS = {
+    'uq_cart_items_user_product': merge_duplicate_items,
+}
+
+def add_missing_indexes():
+    """Create the model indexes an older database lacks
+
+    Each index is tried on its own, so one that can't be built (e.g. a
+    unique key over duplicate rows) is logged and the rest still get added.
+    """
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                with db.engine.connect() as conn:
+                    result = conn.execute(
+                        text(f"SHOW INDEX FROM {table.name} WHERE Key_name = :name"),
+                        {'name': index.name}
+                    )
+                    if result.fetchone():
+                        continue
+                    cleanup = INDEX_CLEANUPS.get(index.name)
+                    if cleanup:
+                        cleanup(conn)
+                    index.create(conn)
+                    conn.commit()
+                    print(f"Added index {index.name} to {table.name} table")
+            except Exception as e:
+                print(f"Error adding index {index.name} to {table.name} table: {str(e)}")
+
 def setup_database():
     with app.app_context():
         try:
@@ -40,6 +72,70 @@ def setup_database():
             except Exception as e:
                 print(f"Note: Could not add video columns (they may already exist): {str(e)}")
             
+            # Unreferenced media is kept for a grace period counted from
+            # when its last reference was dropped
+            try:
+                with db.engine.connect() as conn:
+                    result = conn.execute(text("SHOW COLUMNS FROM media_blobs LIKE 'released_at'"))
+                    if not result.fetchone():
+                        conn.execute(text("ALTER TABLE media_blobs ADD COLUMN released_at DATETIME NULL"))
+                        print("Added released_at column to media_blobs table")
+                    conn.commit()
+            except Exception as e:
+                print(f"Note: Could not add released_at column (it may already exist): {str(e)}")
+            
+            # Callbacks waiting for their payment are retried on a schedule
+            try:
+                with db.engine.connect() as conn:
+                    result = conn.execute(text("SHOW COLUMNS FROM mpesa_callbacks LIKE 'next_attempt_at'"))
+                    if not result.fetchone():
+                        conn.execute(text("ALTER TABLE mpesa_callbacks ADD COLUMN next_attempt_at DATETIME NULL"))
+                        print("Added next_attempt_at column to mpesa_callbacks table")
+                    conn.commit()
+            except Exception as e:
+                print(f"Note: Could not add next_attempt_at column (it may already exist): {str(e)}")
+            
+            # Chunked video uploads are assembled in the background and
+            # record why that failed
+            try:
+                with db.engine.connect() as conn:
+                    result = conn.execute(text("SHOW COLUMNS FROM video_uploads LIKE 'error'"))
+                    if not result.fetchone():
+                        conn.execute(text("ALTER TABLE video_uploads ADD COLUMN error VARCHAR(255) NULL"))
+                        print("Added error column to video_uploads table")
+                    conn.commit()
+            except Exception as e:
+                print(f"Note: Could not add error column (it may already exist): {str(e)}")
+            
+            # Sessions record every principal they are logged in as, one
+            # column per kind, instead of only the highest one
+            try:
+                with db.engine.connect() as conn:
+                    result = conn.execute(text("SHOW COLUMNS FROM sessions LIKE 'seller_id'"))
+                    if not result.fetchone():
+                        for kind in ('admin', 'seller', 'user'):
+                            conn.execute(text(f"ALTER TABLE sessions ADD COLUMN {kind}_id INT NULL"))
+                            conn.execute(text(
+                                f"UPDATE sessions SET {kind}_id = principal_id WHERE principal_kind = :kind"
+                            ), {'kind': kind})
+                        print("Added principal id columns to sessions table")
+                    conn.commit()
+            except Exception as e:
+                print(f"Note: Could not add session principal columns (they may already exist): {str(e)}")
+            
+            # create_all() skips tables that already exist, so add any indexes
+            # declared on the models that an older database is missing
+            add_missing_indexes()
+            
+            # Report rollup tables created just now start empty - fill them
+            # from the existing orders and accounts
+            try:
+                if backfill_summaries():
+                    print("Backfilled report summaries from existing history")
+            except Exception as e:
+                db.session.rollback()
+                print(f"Error backfilling report summaries: {str(e)}")
+            
             print("Database setup completed successfully!")
             print("Created tables:")
             for table in db.metadata.tables.keys():
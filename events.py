@@ -0,0 +1,154 @@
+from queue import Queue, Empty, Full
+from threading import Lock, Thread
+import json
+import time
+
+try:
+    import redis
+except ImportError:  # optional - only needed for EVENTS_REDIS_URL
+    redis = None
+
+class Subscription(object):
+    """Queue of events for one connected client"""
+
+    def __init__(self, channels, maxsize=100):
+        self.channels = channels
+        self.queue = Queue(maxsize)
+        self.overflowed = False
+
+    def get(self, timeout):
+        """Next (event, data, event_id) item, or None if nothing arrived in time"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except Empty:
+            return None
+
+class EventBroker(object):
+    """In-process pub/sub fanning events out to subscribed clients"""
+
+    def __init__(self):
+        self._subscribers = {}
+        self._lock = Lock()
+
+    def subscribe(self, *channels):
+        subscription = Subscription(channels)
+        with self._lock:
+            for channel in channels:
+                self._subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                subscribers = self._subscribers.get(channel)
+                if subscribers:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscribers[channel]
+
+    def deliver(self, channel, event, data, event_id=None):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            try:
+                subscription.queue.put_nowait((event, data, event_id))
+            except Full:
+                # A client that stopped reading is told to resync instead of
+                # holding up everyone else
+                subscription.overflowed = True
+
+    def publish(self, channel, event, data, event_id=None):
+        self.deliver(channel, event, data, event_id)
+
+class RedisEventBroker(EventBroker):
+    """Broker that relays events through a Redis-compatible server so that
+    clients connected to any worker receive them"""
+
+    def __init__(self, url, prefix='kukuhub:events:'):
+        if redis is None:
+            raise RuntimeError('EVENTS_REDIS_URL is set but the redis package is not installed')
+        super().__init__()
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        Thread(target=self._listen, daemon=True).start()
+
+    def publish(self, channel, event, data, event_id=None):
+        # Delivered locally by our own listener, like every other worker
+        self.client.publish(self.prefix + channel, json.dumps({'event': event, 'data': data, 'id': event_id}))
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(self.prefix + '*')
+                for message in pubsub.listen():
+                    channel = message['channel'].decode()[len(self.prefix):]
+                    payload = json.loads(message['data'])
+                    self.deliver(channel, payload['event'], payload['data'], payload.get('id'))
+            except Exception as e:
+                print(f"Event listener error, reconnecting: {str(e)}")
+                time.sleep(1)
+
+broker = EventBroker()
+
+def init_events(app):
+    """Relay events through Redis when EVENTS_REDIS_URL is configured"""
+    global broker
+    url = app.config.get('EVENTS_REDIS_URL')
+    if url:
+        broker = RedisEventBroker(url)
+
+def subscribe(*channels):
+    return broker.subscribe(*channels)
+
+def unsubscribe(subscription):
+    broker.unsubscribe(subscription)
+
+def publish(channel, event, data, event_id=None):
+    """Send an event to every client subscribed to `channel`
+
+    Call after the change has been committed. Errors are logged, never
+    raised - a missed push only means the client picks it up on its next
+    fetch. `event_id` is sent as the SSE id, which a reconnecting browser
+    sends back in the Last-Event-ID header.
+    """
+    try:
+        broker.publish(channel, event, data, event_id)
+    except Exception as e:
+        print(f"Error publishing {event} to {channel}: {str(e)}")
+
+def seller_channel(seller_id):
+    return f'seller:{seller_id}'
+
+def buyer_channel(email):
+    return f'buyer:{(email or "").lower()}'
+
+def format_event(event, data, event_id=None):
+    prefix = f'id: {event_id}\n' if event_id else ''
+    return f'{prefix}event: {event}\ndata: {json.dumps(data)}\n\n'
+
+def event_stream(subscription, replay=(), keepalive=15, lifetime=300):
+    """Server-sent events for a subscription
+
+    `replay` is a list of (event, data, event_id) items sent before the
+    live events - what the client missed while disconnected. Sends a
+    comment every `keepalive` seconds so proxies keep the connection open,
+    and ends after `lifetime` seconds so the browser reconnects
+    (EventSource does this automatically) and workers are recycled.
+    """
+    try:
+        yield 'retry: 3000\n\n'
+        for item in replay:
+            yield format_event(*item)
+        deadline = time.monotonic() + lifetime
+        while time.monotonic() < deadline:
+            if subscription.overflowed:
+                yield 'event: resync\ndata: {}\n\n'
+                return
+            item = subscription.get(timeout=keepalive)
+            if item is None:
+                yield ': keepalive\n\n'
+                continue
+            yield format_event(*item)
+    finally:
+        broker.unsubscribe(subscription)
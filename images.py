@@ -0,0 +1,97 @@
+import os
+from threading import Lock
+from jobs import JobQueue
+from media import URL_PREFIX, blob_sha, mark_pending, media_root
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # optional - without Pillow products only have the original image
+    Image = None
+
+# Widths generated for every uploaded image, smallest first. Images narrower
+# than a width are re-encoded at their own size rather than upscaled.
+VARIANT_WIDTHS = (320, 640, 1280)
+# (format key, file extension, Pillow format, save options)
+VARIANT_FORMATS = (
+    ('webp', '.webp', 'WEBP', {'quality': 80, 'method': 4}),
+    ('jpeg', '.jpg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+)
+
+image_jobs = JobQueue(workers=int(os.environ.get('IMAGE_WORKERS', 2)), max_jobs=1000)
+
+_queued = set()
+_failed = set()
+_lock = Lock()
+
+def _variant_name(sha256, width, ext):
+    return f'{sha256}_w{width}{ext}'
+
+def _source_path(root, image_url):
+    return os.path.join(root, image_url[len(URL_PREFIX):])
+
+def generate_variants(root, image_url):
+    """Write every missing resized copy of a stored image; runs on image_jobs"""
+    sha256 = blob_sha(image_url)
+    source = _source_path(root, image_url)
+    directory = os.path.dirname(source)
+    try:
+        with Image.open(source) as original:
+            image = ImageOps.exif_transpose(original).convert('RGB')
+        for width in VARIANT_WIDTHS:
+            resized = None
+            for _, ext, pil_format, options in VARIANT_FORMATS:
+                path = os.path.join(directory, _variant_name(sha256, width, ext))
+                if os.path.exists(path):
+                    continue
+                if resized is None:
+                    resized = image.copy()
+                    resized.thumbnail((width, width * 4))
+                # Written under a temp name so a half-written file is never served
+                tmp_path = path + '.part'
+                resized.save(tmp_path, pil_format, **options)
+                os.replace(tmp_path, path)
+    except Exception:
+        # Not a decodable image - don't keep queueing it
+        with _lock:
+            _failed.add(sha256)
+        raise
+    finally:
+        with _lock:
+            _queued.discard(sha256)
+
+def queue_variants(image_url, root=None):
+    """Generate variants for a media store image in the background"""
+    sha256 = blob_sha(image_url)
+    if Image is None or sha256 is None:
+        return
+    with _lock:
+        if sha256 in _queued or sha256 in _failed:
+            return
+        _queued.add(sha256)
+    image_jobs.submit(generate_variants, root or media_root(), image_url, max_attempts=1)
+
+def image_variants(image_url):
+    """Resized copies of an image as {format: {width: url}}
+
+    Empty until the variants exist; the first request for an image whose
+    variants are missing queues their generation, and clients fall back to
+    the original image meanwhile.
+    """
+    sha256 = blob_sha(image_url)
+    if Image is None or sha256 is None:
+        return {}
+
+    # The last file generate_variants writes marks a complete set
+    root = media_root()
+    last = _variant_name(sha256, VARIANT_WIDTHS[-1], VARIANT_FORMATS[-1][1])
+    if not os.path.exists(os.path.join(os.path.dirname(_source_path(root, image_url)), last)):
+        queue_variants(image_url, root)
+        if sha256 not in _failed:
+            mark_pending()
+        return {}
+
+    base = image_url[:image_url.rindex('/') + 1]
+    return dict(
+        (key, dict((str(width), base + _variant_name(sha256, width, ext)) for width in VARIANT_WIDTHS))
+        for key, ext, _, _ in VARIANT_FORMATS
+    )
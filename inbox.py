@@ -0,0 +1,65 @@
+from datetime import datetime
+from models import db, Message, SellerProfile
+from pagination import DEFAULT_PAGE_SIZE, decode_cursor, encode_cursor, keyset_condition
+
+# When a message last changed - a reply is always later than the message
+CHANGED_AT = db.func.coalesce(Message.replied_at, Message.created_at)
+
+def _inbox_query(email):
+    # Seller names come from an outer join rather than a lookup per message
+    return db.session.query(Message, SellerProfile.business_name).outerjoin(
+        SellerProfile, SellerProfile.seller_id == Message.seller_id
+    ).filter(Message.senderEmail == email)
+
+def change_token(msg):
+    """`since` token pointing just past a message's latest change"""
+    return encode_cursor('inbox-since', [msg.replied_at or msg.created_at, msg.message_id])
+
+def _since_token(email):
+    latest = db.session.query(CHANGED_AT, Message.message_id).filter(
+        Message.senderEmail == email
+    ).order_by(CHANGED_AT.desc(), Message.message_id.desc()).first()
+    if latest is None:
+        return encode_cursor('inbox-since', [datetime(1970, 1, 1), 0])
+    return encode_cursor('inbox-since', [latest[0], latest[1]])
+
+def buyer_inbox_page(email, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """One page of a buyer's messages, newest first
+
+    Returns (rows, next_cursor, since) where rows are (message, seller name)
+    pairs, next_cursor fetches older messages and `since` is the token to
+    poll buyer_inbox_changes with.
+    """
+    key = (Message.created_at, Message.message_id)
+    query = _inbox_query(email)
+    if cursor:
+        values = decode_cursor(cursor, 'inbox', (datetime, int))
+        query = query.filter(keyset_condition(key, values, descending=True))
+
+    rows = query.order_by(Message.created_at.desc(), Message.message_id.desc()).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1][0]
+        next_cursor = encode_cursor('inbox', [last.created_at, last.message_id])
+
+    return rows, next_cursor, _since_token(email)
+
+def buyer_inbox_changes(email, since, limit=DEFAULT_PAGE_SIZE):
+    """Messages sent or replied to after the `since` token, oldest change first
+
+    Returns (rows, since) - pass the new `since` back on the next poll. When
+    more than `limit` changes are waiting, poll again straight away.
+    """
+    key = (CHANGED_AT, Message.message_id)
+    values = decode_cursor(since, 'inbox-since', (datetime, int))
+
+    rows = _inbox_query(email).filter(
+        keyset_condition(key, values)
+    ).order_by(CHANGED_AT, Message.message_id).limit(limit).all()
+
+    if rows:
+        since = change_token(rows[-1][0])
+
+    return rows, since
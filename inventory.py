@@ -0,0 +1,86 @@
+from collections import OrderedDict
+import random
+import time
+from sqlalchemy.exc import OperationalError
+from models import db, Product
+
+# MySQL error codes worth retrying the whole transaction for
+DEADLOCK = 1213
+LOCK_WAIT_TIMEOUT = 1205
+MAX_ATTEMPTS = 3
+RETRY_BACKOFF = 0.05  # seconds, doubled on every attempt
+
+class StockError(Exception):
+    """An order line cannot be filled - unknown product or not enough stock"""
+
+def _merge_lines(items):
+    quantities = OrderedDict()
+    for product_id, quantity in items:
+        product_id, quantity = int(product_id), int(quantity)
+        if quantity <= 0:
+            raise StockError(f'Invalid quantity {quantity} for product {product_id}')
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    return quantities
+
+def _lock_products(product_ids):
+    # Lock rows in primary-key order so two checkouts touching the same
+    # products always queue up instead of deadlocking each other
+    products = Product.query.filter(
+        Product.product_id.in_(product_ids)
+    ).order_by(Product.product_id).with_for_update().all()
+    return dict((product.product_id, product) for product in products)
+
+def reserve_stock(items):
+    """Lock, check and decrement stock for (product_id, quantity) pairs
+
+    Must run inside the transaction that creates the order. Returns a list
+    of (product, quantity) with the product rows still locked, so prices
+    can be read from the database rather than trusted from the client.
+    """
+    quantities = _merge_lines(items)
+    if not quantities:
+        raise StockError('Order has no items')
+
+    products = _lock_products(sorted(quantities))
+
+    lines = []
+    for product_id, quantity in quantities.items():
+        product = products.get(product_id)
+        if product is None:
+            raise StockError(f'Product {product_id} not found')
+        if product.stock < quantity:
+            raise StockError(f'Only {product.stock} of {product.name} left in stock')
+        product.stock -= quantity
+        lines.append((product, quantity))
+
+    return lines
+
+def release_stock(items):
+    """Put (product_id, quantity) pairs back into stock, e.g. on cancellation"""
+    quantities = _merge_lines(items)
+    products = _lock_products(sorted(quantities))
+    for product_id, quantity in quantities.items():
+        product = products.get(product_id)
+        if product is not None:
+            product.stock += quantity
+
+def _is_retryable(error):
+    code = error.orig.args[0] if error.orig is not None and error.orig.args else None
+    return code in (DEADLOCK, LOCK_WAIT_TIMEOUT)
+
+def with_deadlock_retry(transaction):
+    """Run `transaction()` and retry it after a rollback if MySQL picks it as
+    a deadlock victim or times out waiting for a row lock
+
+    `transaction` must be safe to re-run from the start and should commit
+    itself.
+    """
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            return transaction()
+        except OperationalError as e:
+            db.session.rollback()
+            if not _is_retryable(e) or attempt == MAX_ATTEMPTS - 1:
+                raise
+            print(f"Transaction deadlocked, retrying (attempt {attempt + 2})")
+            time.sleep(RETRY_BACKOFF * (2 ** attempt) * (1 + random.random()))
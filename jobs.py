@@ -0,0 +1,91 @@
+from collections import OrderedDict
+from queue import Queue
+from threading import Lock, Thread, Timer
+import time
+import uuid
+
+class RetryableError(Exception):
+    """Raised by a job function when the attempt may succeed if retried"""
+
+class Job(object):
+    def __init__(self, func, args, max_attempts):
+        self.id = str(uuid.uuid4())
+        self.func = func
+        self.args = args
+        self.max_attempts = max_attempts
+        self.attempts = 0
+        self.status = 'queued'  # queued, running, retrying, done, failed
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+
+    def to_dict(self):
+        return {
+            'jobId': self.id,
+            'status': self.status,
+            'attempts': self.attempts,
+            'result': self.result,
+            'error': self.error
+        }
+
+class JobQueue(object):
+    """Worker threads running queued jobs, retrying with exponential backoff
+
+    Retries are re-queued on a timer rather than slept on, so a job waiting
+    out its backoff never occupies a worker. Finished jobs are kept (up to
+    `max_jobs`) so their outcome can be looked up by id.
+    """
+
+    def __init__(self, workers=4, base_delay=1.0, max_delay=30.0, max_jobs=10000):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_jobs = max_jobs
+        self.workers = workers
+        self._queue = Queue()
+        self._jobs = OrderedDict()
+        self._lock = Lock()
+        self._started = False
+
+    def submit(self, func, *args, max_attempts=3):
+        """Queue `func(*args)` and return the Job right away"""
+        job = Job(func, args, max_attempts)
+        with self._lock:
+            # Workers start with the first job, so importing a module that
+            # defines a queue starts no threads
+            if not self._started:
+                self._started = True
+                for _ in range(self.workers):
+                    Thread(target=self._work, daemon=True).start()
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.max_jobs:
+                self._jobs.popitem(last=False)
+        self._queue.put(job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            job.status = 'running'
+            job.attempts += 1
+            try:
+                job.result = job.func(*job.args)
+                job.status = 'done'
+            except RetryableError as e:
+                job.error = str(e)
+                if job.attempts < job.max_attempts:
+                    delay = min(self.max_delay, self.base_delay * (2 ** (job.attempts - 1)))
+                    print(f"Job {job.id} attempt {job.attempts} failed, retrying in {delay}s: {str(e)}")
+                    job.status = 'retrying'
+                    timer = Timer(delay, self._queue.put, args=(job,))
+                    timer.daemon = True
+                    timer.start()
+                else:
+                    job.status = 'failed'
+            except Exception as e:
+                print(f"Job {job.id} failed: {str(e)}")
+                job.error = str(e)
+                job.status = 'failed'
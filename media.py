@@ -0,0 +1,256 @@
+from datetime import datetime, timedelta
+import hashlib
+import os
+import re
+import tempfile
+import time
+from flask import Request, current_app, g, has_request_context
+from sqlalchemy import case, or_
+from sqlalchemy.exc import IntegrityError
+from werkzeug.exceptions import RequestEntityTooLarge
+from models import db, MediaBlob
+
+CHUNK_SIZE = 64 * 1024
+URL_PREFIX = '/static/uploads/'
+TMP_DIR = 'tmp'
+
+_BLOB_NAME = re.compile(r'^([0-9a-f]{2})/([0-9a-f]{2})/([0-9a-f]{64})(\.[a-z0-9]{1,5})?$')
+
+class MediaError(Exception):
+    """An upload was rejected (empty or larger than allowed) or is gone"""
+
+def media_root():
+    return current_app.config['UPLOAD_FOLDER']
+
+def _tmp_dir():
+    path = os.path.join(media_root(), TMP_DIR)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def _extension(filename):
+    ext = os.path.splitext(filename or '')[1].lower()
+    return ext if re.match(r'^\.[a-z0-9]{1,5}$', ext) else ''
+
+def blob_path(sha256, ext):
+    # Two levels of 256 directories keep every folder small
+    return f'{sha256[:2]}/{sha256[2:4]}/{sha256}{ext}'
+
+def mark_pending():
+    """Note that the current response refers to media still being processed
+
+    Such responses are not given catalogue ETags, so clients pick up the
+    finished variants or poster on their next request.
+    """
+    if has_request_context():
+        g.media_pending = True
+
+def media_url(blob):
+    return URL_PREFIX + blob.path
+
+def blob_sha(url):
+    """The SHA-256 of a media store URL, or None for any other URL"""
+    if not url or not url.startswith(URL_PREFIX):
+        return None
+    match = _BLOB_NAME.match(url[len(URL_PREFIX):])
+    return match.group(3) if match else None
+
+class HashingFile(object):
+    """Temp file in the media store that hashes what is written to it
+
+    Used as Werkzeug's spool file for multipart uploads, so a file part is
+    streamed to disk once and can be moved into place without re-reading.
+    A part growing past `max_bytes` is deleted and the request refused with
+    a 413. Removed on close unless the store adopted it.
+    """
+
+    def __init__(self, directory, max_bytes=None):
+        self.file = tempfile.NamedTemporaryFile(dir=directory, delete=False)
+        self.path = self.file.name
+        self.max_bytes = max_bytes
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.adopted = False
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_bytes and self.size > self.max_bytes:
+            self.close()
+            raise RequestEntityTooLarge(f'File is larger than {self.max_bytes // (1024 * 1024)} MB')
+        self.digest.update(data)
+        return self.file.write(data)
+
+    def close(self):
+        self.file.close()
+        if not self.adopted and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+class MediaRequest(Request):
+    """Request that spools uploaded files straight into the media store"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        # Multipart files are images; videos arrive in chunks as raw bodies
+        return HashingFile(_tmp_dir(), current_app.config.get('MEDIA_MAX_IMAGE_BYTES'))
+
+def _register(sha256, ext, size, content_type):
+    # Lock the row so a concurrent release cannot delete it under us
+    blob = MediaBlob.query.filter_by(sha256=sha256).with_for_update().first()
+    if blob is not None:
+        if blob.refcount == 0:
+            # Uploaded again while unreferenced - restart the grace period
+            # purge_orphans() gives it
+            blob.released_at = datetime.utcnow()
+        return blob
+    blob = MediaBlob(sha256=sha256, path=blob_path(sha256, ext), size=size, content_type=content_type, refcount=0)
+    try:
+        with db.session.begin_nested():
+            db.session.add(blob)
+    except IntegrityError:
+        # The same content was uploaded concurrently
+        blob = MediaBlob.query.filter_by(sha256=sha256).with_for_update().first()
+    return blob
+
+def _adopt(tmp_path, sha256, size, filename, content_type, max_bytes):
+    try:
+        if size == 0:
+            raise MediaError('File is empty')
+        if max_bytes and size > max_bytes:
+            raise MediaError(f'File is larger than {max_bytes // (1024 * 1024)} MB')
+        blob = _register(sha256, _extension(filename), size, content_type)
+        final_path = os.path.join(media_root(), blob.path)
+        if os.path.exists(final_path):
+            # Already stored - the duplicate is dropped
+            os.remove(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            os.replace(tmp_path, final_path)
+        return blob
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def store_upload(file, max_bytes=None):
+    """Store a werkzeug FileStorage and return its MediaBlob
+
+    Identical content is kept once. The blob starts unreferenced; attach it
+    to a product with acquire(). The caller commits.
+    """
+    stream = file.stream
+    if isinstance(stream, HashingFile):
+        stream.flush()
+        stream.adopted = True
+        return _adopt(stream.path, stream.digest.hexdigest(), stream.size,
+                      file.filename, file.mimetype, max_bytes)
+    return store_stream(stream, file.filename, file.mimetype, max_bytes)
+
+def store_stream(stream, filename, content_type=None, max_bytes=None):
+    """Copy a readable stream into the store in chunks; see store_upload"""
+    digest = hashlib.sha256()
+    size = 0
+    handle, tmp_path = tempfile.mkstemp(dir=_tmp_dir())
+    try:
+        with os.fdopen(handle, 'wb') as out:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if max_bytes and size > max_bytes:
+                    raise MediaError(f'File is larger than {max_bytes // (1024 * 1024)} MB')
+                digest.update(chunk)
+                out.write(chunk)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    return _adopt(tmp_path, digest.hexdigest(), size, filename, content_type, max_bytes)
+
+def acquire(url):
+    """Count a new reference to a media store URL (other URLs are ignored)
+
+    Raises MediaError when the URL's file is no longer in the store.
+    """
+    sha256 = blob_sha(url)
+    if sha256 is None:
+        return
+    table = MediaBlob.__table__
+    result = db.session.execute(
+        table.update().where(table.c.sha256 == sha256).values(refcount=table.c.refcount + 1)
+    )
+    if not result.rowcount:
+        raise MediaError('This file is no longer available, please upload it again')
+
+def release(url):
+    """Drop a reference to a media store URL
+
+    Unreferenced blobs are kept: the same content may have just been
+    uploaded again under the same URL. purge_orphans() removes them once
+    they have stayed unreferenced for its grace period.
+    """
+    sha256 = blob_sha(url)
+    if sha256 is None:
+        return
+    table = MediaBlob.__table__
+    db.session.execute(
+        table.update().where(table.c.sha256 == sha256, table.c.refcount > 0).values(
+            refcount=table.c.refcount - 1,
+            released_at=case((table.c.refcount == 1, datetime.utcnow()), else_=table.c.released_at)
+        )
+    )
+
+def remove_files(paths):
+    """Delete purged blob files - call before the purging commit, while
+    their rows are still locked
+
+    Files derived from a blob (named <sha256>_<suffix>, e.g. resized
+    images) are removed with it.
+    """
+    root = media_root()
+    for path in paths:
+        full_path = os.path.join(root, path)
+        sha256 = os.path.splitext(os.path.basename(path))[0]
+        directory = os.path.dirname(full_path)
+        derived = [os.path.join(directory, name) for name in os.listdir(directory)
+                   if name.startswith(sha256 + '_')] if os.path.isdir(directory) else []
+        for file_path in [full_path] + derived:
+            try:
+                os.remove(file_path)
+            except OSError as e:
+                print(f"Error removing media file {file_path}: {str(e)}")
+
+def purge_orphans(max_age=timedelta(days=1)):
+    """Delete uploads no product has referred to for `max_age`, and stale
+    temp files
+
+    The orphans are selected FOR UPDATE, so their refcount is checked under
+    the row lock, and their files are removed before the commit releases
+    it. An acquire() or a re-upload of the same content waits for the lock
+    and then finds the row gone: the re-upload stores the file afresh
+    rather than being matched to a file about to be deleted.
+    """
+    cutoff = datetime.utcnow() - max_age
+    try:
+        orphans = MediaBlob.query.filter(
+            MediaBlob.refcount == 0,
+            MediaBlob.created_at < cutoff,
+            or_(MediaBlob.released_at.is_(None), MediaBlob.released_at < cutoff)
+        ).with_for_update().all()
+        paths = [blob.path for blob in orphans]
+        for blob in orphans:
+            db.session.delete(blob)
+        db.session.flush()
+        remove_files(paths)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    tmp_dir = _tmp_dir()
+    cutoff_ts = time.time() - max_age.total_seconds()
+    for name in os.listdir(tmp_dir):
+        path = os.path.join(tmp_dir, name)
+        if os.path.isfile(path) and os.path.getmtime(path) < cutoff_ts:
+            os.remove(path)
+    return len(paths)
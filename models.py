@@ -1,9 +1,35 @@
 
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.orm import Session
 from datetime import datetime
 
 db = SQLAlchemy()
 
+def on_outermost_commit(key):
+    """Run the decorated callback with `session.info[key]` once the outermost
+    transaction commits, and drop the value if it rolls back instead
+
+    after_commit and after_rollback also fire when a savepoint is released or
+    rolled back, so those are ignored. The callback gets (session, value) and
+    is only called when a value was left under `key`.
+    """
+    def register(callback):
+        @event.listens_for(Session, 'after_commit')
+        def _commit(session):
+            if session.in_nested_transaction():
+                return
+            value = session.info.pop(key, None)
+            if value:
+                callback(session, value)
+
+        @event.listens_for(Session, 'after_rollback')
+        def _rollback(session):
+            if not session.in_nested_transaction():
+                session.info.pop(key, None)
+        return callback
+    return register
+
 class User(db.Model):
     __tablename__ = 'users'
     
@@ -60,6 +86,18 @@ class Product(db.Model):
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    # Composite indexes backing the keyset-paginated catalogue listing - each
+    # filter/sort combination ends in the (sort key, product_id) cursor columns
+    __table_args__ = (
+        db.Index('ix_products_created', 'created_at', 'product_id'),
+        db.Index('ix_products_category_created', 'category', 'created_at', 'product_id'),
+        db.Index('ix_products_seller_created', 'seller_id', 'created_at', 'product_id'),
+        db.Index('ix_products_price', 'price', 'product_id'),
+        db.Index('ix_products_category_price', 'category', 'price', 'product_id'),
+        # Product search (search.py); MySQL keeps it current on every write
+        db.Index('ft_products_search', 'name', 'description', 'category', mysql_prefix='FULLTEXT'),
+    )
 
 class Message(db.Model):
     __tablename__ = 'messages'
@@ -90,6 +128,12 @@ class Message(db.Model):
     
     is_read = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Buyer inbox (looked up by sender email) and seller inbox, newest first
+    __table_args__ = (
+        db.Index('ix_messages_sender_created', 'senderEmail', 'created_at'),
+        db.Index('ix_messages_seller_created', 'seller_id', 'created_at'),
+    )
 
 # Cart and Order Models
 class CartItem(db.Model):
@@ -105,6 +149,49 @@ class CartItem(db.Model):
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    # One row per product per cart, so changes can be applied as upserts
+    __table_args__ = (
+        db.Index('uq_cart_items_user_product', 'user_id', 'product_id', unique=True),
+    )
+
+class Cart(db.Model):
+    __tablename__ = 'carts'
+    
+    # Bumped on every cart change; clients send the version they last saw so
+    # a stale sync is rejected instead of overwriting newer changes
+    user_id = db.Column(db.Integer, db.ForeignKey('users.user_id'), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+class SessionRecord(db.Model):
+    __tablename__ = 'sessions'
+    
+    # SHA-256 of the cookie token, so the table never holds a usable cookie
+    session_id = db.Column(db.String(64), primary_key=True)
+    # Compact principal record - who is logged in, without a profile lookup.
+    # A browser can be logged in as more than one kind at once.
+    admin_id = db.Column(db.Integer, nullable=True)
+    seller_id = db.Column(db.Integer, nullable=True)
+    user_id = db.Column(db.Integer, nullable=True)
+    approval_status = db.Column(db.String(20), nullable=True)
+    data = db.Column(db.Text, nullable=False, default='{}')  # any other session keys, as JSON
+    expires_at = db.Column(db.DateTime, nullable=False)
+    
+    # Bulk revocation by principal, and purging expired sessions
+    __table_args__ = (
+        db.Index('ix_sessions_admin', 'admin_id'),
+        db.Index('ix_sessions_seller', 'seller_id'),
+        db.Index('ix_sessions_user', 'user_id'),
+        db.Index('ix_sessions_expires', 'expires_at'),
+    )
+
+class CatalogVersion(db.Model):
+    __tablename__ = 'catalog_version'
+    
+    # A single row, bumped after every committed change to products or
+    # sellers; catalogue ETags are derived from it
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
 
 class Order(db.Model):
     __tablename__ = 'orders'
@@ -118,6 +205,14 @@ class Order(db.Model):
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    # Back the admin order listing (newest-first paging, status filter and
+    # the filtered COUNT(*)) and the buyer's own order history
+    __table_args__ = (
+        db.Index('ix_orders_created', 'created_at'),
+        db.Index('ix_orders_status_created', 'status', 'created_at'),
+        db.Index('ix_orders_user_created', 'user_id', 'created_at'),
+    )
 
 class OrderItem(db.Model):
     __tablename__ = 'order_items'
@@ -130,3 +225,122 @@ class OrderItem(db.Model):
     
     order = db.relationship('Order', backref=db.backref('items', lazy=True))
     product = db.relationship('Product', backref=db.backref('order_items', lazy=True))
+
+class PaymentTransaction(db.Model):
+    __tablename__ = 'payment_transactions'
+
+    id = db.Column(db.Integer, primary_key=True)
+    checkout_request_id = db.Column(db.String(64), nullable=False)
+    merchant_request_id = db.Column(db.String(64), nullable=True)
+    order_id = db.Column(db.String(36), db.ForeignKey('orders.order_id'), nullable=True)
+    phone_number = db.Column(db.String(20), nullable=False)
+    amount = db.Column(db.Float, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, completed, failed
+    result_code = db.Column(db.Integer, nullable=True)
+    result_desc = db.Column(db.String(255), nullable=True)
+    receipt_number = db.Column(db.String(32), nullable=True)
+
+    order = db.relationship('Order', backref=db.backref('payments', lazy=True))
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # Callbacks and status polls look payments up by CheckoutRequestID
+    __table_args__ = (
+        db.Index('uq_payment_transactions_checkout', 'checkout_request_id', unique=True),
+        db.Index('ix_payment_transactions_order', 'order_id'),
+    )
+
+class MpesaCallback(db.Model):
+    __tablename__ = 'mpesa_callbacks'
+
+    # Callbacks are stored as they arrive and applied in batches by
+    # payments.CallbackConsumer; processed_at stays NULL until then
+    id = db.Column(db.Integer, primary_key=True)
+    checkout_request_id = db.Column(db.String(64), nullable=False)
+    result_code = db.Column(db.Integer, nullable=True)
+    result_desc = db.Column(db.String(255), nullable=True)
+    receipt_number = db.Column(db.String(32), nullable=True)
+    payload = db.Column(db.Text, nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.String(255), nullable=True)
+    received_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Callbacks waiting for their payment row are not retried before this
+    next_attempt_at = db.Column(db.DateTime, nullable=True, default=datetime.utcnow)
+    processed_at = db.Column(db.DateTime, nullable=True)
+
+    # The unique key drops repeated deliveries of the same callback
+    __table_args__ = (
+        db.Index('uq_mpesa_callbacks_checkout', 'checkout_request_id', unique=True),
+        db.Index('ix_mpesa_callbacks_due', 'processed_at', 'next_attempt_at'),
+    )
+
+# Report rollups - one row per day (and seller/category), kept current by
+# reports.py just after orders and accounts are committed and rebuilt from
+# raw history by rebuild_reports.py. Monthly figures are sums over the daily
+# rows.
+class DailyStats(db.Model):
+    __tablename__ = 'report_daily_stats'
+    
+    day = db.Column(db.Date, primary_key=True)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+    sales = db.Column(db.Float, nullable=False, default=0)
+    new_users = db.Column(db.Integer, nullable=False, default=0)
+    new_sellers = db.Column(db.Integer, nullable=False, default=0)
+
+class SellerDailySales(db.Model):
+    __tablename__ = 'report_seller_daily_sales'
+    
+    day = db.Column(db.Date, primary_key=True)
+    seller_id = db.Column(db.Integer, db.ForeignKey('seller_profile.seller_id'), primary_key=True)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0)
+    
+    __table_args__ = (
+        db.Index('ix_report_seller_daily_sales_seller', 'seller_id', 'day'),
+    )
+
+class CategoryDailySales(db.Model):
+    __tablename__ = 'report_category_daily_sales'
+    
+    day = db.Column(db.Date, primary_key=True)
+    category = db.Column(db.String(100), primary_key=True)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0)
+
+class MediaBlob(db.Model):
+    __tablename__ = 'media_blobs'
+    
+    # Uploaded files are stored once per distinct content, named by their
+    # SHA-256, and purged once no product has referred to them for a while
+    sha256 = db.Column(db.String(64), primary_key=True)
+    path = db.Column(db.String(255), nullable=False)  # relative to UPLOAD_FOLDER
+    size = db.Column(db.BigInteger, nullable=False)
+    content_type = db.Column(db.String(100), nullable=True)
+    refcount = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    released_at = db.Column(db.DateTime, nullable=True)  # when refcount last dropped to 0
+
+class VideoUpload(db.Model):
+    __tablename__ = 'video_uploads'
+    
+    # A resumable chunked upload; chunks are kept on disk until the upload
+    # is completed and assembled into the media store
+    upload_id = db.Column(db.String(36), primary_key=True)  # UUID
+    seller_id = db.Column(db.Integer, db.ForeignKey('seller_profile.seller_id'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.product_id'), nullable=True)
+    filename = db.Column(db.String(255), nullable=False)
+    content_type = db.Column(db.String(100), nullable=True)
+    size = db.Column(db.BigInteger, nullable=False)
+    chunk_size = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='uploading')  # uploading, assembling, complete, failed
+    video_url = db.Column(db.String(255), nullable=True)
+    error = db.Column(db.String(255), nullable=True)  # why assembly failed
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_video_uploads_status_created', 'status', 'created_at'),
+    )
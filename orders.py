@@ -0,0 +1,83 @@
+from datetime import datetime
+from sqlalchemy.orm import joinedload, selectinload
+from inventory import release_stock, reserve_stock
+from models import db, Order, OrderItem, Product, User
+from pagination import DEFAULT_PAGE_SIZE, decode_cursor, encode_cursor, keyset_condition
+from reports import record_status_change
+
+USER_ORDER_KEY = (Order.created_at, Order.order_id)
+
+def _items_option():
+    # One extra SELECT ... WHERE order_id IN (...) for the items of the whole
+    # page, with each item's product joined into it
+    return selectinload(Order.items).options(
+        joinedload(OrderItem.product).load_only(Product.name, Product.image_url)
+    )
+
+def orders_query():
+    """Order query that bulk-loads items, their products and the buyer"""
+    return Order.query.options(
+        joinedload(Order.user).load_only(User.username, User.email),
+        _items_option()
+    )
+
+def admin_orders_page(status=None, date_from=None, date_to=None, page=1, page_size=50):
+    """Get one page of orders for the admin listing
+
+    Returns (orders, total). The count runs on the same filters without
+    loading any rows, so it is answered from the (status, created_at) or
+    created_at index rather than a scan of the orders table.
+    """
+    filters = []
+    if status:
+        filters.append(Order.status == status)
+    if date_from:
+        filters.append(Order.created_at >= date_from)
+    if date_to:
+        filters.append(Order.created_at < date_to)
+
+    total = db.session.query(db.func.count(Order.order_id)).filter(*filters).scalar()
+
+    orders = orders_query().filter(*filters).order_by(
+        Order.created_at.desc(), Order.order_id.desc()
+    ).offset((page - 1) * page_size).limit(page_size).all()
+
+    return orders, total
+
+def user_orders_page(user_id, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """Get one page of a buyer's order history, newest first
+
+    Always two queries - orders, then items with their products - walking
+    the (user_id, created_at) index. Returns (orders, next_cursor).
+    """
+    query = Order.query.options(_items_option()).filter(Order.user_id == user_id)
+    if cursor:
+        values = decode_cursor(cursor, 'orders', (datetime, str))
+        query = query.filter(keyset_condition(USER_ORDER_KEY, values, descending=True))
+
+    orders = query.order_by(Order.created_at.desc(), Order.order_id.desc()).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(orders) > limit:
+        orders = orders[:limit]
+        last = orders[-1]
+        next_cursor = encode_cursor('orders', [last.created_at, last.order_id])
+
+    return orders, next_cursor
+
+def change_order_status(order, status):
+    """Move an order to `status`, adjusting stock and the sales rollups
+
+    Cancelled orders give their stock back; reinstating one takes it again
+    (raising StockError if it has since sold out). The caller commits.
+    """
+    old_status = order.status
+    order.status = status
+    
+    lines = [(item.product_id, item.quantity) for item in order.items]
+    if status == 'Cancelled' and old_status != 'Cancelled':
+        release_stock(lines)
+    elif old_status == 'Cancelled' and status != 'Cancelled':
+        reserve_stock(lines)
+    
+    record_status_change(order, old_status)
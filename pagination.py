@@ -0,0 +1,58 @@
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import and_, or_
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+
+class PaginationError(ValueError):
+    pass
+
+def parse_limit(value, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    """Parse a ?limit= argument, clamped to 1..maximum"""
+    if value in (None, ''):
+        return default
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise PaginationError(f'Invalid limit: {value}')
+    return max(1, min(limit, maximum))
+
+def encode_cursor(kind, values):
+    """Encode the sort key of the last row on a page as an opaque token"""
+    payload = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps({'k': kind, 'v': payload}, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(token, kind, types):
+    """Decode a cursor token, checking it was issued for the same ordering
+
+    `types` gives the Python type of each key column so timestamps come back
+    as datetimes.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        data = json.loads(raw)
+        if data['k'] != kind or len(data['v']) != len(types):
+            raise PaginationError('Cursor does not match the requested ordering')
+        return [
+            datetime.fromisoformat(v) if t is datetime else t(v)
+            for v, t in zip(data['v'], types)
+        ]
+    except PaginationError:
+        raise
+    except Exception:
+        raise PaginationError('Invalid cursor')
+
+def keyset_condition(columns, values, descending=False):
+    """WHERE clause selecting rows strictly after `values` in `columns` order
+
+    (a, b) > (x, y) is spelled a > x OR (a = x AND b > y) so MySQL can use a
+    range scan on an index over the same columns.
+    """
+    clauses = []
+    for i, (column, value) in enumerate(zip(columns, values)):
+        step = column < value if descending else column > value
+        clauses.append(and_(*[c == v for c, v in zip(columns[:i], values[:i])], step))
+    return or_(*clauses)
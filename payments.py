@@ -0,0 +1,277 @@
+from datetime import datetime, timedelta
+import json
+import math
+from threading import Event, Lock, Thread
+import time
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
+from cache import LRUCache
+from models import db, MpesaCallback, Order, PaymentTransaction
+from orders import change_order_status
+
+# /status is polled every few seconds per checkout. Settled payments never
+# change so they are cached for long; pending ones only briefly, so a
+# callback handled by another worker shows up within PENDING_STATUS_TTL.
+STATUS_CACHE_SIZE = 4096
+PENDING_STATUS_TTL = 2  # seconds
+FINAL_STATUS_TTL = 3600  # seconds
+
+_status_cache = LRUCache(STATUS_CACHE_SIZE)
+
+# Callbacks applied per transaction, and how long a callback may wait for
+# its payment row (stored by the push job) before it is dropped. A waiting
+# callback is retried after RETRY_DELAY seconds, doubling up to MAX_RETRY_DELAY.
+CALLBACK_BATCH_SIZE = 100
+CALLBACK_MAX_WAIT = 300  # seconds
+CALLBACK_RETRY_DELAY = 1  # seconds
+CALLBACK_MAX_RETRY_DELAY = 30  # seconds
+
+def payment_dict(transaction):
+    return {
+        'checkoutRequestID': transaction.checkout_request_id,
+        'orderId': transaction.order_id,
+        'amount': transaction.amount,
+        'status': transaction.status,
+        'resultDesc': transaction.result_desc,
+        'receiptNumber': transaction.receipt_number,
+        'timestamp': transaction.created_at.isoformat() if transaction.created_at else None
+    }
+
+def _cache_status(checkout_request_id, value):
+    ttl = PENDING_STATUS_TTL if value['status'] == 'pending' else FINAL_STATUS_TTL
+    expires_at = time.time() + ttl
+    _status_cache.set(checkout_request_id, value, expires_at, expires_at)
+
+def record_payment(checkout_request_id, merchant_request_id, phone_number, amount, order_id=None):
+    """Store a payment M-Pesa accepted, as pending until its callback arrives"""
+    transaction = PaymentTransaction(
+        checkout_request_id=checkout_request_id,
+        merchant_request_id=merchant_request_id,
+        order_id=order_id,
+        phone_number=phone_number,
+        amount=amount,
+        status='pending'
+    )
+    db.session.add(transaction)
+    db.session.commit()
+    _cache_status(checkout_request_id, payment_dict(transaction))
+    return transaction
+
+def order_amount(order):
+    """Amount to charge for an order - M-Pesa only takes whole shillings"""
+    return int(math.ceil(order.total))
+
+def callback_amount(payload):
+    """The amount paid according to a stored stkCallback payload, if present"""
+    try:
+        items = json.loads(payload or '{}').get('CallbackMetadata', {}).get('Item', [])
+    except ValueError:
+        return None
+    for item in items:
+        if item.get('Name') == 'Amount':
+            try:
+                return float(item.get('Value'))
+            except (TypeError, ValueError):
+                return None
+    return None
+
+def callback_receipt(stk_callback):
+    """The M-Pesa receipt number from a successful stkCallback, if present"""
+    items = stk_callback.get('CallbackMetadata', {}).get('Item', [])
+    for item in items:
+        if item.get('Name') == 'MpesaReceiptNumber':
+            return str(item.get('Value'))
+    return None
+
+def enqueue_callback(checkout_request_id, result_code, result_desc, receipt_number=None, payload=None):
+    """Store a callback for the consumer to apply
+
+    Returns False when the same CheckoutRequestID was already received -
+    M-Pesa may deliver a callback more than once.
+    """
+    try:
+        db.session.add(MpesaCallback(
+            checkout_request_id=checkout_request_id,
+            result_code=result_code,
+            result_desc=(result_desc or '')[:255],
+            receipt_number=receipt_number,
+            payload=payload
+        ))
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return False
+    
+    if consumer is not None:
+        consumer.notify()
+    return True
+
+def _settle_order(order, status, paid):
+    """Move a Pending order on once its payment is final
+
+    Stock was taken when the order was created: payment confirms it, a
+    failed payment cancels the order and puts the stock back. Orders
+    someone has already moved on are left alone. Returns an error for a
+    completed payment that does not cover the order, which stays Pending.
+    """
+    if order is None or order.status != 'Pending':
+        return None
+    if status == 'completed':
+        if paid is None or paid < order_amount(order):
+            print(f"Payment of {paid} does not cover order {order.order_id} ({order.total}); order left Pending")
+            return 'Amount does not match order total'
+        change_order_status(order, 'Processing')
+    else:
+        change_order_status(order, 'Cancelled')
+    return None
+
+def process_callback_batch(limit=CALLBACK_BATCH_SIZE):
+    """Apply up to `limit` stored callbacks in one transaction
+
+    Returns the number of callbacks applied. Rows are locked with SKIP
+    LOCKED so consumers in several workers share the queue without
+    applying a callback twice. Callbacks still waiting for their
+    payment row are skipped until their next attempt is due, so they never
+    hold up the ones behind them.
+    """
+    now = datetime.utcnow()
+    callbacks = MpesaCallback.query.filter(
+        MpesaCallback.processed_at.is_(None),
+        or_(MpesaCallback.next_attempt_at.is_(None), MpesaCallback.next_attempt_at <= now)
+    ).order_by(MpesaCallback.id).limit(limit).with_for_update(skip_locked=True).all()
+    if not callbacks:
+        db.session.commit()
+        return 0
+    
+    transactions = dict(
+        (transaction.checkout_request_id, transaction)
+        for transaction in PaymentTransaction.query.filter(
+            PaymentTransaction.checkout_request_id.in_([c.checkout_request_id for c in callbacks])
+        ).order_by(PaymentTransaction.checkout_request_id).with_for_update()
+    )
+    order_ids = set(t.order_id for t in transactions.values() if t.order_id and t.status == 'pending')
+    orders = {}
+    if order_ids:
+        orders = dict(
+            (order.order_id, order)
+            for order in Order.query.options(selectinload(Order.items)).filter(
+                Order.order_id.in_(order_ids)
+            ).order_by(Order.order_id).with_for_update()
+        )
+    
+    give_up_before = now - timedelta(seconds=CALLBACK_MAX_WAIT)
+    applied = 0
+    settled = []
+    for callback in callbacks:
+        callback.attempts += 1
+        transaction = transactions.get(callback.checkout_request_id)
+        if transaction is None:
+            # The push job may not have stored the payment yet; try again on
+            # a later batch before giving up
+            if callback.received_at < give_up_before:
+                callback.error = 'Unknown CheckoutRequestID'
+                callback.processed_at = now
+                print(f"Callback for unknown CheckoutRequestID {callback.checkout_request_id} dropped")
+            else:
+                delay = min(CALLBACK_RETRY_DELAY * 2 ** (callback.attempts - 1), CALLBACK_MAX_RETRY_DELAY)
+                callback.next_attempt_at = now + timedelta(seconds=delay)
+            continue
+        
+        if transaction.status == 'pending':
+            transaction.status = 'completed' if callback.result_code == 0 else 'failed'
+            transaction.result_code = callback.result_code
+            transaction.result_desc = callback.result_desc
+            transaction.receipt_number = callback.receipt_number
+            callback.error = _settle_order(
+                orders.get(transaction.order_id), transaction.status, callback_amount(callback.payload)
+            )
+            settled.append(transaction)
+        callback.processed_at = now
+        applied += 1
+    
+    db.session.commit()
+    
+    for transaction in settled:
+        _cache_status(transaction.checkout_request_id, payment_dict(transaction))
+    return applied
+
+class CallbackConsumer(object):
+    """Background thread applying stored callbacks in batches
+
+    Woken as soon as a callback is stored, and every `interval` seconds to
+    pick up callbacks received by other workers or left by a failed batch.
+    """
+
+    def __init__(self, app, batch_size=CALLBACK_BATCH_SIZE, interval=1.0):
+        self.app = app
+        self.batch_size = batch_size
+        self.interval = interval
+        self.processed = 0
+        self.batches = 0
+        self._wakeup = Event()
+        self._started = False
+        self._start_lock = Lock()
+
+    def start(self):
+        with self._start_lock:
+            if not self._started:
+                self._started = True
+                Thread(target=self._run, daemon=True).start()
+
+    def notify(self):
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            with self.app.app_context():
+                try:
+                    while True:
+                        count = process_callback_batch(self.batch_size)
+                        if count:
+                            self.processed += count
+                            self.batches += 1
+                        if count < self.batch_size:
+                            break
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"Error processing M-Pesa callbacks: {str(e)}")
+                finally:
+                    db.session.remove()
+
+consumer = None
+
+def init_payments(app):
+    """Set up the callback consumer for this process
+
+    The consumer thread starts with the first request the app handles, so
+    scripts that merely import the app never start polling the database.
+    Set MPESA_CALLBACK_CONSUMER to False to leave callbacks to other
+    processes.
+    """
+    global consumer
+    consumer = CallbackConsumer(
+        app,
+        batch_size=app.config.get('MPESA_CALLBACK_BATCH_SIZE', CALLBACK_BATCH_SIZE),
+        interval=app.config.get('MPESA_CALLBACK_POLL_INTERVAL', 1.0)
+    )
+    if app.config.get('MPESA_CALLBACK_CONSUMER', True):
+        @app.before_request
+        def _start_consumer():
+            if not consumer._started:
+                consumer.start()
+
+def payment_status(checkout_request_id):
+    """Cached payment_dict for a CheckoutRequestID, or None if unknown"""
+    entry = _status_cache.get(checkout_request_id)
+    if entry is not None:
+        return entry[0]
+
+    transaction = PaymentTransaction.query.filter_by(checkout_request_id=checkout_request_id).first()
+    if transaction is None:
+        return None
+    value = payment_dict(transaction)
+    _cache_status(checkout_request_id, value)
+    return value
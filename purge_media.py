@@ -0,0 +1,19 @@
+from app import app
+from media import purge_orphans
+from videos import purge_stale_uploads
+
+def purge_media():
+    """Delete uploaded files that were never attached to a product"""
+    with app.app_context():
+        try:
+            abandoned = purge_stale_uploads()
+            print(f"Removed {abandoned} abandoned video uploads")
+            removed = purge_orphans()
+            print(f"Removed {removed} unreferenced media files")
+            return True
+        except Exception as e:
+            print(f"Error purging media: {str(e)}")
+            return False
+
+if __name__ == "__main__":
+    purge_media()
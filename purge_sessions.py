@@ -0,0 +1,16 @@
+from app import app
+from sessions import purge_expired_sessions
+
+def purge_sessions():
+    """Delete expired sessions from the sessions table"""
+    with app.app_context():
+        try:
+            removed = purge_expired_sessions()
+            print(f"Removed {removed} expired sessions")
+            return True
+        except Exception as e:
+            print(f"Error purging sessions: {str(e)}")
+            return False
+
+if __name__ == "__main__":
+    purge_sessions()
@@ -0,0 +1,16 @@
+from app import app
+from reports import rebuild_summaries
+
+def rebuild_reports():
+    """Backfill the report rollup tables from the full order and account history"""
+    with app.app_context():
+        try:
+            rebuild_summaries()
+            print("Report summaries rebuilt successfully")
+            return True
+        except Exception as e:
+            print(f"Error rebuilding report summaries: {str(e)}")
+            return False
+
+if __name__ == "__main__":
+    rebuild_reports()
@@ -0,0 +1,277 @@
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import object_session
+from models import db, on_outermost_commit, User, SellerProfile, Product, Order, OrderItem, DailyStats, SellerDailySales, CategoryDailySales
+
+# What the rollups count:
+# - orders/sales: orders that are not Cancelled, at their order total
+# - seller revenue: the seller's own line items (price x quantity)
+# - seller units: items sold, summed over quantities
+# - category orders/units/revenue: as for sellers, by product category
+# - new users/sellers: accounts by the day they were created; deleting an
+#   account takes it back out
+# Cancelling an order takes it back out; reinstating it adds it again.
+EXCLUDED_STATUSES = ('Cancelled',)
+
+def counts_toward_sales(status):
+    return status not in EXCLUDED_STATUSES
+
+def _queue(key, deltas, session=None):
+    """Add `deltas` to the rollup row `key` once the current transaction commits
+
+    Checkouts hold product row locks until they commit, so every one of
+    them bumping today's row in the same transaction would serialize them
+    all on it. The changes are kept in session.info instead and applied
+    by _apply_queued in a short transaction of their own.
+    """
+    pending = (session or db.session).info.setdefault('report_deltas', {})
+    totals = pending.setdefault(key, defaultdict(int))
+    for name, delta in deltas.items():
+        totals[name] += delta
+
+def _bump(conn, model, key, deltas):
+    """Add `deltas` to the rollup row identified by `key`, creating it if needed"""
+    table = model.__table__
+    where = [table.c[name] == value for name, value in key]
+    values = {name: table.c[name] + delta for name, delta in deltas.items()}
+
+    if conn.execute(table.update().where(*where).values(values)).rowcount:
+        return
+    try:
+        with conn.begin_nested():
+            conn.execute(table.insert().values(**dict(key), **deltas))
+    except IntegrityError:
+        # Another transaction created the row between our UPDATE and INSERT
+        conn.execute(table.update().where(*where).values(values))
+
+@on_outermost_commit('report_deltas')
+def _apply_queued(session, pending):
+    try:
+        with db.engine.begin() as conn:
+            # Rows in a fixed order so concurrent appliers cannot deadlock
+            for (model, key) in sorted(pending, key=lambda k: (k[0].__tablename__, repr(k[1]))):
+                deltas = dict(pending[(model, key)])
+                if any(deltas.values()):
+                    _bump(conn, model, key, deltas)
+    except Exception as e:
+        # The order itself is committed; rebuild_reports.py repairs the rollups
+        print(f"Error updating report rollups: {str(e)}")
+
+def _apply_order(order, items, sign):
+    day = (order.created_at or datetime.utcnow()).date()
+    product_ids = [item.product_id for item in items]
+    products = dict(
+        (row.product_id, row) for row in db.session.query(
+            Product.product_id, Product.seller_id, Product.category
+        ).filter(Product.product_id.in_(product_ids))
+    ) if product_ids else {}
+
+    by_seller = defaultdict(lambda: [0, 0.0])
+    by_category = defaultdict(lambda: [0, 0.0])
+    for item in items:
+        product = products.get(item.product_id)
+        if not product:
+            continue
+        for bucket in (by_seller[product.seller_id], by_category[product.category]):
+            bucket[0] += item.quantity
+            bucket[1] += item.price * item.quantity
+
+    _queue((DailyStats, (('day', day),)), {'orders': sign, 'sales': sign * order.total})
+    for seller_id, (units, revenue) in by_seller.items():
+        _queue((SellerDailySales, (('day', day), ('seller_id', seller_id))),
+               {'orders': sign, 'units': sign * units, 'revenue': sign * revenue})
+    for category, (units, revenue) in by_category.items():
+        _queue((CategoryDailySales, (('day', day), ('category', category))),
+               {'orders': sign, 'units': sign * units, 'revenue': sign * revenue})
+
+def record_order(order, items):
+    """Add a new order to the rollups once its transaction commits"""
+    if counts_toward_sales(order.status):
+        _apply_order(order, items, 1)
+
+def record_status_change(order, old_status):
+    """Move an order in or out of the sales rollups when its status changes"""
+    was_counted = counts_toward_sales(old_status)
+    is_counted = counts_toward_sales(order.status)
+    if was_counted != is_counted:
+        _apply_order(order, order.items, 1 if is_counted else -1)
+
+def _signup_delta(target, column, sign):
+    day = (target.created_at or datetime.utcnow()).date()
+    _queue((DailyStats, (('day', day),)), {column: sign}, object_session(target))
+
+# Accounts are counted however they are created or removed (registration,
+# admin tools, scripts), so the sign-up totals track the account tables
+@event.listens_for(User, 'after_insert')
+def _count_user(mapper, connection, target):
+    _signup_delta(target, 'new_users', 1)
+
+@event.listens_for(User, 'after_delete')
+def _uncount_user(mapper, connection, target):
+    _signup_delta(target, 'new_users', -1)
+
+@event.listens_for(SellerProfile, 'after_insert')
+def _count_seller(mapper, connection, target):
+    _signup_delta(target, 'new_sellers', 1)
+
+@event.listens_for(SellerProfile, 'after_delete')
+def _uncount_seller(mapper, connection, target):
+    _signup_delta(target, 'new_sellers', -1)
+
+def _as_date(value):
+    # DATE() comes back as a string on some drivers
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+def _month_start(today, months_back):
+    month = today.month - 1 - months_back
+    return date(today.year + month // 12, month % 12 + 1, 1)
+
+def rebuild_summaries():
+    """Recompute every rollup table from the raw order and account history"""
+    for model in (DailyStats, SellerDailySales, CategoryDailySales):
+        model.query.delete()
+
+    counted = ~Order.status.in_(EXCLUDED_STATUSES)
+    daily = defaultdict(lambda: {'orders': 0, 'sales': 0.0, 'new_users': 0, 'new_sellers': 0})
+
+    order_day = db.func.date(Order.created_at)
+    for day, orders, sales in db.session.query(
+        order_day, db.func.count(Order.order_id), db.func.sum(Order.total)
+    ).filter(counted).group_by(order_day):
+        daily[_as_date(day)].update(orders=orders, sales=float(sales or 0))
+
+    for model, key, column in ((User, User.user_id, 'new_users'),
+                               (SellerProfile, SellerProfile.seller_id, 'new_sellers')):
+        signup_day = db.func.date(model.created_at)
+        for day, count in db.session.query(signup_day, db.func.count(key)).group_by(signup_day):
+            daily[_as_date(day)][column] = count
+
+    db.session.add_all(DailyStats(day=day, **values) for day, values in daily.items())
+
+    for model, group_column in ((SellerDailySales, Product.seller_id),
+                                (CategoryDailySales, Product.category)):
+        rows = db.session.query(
+            order_day,
+            group_column,
+            db.func.count(db.distinct(Order.order_id)),
+            db.func.sum(OrderItem.quantity),
+            db.func.sum(OrderItem.price * OrderItem.quantity)
+        ).join(
+            OrderItem, OrderItem.order_id == Order.order_id
+        ).join(
+            Product, Product.product_id == OrderItem.product_id
+        ).filter(counted).group_by(order_day, group_column)
+
+        for day, group, orders, units, revenue in rows:
+            db.session.add(model(**{
+                'day': _as_date(day),
+                group_column.key: group,
+                'orders': orders,
+                'units': int(units or 0),
+                'revenue': float(revenue or 0)
+            }))
+
+    db.session.commit()
+
+def backfill_summaries():
+    """Rebuild the rollups if they are empty while there is history to
+    count, as after the tables are first created on an existing database
+
+    Returns True if they were rebuilt.
+    """
+    has_orders = db.session.query(Order.query.filter(~Order.status.in_(EXCLUDED_STATUSES)).exists()).scalar()
+    has_accounts = db.session.query(User.query.exists()).scalar() or \
+        db.session.query(SellerProfile.query.exists()).scalar()
+    missing = [
+        model for model, needed in ((DailyStats, has_orders or has_accounts),
+                                    (SellerDailySales, has_orders),
+                                    (CategoryDailySales, has_orders))
+        if needed and not db.session.query(model.query.exists()).scalar()
+    ]
+    if not missing:
+        return False
+    rebuild_summaries()
+    return True
+
+def sales_report(months=6):
+    """Totals and per-month sales for the last `months` calendar months"""
+    total_orders, total_sales = db.session.query(
+        db.func.sum(DailyStats.orders), db.func.sum(DailyStats.sales)
+    ).one()
+
+    start = _month_start(date.today(), months - 1)
+    by_month = {}
+    for row in DailyStats.query.filter(DailyStats.day >= start, DailyStats.orders != 0).order_by(DailyStats.day):
+        month = by_month.setdefault((row.day.year, row.day.month), {
+            'month': row.day.strftime('%b'), 'sales': 0.0, 'orders': 0
+        })
+        month['sales'] += row.sales
+        month['orders'] += row.orders
+
+    return int(total_orders or 0), float(total_sales or 0), list(by_month.values())
+
+def user_report(months=6):
+    """Account totals, sign-ups in the last 30 days and per-month growth"""
+    total_users, total_sellers = db.session.query(
+        db.func.sum(DailyStats.new_users), db.func.sum(DailyStats.new_sellers)
+    ).one()
+
+    today = date.today()
+    new_users_this_month = db.session.query(db.func.sum(DailyStats.new_users)).filter(
+        DailyStats.day >= today - timedelta(days=30)
+    ).scalar()
+
+    start = _month_start(today, months - 1)
+    by_month = {}
+    for row in DailyStats.query.filter(DailyStats.day >= start).order_by(DailyStats.day):
+        if not (row.new_users or row.new_sellers):
+            continue
+        month = by_month.setdefault((row.day.year, row.day.month), {
+            'month': row.day.strftime('%b'), 'users': 0, 'sellers': 0
+        })
+        month['users'] += row.new_users
+        month['sellers'] += row.new_sellers
+
+    return int(total_users or 0), int(total_sellers or 0), int(new_users_this_month or 0), list(by_month.values())
+
+def top_sellers(limit=5):
+    """Sellers with the highest all-time revenue"""
+    revenue = db.func.sum(SellerDailySales.revenue)
+    rows = db.session.query(
+        SellerProfile.business_name,
+        revenue.label('sales'),
+        db.func.sum(SellerDailySales.units).label('units')
+    ).join(
+        SellerProfile, SellerProfile.seller_id == SellerDailySales.seller_id
+    ).group_by(
+        SellerDailySales.seller_id, SellerProfile.business_name
+    ).order_by(revenue.desc()).limit(limit).all()
+
+    return [
+        {
+            'name': row.business_name,
+            'sales': float(row.sales or 0),
+            'products': int(row.units or 0)
+        } for row in rows
+    ]
+
+def category_sales():
+    """All-time units sold and revenue per category, most units first"""
+    units = db.func.sum(CategoryDailySales.units)
+    rows = db.session.query(
+        CategoryDailySales.category,
+        units.label('units'),
+        db.func.sum(CategoryDailySales.revenue).label('revenue')
+    ).group_by(CategoryDailySales.category).having(units > 0).order_by(units.desc()).all()
+
+    total_units = sum(int(row.units) for row in rows)
+    return [
+        {
+            'category': row.category,
+            'count': int(row.units),
+            'revenue': float(row.revenue or 0),
+            'percentage': round(int(row.units) / total_units * 100) if total_units > 0 else 0
+        } for row in rows
+    ]
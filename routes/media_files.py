@@ -0,0 +1,73 @@
+import mimetypes
+import os
+import re
+from flask import Blueprint, Response, abort, current_app, request
+from werkzeug.security import safe_join
+from werkzeug.utils import send_file
+from media import TMP_DIR
+
+media_routes = Blueprint('media', __name__)
+
+# Content-addressed files (and the variants and posters derived from them)
+# never change under the same name, so browsers may keep them for a year
+# without revalidating. Anything else is revalidated hourly.
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+MUTABLE_MAX_AGE = 3600
+
+_HASHED_NAME = re.compile(r'^[0-9a-f]{64}(_[a-z0-9]+)?\.[a-z0-9]{1,5}$')
+
+def _validators(path, filename):
+    """(etag, max_age, immutable) for a file"""
+    name = os.path.basename(filename)
+    if _HASHED_NAME.match(name):
+        return name, IMMUTABLE_MAX_AGE, True
+    stat = os.stat(path)
+    return f'{stat.st_mtime_ns:x}-{stat.st_size:x}', MUTABLE_MAX_AGE, False
+
+def _proxy_response(path, filename, mode, etag, max_age, immutable):
+    # The fronting server streams the file (and handles Range itself); we
+    # only answer conditional requests
+    response = Response(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    response.cache_control.immutable = immutable or None
+    response.make_conditional(request)
+    if response.status_code != 200:
+        # A 304 or 412 must reach the client as is - with the header the
+        # server would send the whole file instead
+        return response
+    if mode == 'x-accel-redirect':
+        prefix = current_app.config['MEDIA_ACCEL_PREFIX'].rstrip('/')
+        response.headers['X-Accel-Redirect'] = f'{prefix}/{filename}'
+    else:
+        response.headers['X-Sendfile'] = path
+    return response
+
+@media_routes.route('/<path:filename>', methods=['GET', 'HEAD'])
+def serve_media(filename):
+    """Serve an uploaded file with strong ETags, long-lived caching and Range
+    support, or hand it to the fronting server when MEDIA_SENDFILE is set"""
+    if filename.split('/', 1)[0] == TMP_DIR:
+        abort(404)
+    root = os.path.abspath(current_app.config['UPLOAD_FOLDER'])
+    path = safe_join(root, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    etag, max_age, immutable = _validators(path, filename)
+
+    mode = current_app.config.get('MEDIA_SENDFILE')
+    if mode in ('x-sendfile', 'x-accel-redirect'):
+        return _proxy_response(path, filename, mode, etag, max_age, immutable)
+
+    # Handles If-None-Match, If-Modified-Since, Range and If-Range
+    response = send_file(
+        path,
+        request.environ,
+        etag=etag,
+        conditional=True,
+        max_age=max_age
+    )
+    response.cache_control.immutable = immutable or None
+    return response
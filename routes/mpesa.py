@@ -1,11 +1,18 @@
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, current_app, request, jsonify, session
 import requests
 import base64
 from datetime import datetime
 import json
+import os
 import socket
-import time
+from app_auth import admin_required
+from jobs import JobQueue, RetryableError
+from models import Order
+import payments
+from payments import callback_receipt, enqueue_callback, order_amount, payment_status, record_payment
+from routes.mpesa_client import MpesaClient
+from routes.mpesa_token import RedisTokenStore, TokenCache
 
 mpesa_routes = Blueprint('mpesa', __name__)
 
@@ -16,26 +23,46 @@ BUSINESS_SHORT_CODE = "174379"  # Lipa Na M-Pesa shortcode
 PASSKEY = "bfb279f9aa9bdbcf158e97dd71a467cd2e0c893059b10f78e6b72ada1ed2c919"  # Lipa Na M-Pesa passkey
 
 # For production, use your actual domain
-CALLBACK_URL = "https://webhook.site/3c1f62b5-4214-47d6-9f26-71c1f4b9c8f0"  # Use a webhook.site URL for testing
+CALLBACK_URL = os.environ.get('MPESA_CALLBACK_URL', "https://webhook.site/3c1f62b5-4214-47d6-9f26-71c1f4b9c8f0")  # Use a webhook.site URL for testing
 
-# M-Pesa API endpoints
-API_BASE_URL = "https://sandbox.safaricom.co.ke"
+# M-Pesa API endpoints - point MPESA_API_BASE_URL at a local stub to test
+API_BASE_URL = os.environ.get('MPESA_API_BASE_URL', "https://sandbox.safaricom.co.ke")
 AUTH_ENDPOINT = "/oauth/v1/generate"
 STK_PUSH_ENDPOINT = "/mpesa/stkpush/v1/processrequest"
 
-# Store transaction details in memory (in a real app, you'd use a database)
-TRANSACTIONS = {}
+# Shared keep-alive client; calls fail fast once M-Pesa keeps erroring
+mpesa_client = MpesaClient(
+    API_BASE_URL,
+    pool_size=int(os.environ.get('MPESA_POOL_SIZE', 10)),
+    connect_timeout=float(os.environ.get('MPESA_CONNECT_TIMEOUT', 5)),
+    read_timeout=float(os.environ.get('MPESA_READ_TIMEOUT', 30)),
+    failure_threshold=int(os.environ.get('MPESA_CIRCUIT_THRESHOLD', 5)),
+    reset_timeout=float(os.environ.get('MPESA_CIRCUIT_RESET', 30))
+)
 
-# Max retries for API calls
+# Max attempts for an STK push; retries back off exponentially from RETRY_DELAY
 MAX_RETRIES = 3
 RETRY_DELAY = 2  # seconds
 
+# STK pushes run on background workers so request threads never wait on
+# Safaricom; the endpoint returns a job id to poll /status/<id> with
+STK_WORKERS = int(os.environ.get('MPESA_STK_WORKERS', 4))
+stk_jobs = JobQueue(workers=STK_WORKERS, base_delay=RETRY_DELAY)
+
+# Access tokens last about an hour; one is shared by all pushes and renewed
+# TOKEN_REFRESH_MARGIN seconds before it expires. Set MPESA_TOKEN_REDIS_URL
+# to share it between worker processes too.
+TOKEN_DEFAULT_TTL = 3599
+TOKEN_REFRESH_MARGIN = int(os.environ.get('MPESA_TOKEN_REFRESH_MARGIN', 300))
+TOKEN_REDIS_URL = os.environ.get('MPESA_TOKEN_REDIS_URL')
+
 @mpesa_routes.route('/stkpush', methods=['POST'])
 def initiate_stk_push():
     try:
         data = request.json
         phone_number = data.get('phoneNumber')
         amount = data.get('amount', 1)  # Default to 1 if not provided
+        order_id = data.get('orderId')
         
         if not phone_number:
             return jsonify({
@@ -43,127 +70,36 @@ def initiate_stk_push():
                 'message': 'Phone number is required'
             }), 400
         
-        # Get access token with retry
-        access_token = None
-        retry_count = 0
-        auth_error = None
-        
-        while retry_count < MAX_RETRIES and access_token is None:
-            access_token_result = get_access_token()
-            if 'access_token' in access_token_result:
-                access_token = access_token_result['access_token']
-                break
-            else:
-                auth_error = access_token_result.get('error')
-                print(f"Auth attempt {retry_count + 1} failed: {auth_error}")
-                retry_count += 1
-                if retry_count < MAX_RETRIES:
-                    time.sleep(RETRY_DELAY)
+        if order_id:
+            # Paying for an order settles it, so only its buyer may start the
+            # payment and the amount always comes from the order itself
+            if 'user_id' not in session:
+                return jsonify({
+                    'success': False,
+                    'message': 'User not authenticated'
+                }), 401
+            order = Order.query.get(order_id)
+            if not order or order.user_id != session['user_id']:
+                return jsonify({
+                    'success': False,
+                    'message': 'Order not found'
+                }), 404
+            if order.status != 'Pending':
+                return jsonify({
+                    'success': False,
+                    'message': f'Order is already {order.status}'
+                }), 409
+            amount = order_amount(order)
         
-        if access_token is None:
-            return jsonify({
-                'success': False,
-                'message': 'Could not authenticate with M-Pesa service',
-                'details': auth_error
-            }), 503  # Service Unavailable
-        
-        # Prepare timestamp
-        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-        
-        # Generate password - format: BusinessShortCode+Passkey+Timestamp
-        password = base64.b64encode(f"{BUSINESS_SHORT_CODE}{PASSKEY}{timestamp}".encode()).decode('utf-8')
-        
-        # Prepare STK push request
-        stk_request = {
-            "BusinessShortCode": BUSINESS_SHORT_CODE,
-            "Password": password,
-            "Timestamp": timestamp,
-            "TransactionType": "CustomerPayBillOnline",
-            "Amount": amount,
-            "PartyA": phone_number,
-            "PartyB": BUSINESS_SHORT_CODE,
-            "PhoneNumber": phone_number,
-            "CallBackURL": CALLBACK_URL,
-            "AccountReference": "KukuHub",
-            "TransactionDesc": "Payment for products"
-        }
+        app = current_app._get_current_object()
+        job = stk_jobs.submit(send_stk_push, app, phone_number, amount, order_id, max_attempts=MAX_RETRIES)
         
-        print(f"Sending M-Pesa request with callback URL: {CALLBACK_URL}")
-        
-        # Make request to M-Pesa API with retry
-        stk_response = None
-        stk_error = None
-        retry_count = 0
-        
-        while retry_count < MAX_RETRIES and stk_response is None:
-            try:
-                response = requests.post(
-                    f"{API_BASE_URL}{STK_PUSH_ENDPOINT}",
-                    json=stk_request,
-                    headers={
-                        "Authorization": f"Bearer {access_token}",
-                        "Content-Type": "application/json"
-                    },
-                    timeout=30,
-                    verify=True  # Enable SSL verification
-                )
-                
-                print(f"M-Pesa API Response Status: {response.status_code}")
-                print(f"M-Pesa API Response: {response.text}")
-                
-                if response.status_code == 200:
-                    try:
-                        stk_response = response.json()
-                    except json.JSONDecodeError:
-                        stk_error = "Invalid JSON response from M-Pesa"
-                elif response.status_code == 503:
-                    stk_error = "M-Pesa service is temporarily unavailable"
-                else:
-                    stk_error = f"M-Pesa API returned status code {response.status_code}: {response.text}"
-                
-                if stk_response is None:
-                    retry_count += 1
-                    if retry_count < MAX_RETRIES:
-                        print(f"Retrying STK push, attempt {retry_count + 1}")
-                        time.sleep(RETRY_DELAY)
-            except requests.exceptions.RequestException as e:
-                stk_error = str(e)
-                retry_count += 1
-                if retry_count < MAX_RETRIES:
-                    print(f"Request exception, retrying: {stk_error}")
-                    time.sleep(RETRY_DELAY)
-        
-        if stk_response is None:
-            error_message = "Unable to complete payment request"
-            if stk_error:
-                error_message += f": {stk_error}"
-            
-            return jsonify({
-                'success': False,
-                'message': error_message
-            }), 503
-                
-        if 'ResponseCode' in stk_response and stk_response['ResponseCode'] == '0':
-            # Success - store transaction
-            checkout_request_id = stk_response['CheckoutRequestID']
-            TRANSACTIONS[checkout_request_id] = {
-                'amount': amount,
-                'phone_number': phone_number,
-                'status': 'pending',
-                'timestamp': datetime.now().isoformat()
-            }
-            
-            return jsonify({
-                'success': True,
-                'message': 'Payment request sent successfully. Please check your phone.',
-                'checkoutRequestID': checkout_request_id
-            })
-        else:
-            return jsonify({
-                'success': False,
-                'message': 'Failed to initiate payment request',
-                'details': stk_response
-            }), 400
+        return jsonify({
+            'success': True,
+            'message': 'Payment request is being sent. Please check your phone.',
+            'jobId': job.id,
+            'status': 'pending'
+        }), 202
             
     except Exception as e:
         print(f"STK push error: {str(e)}")
@@ -172,38 +108,117 @@ def initiate_stk_push():
             'message': 'An error occurred while processing your payment request'
         }), 500
 
+def send_stk_push(app, phone_number, amount, order_id=None):
+    """Send one STK push attempt; runs on an stk_jobs worker
+    
+    Raises RetryableError for failures worth another attempt (auth, network,
+    5xx) and a plain Exception for requests M-Pesa rejected outright. A push
+    that timed out waiting for M-Pesa's answer is not retried: it may have
+    gone through, and sending it again would prompt the customer twice.
+    """
+    access_token_result = get_access_token()
+    if 'access_token' not in access_token_result:
+        raise RetryableError(f"Could not authenticate with M-Pesa service: {access_token_result.get('error')}")
+    access_token = access_token_result['access_token']
+    
+    # Prepare timestamp
+    timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+    
+    # Generate password - format: BusinessShortCode+Passkey+Timestamp
+    password = base64.b64encode(f"{BUSINESS_SHORT_CODE}{PASSKEY}{timestamp}".encode()).decode('utf-8')
+    
+    # Prepare STK push request
+    stk_request = {
+        "BusinessShortCode": BUSINESS_SHORT_CODE,
+        "Password": password,
+        "Timestamp": timestamp,
+        "TransactionType": "CustomerPayBillOnline",
+        "Amount": amount,
+        "PartyA": phone_number,
+        "PartyB": BUSINESS_SHORT_CODE,
+        "PhoneNumber": phone_number,
+        "CallBackURL": CALLBACK_URL,
+        "AccountReference": "KukuHub",
+        "TransactionDesc": "Payment for products"
+    }
+    
+    try:
+        response = mpesa_client.post(
+            STK_PUSH_ENDPOINT,
+            json=stk_request,
+            headers={
+                "Authorization": f"Bearer {access_token}",
+                "Content-Type": "application/json"
+            }
+        )
+    except requests.exceptions.ReadTimeout as e:
+        print(f"STK push timed out after it was sent: {str(e)}")
+        raise Exception("M-Pesa did not respond in time. Check your phone for the payment prompt before trying again")
+    except requests.exceptions.RequestException as e:
+        raise RetryableError(str(e))
+    
+    print(f"M-Pesa API Response Status: {response.status_code}")
+    
+    if response.status_code == 401:
+        # Token revoked or expired early - fetch a new one on the retry
+        token_cache.invalidate()
+        raise RetryableError(f"M-Pesa rejected the access token: {response.text}")
+    if response.status_code >= 500:
+        raise RetryableError(f"M-Pesa API returned status code {response.status_code}: {response.text}")
+    if response.status_code != 200:
+        raise Exception(f"M-Pesa API returned status code {response.status_code}: {response.text}")
+    
+    try:
+        stk_response = response.json()
+    except json.JSONDecodeError:
+        raise RetryableError("Invalid JSON response from M-Pesa")
+    
+    if stk_response.get('ResponseCode') != '0':
+        raise Exception(f"Failed to initiate payment request: {stk_response}")
+    
+    # Success - store transaction. Not retried on failure: the push has
+    # already gone out and retrying would prompt the customer twice.
+    checkout_request_id = stk_response['CheckoutRequestID']
+    with app.app_context():
+        record_payment(
+            checkout_request_id,
+            stk_response.get('MerchantRequestID'),
+            phone_number,
+            amount,
+            order_id
+        )
+    
+    return {'checkoutRequestID': checkout_request_id}
+
 @mpesa_routes.route('/callback', methods=['POST'])
 def mpesa_callback():
-    """Handle M-Pesa callback after STK push"""
+    """Handle M-Pesa callback after STK push
+    
+    The callback is stored and acknowledged straight away; the payment, its
+    order and stock are updated by the callback consumer in batches.
+    """
     try:
-        callback_data = request.json
-        print(f"M-Pesa Callback Data: {json.dumps(callback_data, indent=2)}")
+        callback_data = request.get_json(silent=True) or {}
+        stk_callback = callback_data.get('Body', {}).get('stkCallback', {})
+        checkout_request_id = stk_callback.get('CheckoutRequestID')
+        result_code = stk_callback.get('ResultCode')
+        result_desc = stk_callback.get('ResultDesc')
         
-        # Extract relevant information from the callback data
-        checkout_request_id = callback_data.get('Body', {}).get('stkCallback', {}).get('CheckoutRequestID')
-        result_code = callback_data.get('Body', {}).get('stkCallback', {}).get('ResultCode')
-        result_desc = callback_data.get('Body', {}).get('stkCallback', {}).get('ResultDesc')
+        if not checkout_request_id:
+            return jsonify({'success': False, 'message': 'Missing CheckoutRequestID'}), 400
         
-        # Log the callback data and result
         print(f"Callback received for CheckoutRequestID: {checkout_request_id}, ResultCode: {result_code}, ResultDesc: {result_desc}")
         
-        # Check if the transaction exists
-        if checkout_request_id in TRANSACTIONS:
-            # Update transaction status based on the callback
-            if result_code == 0:
-                TRANSACTIONS[checkout_request_id]['status'] = 'completed'
-                print(f"Transaction {checkout_request_id} completed successfully.")
-            else:
-                TRANSACTIONS[checkout_request_id]['status'] = 'failed'
-                print(f"Transaction {checkout_request_id} failed. Result Description: {result_desc}")
-            
-            # You can add more detailed handling here, such as updating a database
-            # or sending notifications to users.
-            
-            return jsonify({'success': True, 'message': 'Callback processed successfully'}), 200
-        else:
-            print(f"Transaction with CheckoutRequestID {checkout_request_id} not found.")
-            return jsonify({'success': False, 'message': 'Transaction not found'}), 404
+        if not enqueue_callback(
+            checkout_request_id,
+            result_code,
+            result_desc,
+            callback_receipt(stk_callback),
+            json.dumps(stk_callback)
+        ):
+            print(f"Duplicate callback for {checkout_request_id} ignored.")
+        
+        return jsonify({'success': True, 'message': 'Callback received'}), 200
     
     except Exception as e:
         print(f"Callback processing error: {str(e)}")
@@ -211,13 +226,33 @@ def mpesa_callback():
 
 @mpesa_routes.route('/status/<checkout_request_id>', methods=['GET'])
 def check_payment_status(checkout_request_id):
-    """Check the status of an M-Pesa payment"""
+    """Check the status of an M-Pesa payment by CheckoutRequestID or job id"""
     try:
-        if checkout_request_id in TRANSACTIONS:
-            transaction = TRANSACTIONS[checkout_request_id]
+        # A job id resolves to its CheckoutRequestID once M-Pesa accepted the push
+        job = stk_jobs.get(checkout_request_id)
+        if job is not None:
+            if job.status == 'failed':
+                return jsonify({
+                    'success': False,
+                    'status': 'failed',
+                    'message': job.error or 'Unable to complete payment request'
+                })
+            if job.status != 'done':
+                return jsonify({
+                    'success': True,
+                    'status': 'pending',
+                    'message': 'Payment request is being sent'
+                })
+            checkout_request_id = job.result['checkoutRequestID']
+        
+        transaction = payment_status(checkout_request_id)
+        if transaction is not None:
             return jsonify({
                 'success': True,
                 'status': transaction['status'],
+                'checkoutRequestID': checkout_request_id,
+                'orderId': transaction['orderId'],
+                'receiptNumber': transaction['receiptNumber'],
                 'message': f'Transaction status is {transaction["status"]}'
             })
         else:
@@ -234,32 +269,50 @@ def check_payment_status(checkout_request_id):
             'message': f'An error occurred: {str(e)}'
         }), 500
 
-def get_access_token():
-    """Get M-Pesa API access token"""
-    try:
-        credentials = base64.b64encode(f"{CONSUMER_KEY}:{CONSUMER_SECRET}".encode()).decode('utf-8')
+@mpesa_routes.route('/metrics', methods=['GET'])
+@admin_required
+def mpesa_metrics():
+    """Connection reuse and circuit breaker state for the M-Pesa client"""
+    return jsonify({
+        'success': True,
+        'client': mpesa_client.stats(),
+        'tokenFetches': token_cache.fetches,
+        'callbacks': {
+            'processed': payments.consumer.processed if payments.consumer else 0,
+            'batches': payments.consumer.batches if payments.consumer else 0
+        }
+    })
+
+def fetch_access_token():
+    """Request a new M-Pesa API access token; returns (token, expires_in)"""
+    credentials = base64.b64encode(f"{CONSUMER_KEY}:{CONSUMER_SECRET}".encode()).decode('utf-8')
+    
+    response = mpesa_client.get(
+        f"{AUTH_ENDPOINT}?grant_type=client_credentials",
+        headers={
+            "Authorization": f"Basic {credentials}"
+        }
+    )
+    
+    if response.status_code != 200:
+        raise Exception(f"API returned status code {response.status_code}: {response.text}")
         
-        response = requests.get(
-            f"{API_BASE_URL}{AUTH_ENDPOINT}?grant_type=client_credentials",
-            headers={
-                "Authorization": f"Basic {credentials}"
-            },
-            timeout=30,
-            verify=True  # Enable SSL verification
-        )
+    data = response.json()
+    if 'access_token' not in data:
+        raise Exception(f"No access token in response: {data}")
         
-        if response.status_code != 200:
-            return {
-                'error': f"API returned status code {response.status_code}: {response.text}"
-            }
-            
-        data = response.json()
-        if 'access_token' not in data:
-            return {
-                'error': f"No access token in response: {data}"
-            }
-            
-        return {'access_token': data.get('access_token')}
+    return data['access_token'], data.get('expires_in', TOKEN_DEFAULT_TTL)
+
+token_cache = TokenCache(
+    fetch_access_token,
+    refresh_margin=TOKEN_REFRESH_MARGIN,
+    store=RedisTokenStore(TOKEN_REDIS_URL) if TOKEN_REDIS_URL else None
+)
+
+def get_access_token():
+    """Get M-Pesa API access token, shared until shortly before it expires"""
+    try:
+        return {'access_token': token_cache.get()}
     except requests.exceptions.ConnectionError as e:
         print(f"Connection error: {str(e)}")
         return {'error': f"Connection error: {str(e)}"}
@@ -270,5 +323,5 @@ def get_access_token():
         print(f"Error getting access token: {str(e)}")
         return {'error': f"Request error: {str(e)}"}
     except Exception as e:
-        print(f"Unexpected error: {str(e)}")
-        return {'error': f"Unexpected error: {str(e)}"}
+        print(f"Error getting access token: {str(e)}")
+        return {'error': str(e)}
@@ -0,0 +1,120 @@
+from threading import Lock
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Raised without calling the provider while the circuit is open"""
+
+class CircuitBreaker(object):
+    """Stops calls to a failing provider for a while
+
+    After `threshold` consecutive failures the circuit opens and calls fail
+    immediately. Once `reset_timeout` seconds have passed a single trial
+    call is let through; success closes the circuit, failure re-opens it.
+    """
+
+    def __init__(self, threshold=5, reset_timeout=30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.rejected = 0
+        self._lock = Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self.trial_running:
+                self.trial_running = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.trial_running = False
+            if self.opened_at is not None or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+class MpesaClient(object):
+    """Keep-alive HTTP client for the M-Pesa API
+
+    One pooled requests.Session is shared by every thread, so pushes reuse
+    open TCP/TLS connections instead of handshaking each time. Connection
+    errors, timeouts and 5xx responses count against the circuit breaker.
+    """
+
+    def __init__(self, base_url, pool_size=10, connect_timeout=5, read_timeout=30,
+                 failure_threshold=5, reset_timeout=30):
+        self.base_url = base_url
+        self.timeout = (connect_timeout, read_timeout)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=False)
+        self.session = requests.Session()
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+        self.requests = 0
+        self.failures = 0
+
+    def request(self, method, path, **kwargs):
+        if not self.breaker.allow():
+            raise CircuitOpenError('M-Pesa service is unavailable, not retrying yet')
+
+        kwargs.setdefault('timeout', self.timeout)
+        self.requests += 1
+        try:
+            response = self.session.request(method, f"{self.base_url}{path}", **kwargs)
+        except requests.exceptions.RequestException:
+            self.failures += 1
+            self.breaker.record_failure()
+            raise
+
+        if response.status_code >= 500:
+            self.failures += 1
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def stats(self):
+        """Request, failure and connection-reuse counters"""
+        connections = 0
+        pooled_requests = 0
+        for key in self.adapter.poolmanager.pools.keys():
+            pool = self.adapter.poolmanager.pools[key]
+            connections += pool.num_connections
+            pooled_requests += pool.num_requests
+        return {
+            'requests': self.requests,
+            'failures': self.failures,
+            'connectionsOpened': connections,
+            'connectionsReused': max(0, pooled_requests - connections),
+            'reuseRatio': round(1 - connections / pooled_requests, 3) if pooled_requests else 0,
+            'circuit': self.breaker.state,
+            'rejectedByCircuit': self.breaker.rejected
+        }
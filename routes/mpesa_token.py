@@ -0,0 +1,152 @@
+from threading import Lock
+import json
+import time
+
+try:
+    import redis
+except ImportError:  # optional - only needed for MPESA_TOKEN_REDIS_URL
+    redis = None
+
+class RedisTokenStore(object):
+    """Token shared by every worker through a Redis-compatible server
+
+    A short-lived SET NX lock lets only one process refresh at a time.
+    """
+
+    def __init__(self, url, key='kukuhub:mpesa:token'):
+        if redis is None:
+            raise RuntimeError('MPESA_TOKEN_REDIS_URL is set but the redis package is not installed')
+        self.client = redis.Redis.from_url(url)
+        self.key = key
+        self.lock_key = key + ':refresh'
+
+    def get(self):
+        raw = self.client.get(self.key)
+        if raw is None:
+            return None
+        entry = json.loads(raw)
+        return entry['token'], entry['expires_at']
+
+    def set(self, token, expires_at):
+        ttl = max(1, int(expires_at - time.time()))
+        self.client.set(self.key, json.dumps({'token': token, 'expires_at': expires_at}), ex=ttl)
+
+    def delete(self):
+        self.client.delete(self.key)
+
+    def acquire_refresh(self, timeout):
+        return bool(self.client.set(self.lock_key, '1', nx=True, ex=max(1, int(timeout))))
+
+    def release_refresh(self):
+        self.client.delete(self.lock_key)
+
+class TokenCache(object):
+    """Thread-safe OAuth token cache with refresh-ahead and single-flight
+
+    `fetch()` must return (token, expires_in_seconds) or raise. A token is
+    served until `refresh_margin` seconds before it expires. Inside that
+    window one caller refreshes while the others keep using the still-valid
+    token; once it has expired, callers wait for the single refresh instead
+    of each requesting their own. A refresh that fails while the current
+    token is still valid is logged and that token served; errors only
+    reach callers when there is no valid token left.
+    """
+
+    def __init__(self, fetch, refresh_margin=300, store=None, wait_timeout=10):
+        self._fetch = fetch
+        self.refresh_margin = refresh_margin
+        self.store = store
+        self.wait_timeout = wait_timeout
+        self._token = None
+        self._expires_at = 0
+        self._lock = Lock()
+        self.fetches = 0
+
+    def _fresh(self, expires_at, now):
+        return now < expires_at - self.refresh_margin
+
+    def get(self):
+        now = time.time()
+        token, expires_at = self._token, self._expires_at
+        if token and self._fresh(expires_at, now):
+            return token
+
+        if token and now < expires_at:
+            # Still valid: refresh ahead only if nobody else is already doing it
+            if not self._lock.acquire(blocking=False):
+                return token
+        else:
+            self._lock.acquire()
+
+        try:
+            # Another thread may have refreshed while we waited for the lock
+            if self._token and self._fresh(self._expires_at, time.time()):
+                return self._token
+            return self._refresh()
+        except Exception as e:
+            if not self._valid():
+                raise
+            print(f"M-Pesa token refresh failed, using the current token: {str(e)}")
+            return self._token
+        finally:
+            self._lock.release()
+
+    def _valid(self):
+        return self._token is not None and time.time() < self._expires_at
+
+    def _refresh(self):
+        if self.store is None:
+            return self._fetch_and_keep()
+
+        stored = self._read_store()
+        if stored:
+            return stored
+
+        if not self.store.acquire_refresh(self.wait_timeout):
+            # Another worker is refreshing - keep using a still-valid token,
+            # or wait for it to publish the new one
+            if self._valid():
+                return self._token
+            deadline = time.time() + self.wait_timeout
+            while time.time() < deadline:
+                time.sleep(0.1)
+                stored = self._read_store()
+                if stored:
+                    return stored
+            return self._fetch_and_keep()
+
+        try:
+            token = self._fetch_and_keep()
+            self.store.set(token, self._expires_at)
+            return token
+        finally:
+            self.store.release_refresh()
+
+    def _read_store(self):
+        try:
+            entry = self.store.get()
+        except Exception as e:
+            print(f"M-Pesa token store read error: {str(e)}")
+            return None
+        if entry and self._fresh(entry[1], time.time()):
+            self._token, self._expires_at = entry
+            return self._token
+        return None
+
+    def _fetch_and_keep(self):
+        token, expires_in = self._fetch()
+        self.fetches += 1
+        self._token = token
+        self._expires_at = time.time() + float(expires_in)
+        return token
+
+    def invalidate(self):
+        """Forget the token, e.g. after the API rejected it"""
+        with self._lock:
+            self._token = None
+            self._expires_at = 0
+            if self.store is not None:
+                try:
+                    self.store.delete()
+                except Exception as e:
+                    print(f"M-Pesa token store delete error: {str(e)}")
@@ -0,0 +1,138 @@
+from flask import Blueprint, current_app, request, jsonify
+from app_auth import current_seller_id, seller_required
+from models import db, Product, VideoUpload
+from videos import (
+    UploadError, check_complete, create_upload, queue_assembly, received_chunks, save_chunk, total_chunks
+)
+
+video_upload_routes = Blueprint('video_uploads', __name__)
+
+def _upload_dict(upload):
+    return {
+        'uploadId': upload.upload_id,
+        'productId': upload.product_id,
+        'size': upload.size,
+        'chunkSize': upload.chunk_size,
+        'totalChunks': total_chunks(upload),
+        'receivedChunks': received_chunks(upload) if upload.status == 'uploading' else [],
+        'status': upload.status,
+        'videoUrl': upload.video_url,
+        'error': upload.error
+    }
+
+def _own_upload(upload_id, lock=False):
+    query = VideoUpload.query.filter_by(upload_id=upload_id)
+    upload = (query.with_for_update() if lock else query).first()
+    if upload is None or upload.seller_id != current_seller_id():
+        return None
+    return upload
+
+def _own_product(product_id):
+    product = Product.query.get(product_id)
+    if product is None or product.seller_id != current_seller_id():
+        return None
+    return product
+
+@video_upload_routes.route('', methods=['POST'])
+@seller_required
+def start_video_upload():
+    """Start a chunked video upload
+
+    JSON body: filename, size (bytes), contentType, optional chunkSize and
+    productId (the product to attach the video to once complete).
+    """
+    try:
+        data = request.json or {}
+        product_id = data.get('productId')
+        if product_id is not None and _own_product(product_id) is None:
+            return jsonify({'success': False, 'message': 'Product not found'}), 404
+
+        upload = create_upload(
+            current_seller_id(),
+            data.get('filename') or 'video',
+            data.get('size') or 0,
+            content_type=data.get('contentType'),
+            chunk_size=data.get('chunkSize'),
+            product_id=product_id,
+            max_bytes=current_app.config['MEDIA_MAX_VIDEO_BYTES']
+        )
+        db.session.commit()
+
+        return jsonify({'success': True, 'upload': _upload_dict(upload)})
+
+    except (UploadError, ValueError, TypeError) as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error starting video upload: {str(e)}")
+        return jsonify({'success': False, 'message': f'Error starting upload: {str(e)}'}), 500
+
+@video_upload_routes.route('/<upload_id>', methods=['GET'])
+@seller_required
+def get_video_upload(upload_id):
+    """Upload progress - the chunks already received, for resuming, or
+    whether a completed upload has been assembled"""
+    upload = _own_upload(upload_id)
+    if upload is None:
+        return jsonify({'success': False, 'message': 'Upload not found'}), 404
+    return jsonify({'success': True, 'upload': _upload_dict(upload)})
+
+@video_upload_routes.route('/<upload_id>/chunks/<int:index>', methods=['PUT'])
+@seller_required
+def put_video_chunk(upload_id, index):
+    """Store one chunk, sent as the raw request body
+
+    The X-Chunk-SHA256 header must hold the hex SHA-256 of the chunk.
+    """
+    upload = _own_upload(upload_id)
+    if upload is None:
+        return jsonify({'success': False, 'message': 'Upload not found'}), 404
+
+    try:
+        save_chunk(upload, index, request.stream, request.headers.get('X-Chunk-SHA256'))
+        return jsonify({'success': True, 'index': index})
+    except UploadError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        print(f"Error storing video chunk: {str(e)}")
+        return jsonify({'success': False, 'message': f'Error storing chunk: {str(e)}'}), 500
+
+@video_upload_routes.route('/<upload_id>/complete', methods=['POST'])
+@seller_required
+def complete_video_upload(upload_id):
+    """Queue the chunks' assembly; the video is attached to its product,
+    if any, once assembled
+
+    Answers 202 with status 'assembling' - poll GET /<upload_id> until it
+    is 'complete' (with videoUrl) or 'failed' (with error).
+    """
+    # Read unlocked first: an assembling upload's row is locked by its job
+    upload = _own_upload(upload_id)
+    if upload is not None and upload.status == 'uploading':
+        # Locked so concurrent requests queue the assembly only once
+        db.session.commit()
+        upload = _own_upload(upload_id, lock=True)
+    if upload is None:
+        return jsonify({'success': False, 'message': 'Upload not found'}), 404
+    if upload.status != 'uploading':
+        db.session.commit()
+        return jsonify({'success': True, 'upload': _upload_dict(upload)}), 202 if upload.status == 'assembling' else 200
+
+    try:
+        check_complete(upload)
+        upload.status = 'assembling'
+        upload.error = None
+        db.session.commit()
+        queue_assembly(current_app._get_current_object(), upload.upload_id,
+                       current_app.config['MEDIA_MAX_VIDEO_BYTES'])
+
+        return jsonify({'success': True, 'upload': _upload_dict(upload)}), 202
+
+    except UploadError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error completing video upload: {str(e)}")
+        return jsonify({'success': False, 'message': f'Error completing upload: {str(e)}'}), 500
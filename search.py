@@ -0,0 +1,125 @@
+import re
+from sqlalchemy import and_, case, or_
+from sqlalchemy.dialects import mysql
+from catalog import SORT_OPTIONS, catalog_query, filter_products, key_values, select_columns
+from models import db, Product
+from pagination import DEFAULT_PAGE_SIZE, PaginationError, decode_cursor, encode_cursor, keyset_condition
+
+# Columns covered by the ft_products_search FULLTEXT index - the order must
+# match the index definition for MySQL to use it
+SEARCH_COLUMNS = (Product.name, Product.description, Product.category)
+
+# InnoDB's default innodb_ft_min_token_size; shorter words are not in the
+# index and are matched with LIKE instead
+MIN_TOKEN_SIZE = 3
+MAX_TERMS = 8
+SUGGEST_LIMIT = 10
+
+_WORD = re.compile(r'[^\W_]+', re.UNICODE)
+
+class SearchError(ValueError):
+    pass
+
+def search_terms(q):
+    """Lowercased words of a search query
+
+    Everything but letters and digits is dropped, so user input can never
+    inject boolean-mode operators or LIKE wildcards.
+    """
+    return _WORD.findall((q or '').lower())[:MAX_TERMS]
+
+def _split_terms(terms):
+    # Without a FULLTEXT index (SQLite in development) every term uses LIKE
+    if db.engine.dialect.name != 'mysql':
+        return [], terms
+    indexed = [t for t in terms if len(t) >= MIN_TOKEN_SIZE]
+    return indexed, [t for t in terms if len(t) < MIN_TOKEN_SIZE]
+
+def _fulltext_match(terms):
+    # Every word is required and prefix-matched, so "kienyeji chick" finds
+    # "Kienyeji chicks" and a half-typed word still autocompletes
+    against = ' '.join(f'+{term}*' for term in terms)
+    return mysql.match(*SEARCH_COLUMNS, against=against).in_boolean_mode()
+
+def _like_condition(term):
+    pattern = f'%{term}%'
+    return or_(*[column.ilike(pattern) for column in SEARCH_COLUMNS])
+
+def _like_score(term):
+    # A hit in the name counts for more than one in the description
+    pattern = f'%{term}%'
+    return case((Product.name.ilike(pattern), 2.0), else_=0.0) + \
+        case((or_(Product.description.ilike(pattern), Product.category.ilike(pattern)), 1.0), else_=0.0)
+
+def search_clauses(q):
+    """(WHERE condition, relevance score) for a search query"""
+    terms = search_terms(q)
+    if not terms:
+        raise SearchError('Search query must contain at least one letter or digit')
+    indexed, short = _split_terms(terms)
+
+    conditions = []
+    scores = []
+    if indexed:
+        match = _fulltext_match(indexed)
+        conditions.append(match)
+        scores.append(match)
+    for term in short:
+        conditions.append(_like_condition(term))
+        scores.append(_like_score(term))
+
+    return and_(*conditions), sum(scores[1:], scores[0])
+
+def search_products(q, category=None, min_price=None, max_price=None, seller_id=None,
+                    in_stock=False, sort='relevance', cursor=None, limit=DEFAULT_PAGE_SIZE, columns=None):
+    """Get one page of products matching a search query
+
+    Accepts the same filters and `columns` as list_products(); sort is
+    'relevance' (the default) or any catalogue sort option. Returns
+    (products, next_cursor).
+    """
+    condition, score = search_clauses(q)
+
+    if sort == 'relevance':
+        keys, types, descending = (score, Product.product_id), (float, int), True
+    elif sort in SORT_OPTIONS:
+        keys, types, descending = SORT_OPTIONS[sort]
+    else:
+        raise PaginationError(f'Unknown sort option: {sort}')
+
+    # The score is selected last, after any sort key columns
+    key_columns = keys[1:] if sort == 'relevance' else keys
+    query = catalog_query(select_columns(columns, key_columns) if columns else None)
+    query = filter_products(query, category, min_price, max_price, seller_id, in_stock)
+    query = query.filter(condition)
+
+    if cursor:
+        values = decode_cursor(cursor, sort, types)
+        query = query.filter(keyset_condition(keys, values, descending))
+
+    order = [c.desc() if descending else c.asc() for c in keys]
+    rows = query.add_columns(score.label('score')).order_by(*order).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        values = key_values(last if columns else last[0], key_columns)
+        if sort == 'relevance':
+            values = [float(last[-1])] + values
+        next_cursor = encode_cursor(sort, values)
+
+    if columns:
+        return rows, next_cursor
+    return [product for product, _ in rows], next_cursor
+
+def suggest_products(q, category=None, limit=SUGGEST_LIMIT):
+    """Best matching (product_id, name, category) rows for autocomplete
+
+    Only the three columns are read, so suggestions never load descriptions.
+    """
+    condition, score = search_clauses(q)
+    query = db.session.query(Product.product_id, Product.name, Product.category).filter(condition)
+    if category:
+        query = query.filter(Product.category == category)
+    return query.order_by(score.desc(), Product.product_id.desc()).limit(limit).all()
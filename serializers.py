@@ -0,0 +1,197 @@
+from flask import current_app, jsonify
+from images import image_variants
+from models import Product, Order, OrderItem, Message, User, SellerProfile
+from videos import video_poster
+
+try:
+    import orjson
+except ImportError:  # optional - without it responses go through jsonify
+    orjson = None
+
+def to_str(value):
+    return None if value is None else str(value)
+
+def isoformat(value):
+    return None if value is None else value.isoformat()
+
+def default(placeholder):
+    """Converter replacing a missing value with `placeholder`"""
+    def convert(value):
+        return placeholder if value is None else value
+    return convert
+
+class Field(object):
+    """One key of a payload
+
+    `column` is what row queries select; `path` is the attribute path read
+    from ORM objects, for values reached through a relationship (defaults
+    to the column's own attribute).
+    """
+
+    def __init__(self, column, convert=None, path=None):
+        self.column = column
+        self.convert = convert
+        self.path = path or column.key
+
+def _path_getter(names):
+    def get(obj):
+        for name in names:
+            if obj is None:
+                return None
+            obj = getattr(obj, name)
+        return obj
+    return get
+
+class Schema(object):
+    """Declarative payload description, compiled once into two functions
+
+    dump_row() builds the dict from a row tuple selected with `columns`
+    (extra trailing columns are ignored); dump() builds it from an ORM
+    object. Both are generated as a single dict literal, so serializing a
+    row costs one function call plus the converters.
+    """
+
+    def __init__(self, **fields):
+        self.fields = dict(
+            (key, value if isinstance(value, Field) else Field(value))
+            for key, value in fields.items()
+        )
+
+        # Several keys may read the same column (an image URL and its
+        # variants); select it once
+        self.columns = []
+        positions = []
+        for field in self.fields.values():
+            for index, column in enumerate(self.columns):
+                if column is field.column:
+                    break
+            else:
+                index = len(self.columns)
+                self.columns.append(field.column)
+            positions.append(index)
+
+        namespace = {}
+        row_values = []
+        obj_values = []
+        for n, (field, index) in enumerate(zip(self.fields.values(), positions)):
+            names = field.path.split('.')
+            if not all(name.isidentifier() for name in names):
+                raise ValueError(f'Invalid attribute path: {field.path}')
+            if len(names) == 1:
+                obj_value = f'o.{names[0]}'
+            else:
+                namespace[f'p{n}'] = _path_getter(names)
+                obj_value = f'p{n}(o)'
+            row_value = f'r[{index}]'
+            if field.convert is not None:
+                namespace[f'c{n}'] = field.convert
+                obj_value = f'c{n}({obj_value})'
+                row_value = f'c{n}({row_value})'
+            row_values.append(row_value)
+            obj_values.append(obj_value)
+
+        self.dump_row = self._compile('dump_row', 'r', row_values, namespace)
+        self.dump = self._compile('dump', 'o', obj_values, namespace)
+
+    def _compile(self, name, arg, values, namespace):
+        items = ', '.join(f'{key!r}: {value}' for key, value in zip(self.fields, values))
+        exec(f'def {name}({arg}):\n    return {{{items}}}\n', namespace)
+        return namespace[name]
+
+    def dump_rows(self, rows):
+        dump_row = self.dump_row
+        return [dump_row(row) for row in rows]
+
+    def dump_many(self, objects):
+        dump = self.dump
+        return [dump(obj) for obj in objects]
+
+def json_response(payload, status=200):
+    """JSON response for a payload, encoded with orjson when installed"""
+    if orjson is None:
+        response = jsonify(payload)
+        response.status_code = status
+        return response
+    return current_app.response_class(orjson.dumps(payload), status=status, mimetype='application/json')
+
+PRODUCT = Schema(
+    id=Field(Product.product_id, to_str),
+    name=Product.name,
+    description=Product.description,
+    price=Product.price,
+    stock=Product.stock,
+    category=Product.category,
+    image=Product.image_url,
+    variants=Field(Product.image_url, image_variants),
+    video=Product.video_url,
+    poster=Field(Product.video_url, video_poster),
+    mediaType=Product.media_type,
+    sellerId=Field(Product.seller_id, to_str),
+    sellerName=Field(SellerProfile.business_name, default("Unknown Seller"), path='seller.business_name'),
+    createdAt=Field(Product.created_at, isoformat)
+)
+
+ORDER_ITEM = Schema(
+    id=Field(Product.product_id, to_str, path='product.product_id'),
+    name=Field(Product.name, path='product.name'),
+    price=OrderItem.price,
+    quantity=OrderItem.quantity,
+    image=Field(Product.image_url, path='product.image_url')
+)
+
+# A buyer's own order history
+ORDER = Schema(
+    id=Field(Order.order_id, to_str),
+    totalAmount=Order.total,
+    status=Order.status,
+    createdAt=Field(Order.created_at, isoformat)
+)
+
+# The admin order listing
+ADMIN_ORDER = Schema(
+    id=Field(Order.order_id, to_str),
+    user_name=Field(User.username, default("Unknown User"), path='user.username'),
+    user_email=Field(User.email, default("Unknown Email"), path='user.email'),
+    total=Order.total,
+    status=Order.status,
+    created_at=Field(Order.created_at, isoformat)
+)
+
+SELLER_MESSAGE = Schema(
+    id=Field(Message.message_id, to_str),
+    senderName=Message.senderName,
+    senderEmail=Message.senderEmail,
+    content=Message.content,
+    productName=Message.productName,
+    createdAt=Field(Message.created_at, isoformat),
+    reply=Message.reply,
+    repliedAt=Field(Message.replied_at, isoformat)
+)
+
+# The seller's business name is added by the caller, which already has it
+BUYER_MESSAGE = Schema(
+    id=Field(Message.message_id, to_str),
+    productName=Message.productName,
+    content=Message.content,
+    reply=Message.reply,
+    createdAt=Field(Message.created_at, isoformat),
+    repliedAt=Field(Message.replied_at, isoformat)
+)
+
+USER = Schema(
+    user_id=User.user_id,
+    username=User.username,
+    email=User.email,
+    phone_number=User.phone_number,
+    created_at=Field(User.created_at, isoformat)
+)
+
+SELLER = Schema(
+    seller_id=SellerProfile.seller_id,
+    username=SellerProfile.username,
+    email=SellerProfile.email,
+    business_name=SellerProfile.business_name,
+    approval_status=SellerProfile.approval_status,
+    phone_number=SellerProfile.phone_number,
+    created_at=Field(SellerProfile.created_at, isoformat)
+)
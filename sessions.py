@@ -0,0 +1,272 @@
+from datetime import datetime, timedelta
+import hashlib
+import json
+import secrets
+from flask import current_app
+from flask.sessions import SessionInterface, SessionMixin
+from sqlalchemy import select
+from werkzeug.datastructures import CallbackDict
+from models import db, SessionRecord
+
+try:
+    import redis
+except ImportError:  # optional - only needed for SESSION_REDIS_URL
+    redis = None
+
+# Principal kinds; each one's id is kept under '<kind>_id'. A browser logged
+# in as more than one has all of them recorded, so revoking any of them
+# reaches its session.
+PRINCIPAL_KINDS = ('admin', 'seller', 'user')
+STATUS_KEY = 'approval_status'
+
+def _sid(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def _split(data):
+    """Session dict -> ({kind: principal_id}, status, other keys)"""
+    rest = dict(data)
+    principals = dict((kind, rest.pop(f'{kind}_id')) for kind in PRINCIPAL_KINDS if f'{kind}_id' in rest)
+    return principals, rest.pop(STATUS_KEY, None), rest
+
+def _join(principals, status, rest):
+    data = dict(rest)
+    for kind, principal_id in principals.items():
+        data[f'{kind}_id'] = principal_id
+    if status is not None:
+        data[STATUS_KEY] = status
+    return data
+
+class SQLSessionStore(object):
+    """Sessions in the `sessions` table, read by primary key
+
+    Uses its own connection so saving a session never commits whatever a
+    view left in db.session.
+    """
+
+    table = SessionRecord.__table__
+
+    def load(self, sid):
+        """(data, expires_at) for a live session, or None"""
+        t = self.table
+        columns = [t.c[f'{kind}_id'] for kind in PRINCIPAL_KINDS]
+        with db.engine.connect() as conn:
+            row = conn.execute(select(
+                *columns, t.c.approval_status, t.c.data, t.c.expires_at
+            ).where(t.c.session_id == sid)).first()
+        if row is None or row.expires_at <= datetime.utcnow():
+            return None
+        principals = dict((kind, row[i]) for i, kind in enumerate(PRINCIPAL_KINDS) if row[i] is not None)
+        return _join(principals, row.approval_status, json.loads(row.data)), row.expires_at
+
+    def save(self, sid, data, expires_at):
+        principals, status, rest = _split(data)
+        values = dict((f'{kind}_id', principals.get(kind)) for kind in PRINCIPAL_KINDS)
+        values.update({
+            'approval_status': status,
+            'data': json.dumps(rest, separators=(',', ':')),
+            'expires_at': expires_at
+        })
+        t = self.table
+        with db.engine.begin() as conn:
+            if not conn.execute(t.update().where(t.c.session_id == sid).values(values)).rowcount:
+                conn.execute(t.insert().values(session_id=sid, **values))
+
+    def touch(self, sid, data, expires_at):
+        t = self.table
+        with db.engine.begin() as conn:
+            conn.execute(t.update().where(t.c.session_id == sid).values(expires_at=expires_at))
+
+    def delete(self, sid):
+        t = self.table
+        with db.engine.begin() as conn:
+            conn.execute(t.delete().where(t.c.session_id == sid))
+
+    def _principal(self, kind, principal_id):
+        return self.table.c[f'{kind}_id'] == principal_id
+
+    def revoke(self, kind, principal_id):
+        """Delete every session of a principal; returns how many there were"""
+        with db.engine.begin() as conn:
+            return conn.execute(self.table.delete().where(self._principal(kind, principal_id))).rowcount
+
+    def set_status(self, kind, principal_id, status):
+        with db.engine.begin() as conn:
+            conn.execute(self.table.update().where(self._principal(kind, principal_id)).values(approval_status=status))
+
+    def purge_expired(self):
+        with db.engine.begin() as conn:
+            return conn.execute(self.table.delete().where(self.table.c.expires_at <= datetime.utcnow())).rowcount
+
+class RedisSessionStore(object):
+    """Sessions in any Redis-compatible server, expired by the server itself
+
+    Each principal has a set of its session ids for bulk revocation.
+    """
+
+    def __init__(self, url, prefix='kukuhub:session:'):
+        if redis is None:
+            raise RuntimeError('SESSION_REDIS_URL is set but the redis package is not installed')
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def _key(self, sid):
+        return self.prefix + sid
+
+    def _index(self, kind, principal_id):
+        return f'{self.prefix}principal:{kind}:{principal_id}'
+
+    def _ttl(self, expires_at):
+        return max(1, int((expires_at - datetime.utcnow()).total_seconds()))
+
+    def load(self, sid):
+        raw, ttl = self.client.pipeline().get(self._key(sid)).ttl(self._key(sid)).execute()
+        if raw is None or ttl is None or ttl < 0:
+            return None
+        record = json.loads(raw)
+        return _join(record['p'], record['s'], record['d']), datetime.utcnow() + timedelta(seconds=ttl)
+
+    def save(self, sid, data, expires_at):
+        principals, status, rest = _split(data)
+        ttl = self._ttl(expires_at)
+        pipe = self.client.pipeline()
+        pipe.set(self._key(sid), json.dumps({'p': principals, 's': status, 'd': rest}), ex=ttl)
+        for kind, principal_id in principals.items():
+            index = self._index(kind, principal_id)
+            pipe.sadd(index, sid)
+            # Every save or touch sets the full idle timeout, so the index
+            # always lives at least as long as the sessions in it
+            pipe.expire(index, ttl)
+        pipe.execute()
+
+    def touch(self, sid, data, expires_at):
+        ttl = self._ttl(expires_at)
+        pipe = self.client.pipeline()
+        pipe.expire(self._key(sid), ttl)
+        for kind, principal_id in _split(data)[0].items():
+            pipe.expire(self._index(kind, principal_id), ttl)
+        pipe.execute()
+
+    def delete(self, sid):
+        self.client.delete(self._key(sid))
+
+    def revoke(self, kind, principal_id):
+        index = self._index(kind, principal_id)
+        sids = self.client.smembers(index)
+        pipe = self.client.pipeline()
+        for sid in sids:
+            pipe.delete(self._key(sid.decode()))
+        pipe.delete(index)
+        return sum(pipe.execute()[:-1])
+
+    def set_status(self, kind, principal_id, status):
+        for sid in self.client.smembers(self._index(kind, principal_id)):
+            key = self._key(sid.decode())
+            raw = self.client.get(key)
+            if raw is not None:
+                record = json.loads(raw)
+                record['s'] = status
+                self.client.set(key, json.dumps(record), keepttl=True)
+
+    def purge_expired(self):
+        return 0
+
+class ServerSession(CallbackDict, SessionMixin):
+    """Session data loaded from the store; the cookie only holds a token"""
+
+    def __init__(self, initial=None, token=None, expires_at=None):
+        def on_update(self):
+            self.modified = True
+        CallbackDict.__init__(self, initial, on_update)
+        self.token = token
+        self.expires_at = expires_at
+        self.principals = _split(initial or {})[0]
+        self.modified = False
+
+class ServerSessionInterface(SessionInterface):
+    """Flask session interface backed by a SQL or Redis session store
+
+    Sessions expire after SESSION_IDLE_TIMEOUT without a request. Each
+    request slides the expiry forward, writing to the store at most once
+    per SESSION_TOUCH_INTERVAL. Visitors who never store anything in their
+    session get no record and no cookie.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        token = request.cookies.get(self.get_cookie_name(app))
+        if token:
+            try:
+                record = self.store.load(_sid(token))
+            except Exception as e:
+                print(f"Error loading session: {str(e)}")
+                record = None
+            if record is not None:
+                data, expires_at = record
+                return ServerSession(data, token, expires_at)
+        return ServerSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.token is not None and session.modified:
+                self.store.delete(_sid(session.token))
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        expires_at = datetime.utcnow() + app.config['SESSION_IDLE_TIMEOUT']
+        if session.modified or session.token is None:
+            # Logging in (or switching principal) issues a fresh token, so a
+            # session id planted in the browser beforehand is worthless
+            if session.token is None or _split(session)[0] != session.principals:
+                if session.token is not None:
+                    self.store.delete(_sid(session.token))
+                session.token = secrets.token_urlsafe(32)
+            self.store.save(_sid(session.token), dict(session), expires_at)
+        elif (app.config['SESSION_REFRESH_EACH_REQUEST'] and session.expires_at is not None
+                and expires_at - session.expires_at >= app.config['SESSION_TOUCH_INTERVAL']):
+            self.store.touch(_sid(session.token), dict(session), expires_at)
+        else:
+            return
+
+        response.vary.add('Cookie')
+        response.set_cookie(
+            name,
+            session.token,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app)
+        )
+
+def init_sessions(app):
+    """Keep sessions server side - in Redis when SESSION_REDIS_URL is
+    configured, otherwise in the sessions table"""
+    url = app.config.get('SESSION_REDIS_URL')
+    store = RedisSessionStore(url) if url else SQLSessionStore()
+    app.session_interface = ServerSessionInterface(store)
+
+def _store():
+    # None for apps (e.g. standalone scripts) still on cookie sessions
+    return getattr(current_app.session_interface, 'store', None)
+
+def revoke_sessions(kind, principal_id):
+    """Log a principal out everywhere"""
+    store = _store()
+    return store.revoke(kind, principal_id) if store is not None else 0
+
+def set_session_status(kind, principal_id, status):
+    """Update the approval status held in a principal's sessions"""
+    store = _store()
+    if store is not None:
+        store.set_status(kind, principal_id, status)
+
+def purge_expired_sessions():
+    store = _store()
+    return store.purge_expired() if store is not None else 0
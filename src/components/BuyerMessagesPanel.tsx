@@ -24,14 +24,23 @@ interface BuyerMessagesPanelProps {
 const BuyerMessagesPanel = ({ isOpen, onClose, userEmail }: BuyerMessagesPanelProps) => {
   const [messages, setMessages] = useState<Message[]>([]);
   const [isLoading, setIsLoading] = useState(false);
+  const [since, setSince] = useState<string | null>(null);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [isLoadingMore, setIsLoadingMore] = useState(false);
   const { toast } = useToast();
 
-  const fetchMessages = async () => {
+  // Newest messages first; pass the previous nextCursor to append older ones
+  const fetchMessages = async (cursor: string | null = null) => {
     if (!userEmail) return;
     
-    setIsLoading(true);
+    if (cursor) {
+      setIsLoadingMore(true);
+    } else {
+      setIsLoading(true);
+    }
     try {
-      const response = await fetch(`http://localhost:5000/api/user/messages?email=${userEmail}`, {
+      const params = cursor ? `&cursor=${encodeURIComponent(cursor)}` : '';
+      const response = await fetch(`http://localhost:5000/api/user/messages?email=${userEmail}${params}`, {
         method: 'GET',
         credentials: 'include'
       });
@@ -39,7 +48,15 @@ const BuyerMessagesPanel = ({ isOpen, onClose, userEmail }: BuyerMessagesPanelPr
       const data = await response.json();
       
       if (data.success) {
-        setMessages(data.messages || []);
+        const page: Message[] = data.messages || [];
+        if (cursor) {
+          // Streamed messages may already be in the list
+          setMessages((current) => [...current, ...page.filter((msg) => !current.some((c) => c.id === msg.id))]);
+        } else {
+          setMessages(page);
+          setSince(data.since || null);
+        }
+        setNextCursor(data.nextCursor || null);
       } else {
         toast({
           title: "Error",
@@ -56,6 +73,7 @@ const BuyerMessagesPanel = ({ isOpen, onClose, userEmail }: BuyerMessagesPanelPr
       });
     } finally {
       setIsLoading(false);
+      setIsLoadingMore(false);
     }
   };
 
@@ -65,6 +83,32 @@ const BuyerMessagesPanel = ({ isOpen, onClose, userEmail }: BuyerMessagesPanelPr
     }
   }, [isOpen, userEmail]);
 
+  // While open, new messages and seller replies are pushed by the server.
+  // The stream starts from the `since` of the last fetch; on reconnect the
+  // browser sends the last event id and the server replays what was missed.
+  useEffect(() => {
+    if (!isOpen || !userEmail || !since) return;
+    
+    const source = new EventSource(
+      `http://localhost:5000/api/user/messages/stream?email=${encodeURIComponent(userEmail)}&since=${encodeURIComponent(since)}`,
+      { withCredentials: true }
+    );
+    
+    const upsert = (event: MessageEvent) => {
+      const incoming: Message = JSON.parse(event.data);
+      setMessages((current) => {
+        const rest = current.filter((msg) => msg.id !== incoming.id);
+        return [incoming, ...rest].sort((a, b) => b.createdAt.localeCompare(a.createdAt));
+      });
+    };
+    
+    source.addEventListener('message', upsert);
+    source.addEventListener('reply', upsert);
+    source.addEventListener('resync', () => fetchMessages());
+    
+    return () => source.close();
+  }, [isOpen, userEmail, since]);
+
   if (!isOpen) return null;
 
   return (
@@ -122,6 +166,14 @@ const BuyerMessagesPanel = ({ isOpen, onClose, userEmail }: BuyerMessagesPanelPr
               </div>
             ))
           )}
+          
+          {!isLoading && nextCursor && (
+            <div className="flex justify-center">
+              <Button variant="outline" onClick={() => fetchMessages(nextCursor)} disabled={isLoadingMore}>
+                {isLoadingMore ? "Loading..." : "Load older messages"}
+              </Button>
+            </div>
+          )}
         </div>
       </div>
     </div>
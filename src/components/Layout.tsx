@@ -15,7 +15,7 @@ interface LayoutProps {
 
 const Layout = ({ children, searchQuery, setSearchQuery }: LayoutProps) => {
   const { cart, showCart, setShowCart, updateQuantity, removeFromCart } = useCart();
-  const { orders, showOrders, setShowOrders } = useOrders();
+  const { orders, showOrders, setShowOrders, hasMoreOrders, loadMoreOrders } = useOrders();
   const { isAuthenticated, userEmail, handleLogout } = useAuth();
 
   return (
@@ -46,6 +46,8 @@ const Layout = ({ children, searchQuery, setSearchQuery }: LayoutProps) => {
         showOrders={showOrders}
         setShowOrders={setShowOrders}
         orders={orders}
+        hasMore={hasMoreOrders}
+        onLoadMore={loadMoreOrders}
       />
     </>
   );
@@ -9,12 +9,16 @@ interface OrdersSidebarProps {
   showOrders: boolean;
   setShowOrders: (show: boolean) => void;
   orders: Order[];
+  hasMore?: boolean;
+  onLoadMore?: () => void;
 }
 
 const OrdersSidebar = ({
   showOrders,
   setShowOrders,
   orders,
+  hasMore = false,
+  onLoadMore,
 }: OrdersSidebarProps) => {
   const navigate = useNavigate();
 
@@ -138,6 +142,12 @@ const OrdersSidebar = ({
                 </div>
               </div>
             ))}
+            
+            {hasMore && onLoadMore && (
+              <Button variant="outline" className="w-full" onClick={onLoadMore}>
+                Load more orders
+              </Button>
+            )}
           </div>
         )}
       </div>
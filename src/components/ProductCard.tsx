@@ -32,6 +32,19 @@ const ProductCard = ({ product, onAddToCart }: ProductCardProps) => {
   const videoUrl = product.video?.startsWith('/static') 
     ? `http://localhost:5000${product.video}` 
     : product.video;
+  
+  // Frame extracted from the video on the server, once it is ready
+  const posterUrl = product.poster ? `http://localhost:5000${product.poster}` : undefined;
+
+  // Let the browser pick the smallest resized copy that fills the card
+  const srcSet = (format: string) => {
+    const widths = product.variants?.[format];
+    if (!widths) return undefined;
+    return Object.entries(widths)
+      .map(([width, url]) => `http://localhost:5000${url} ${width}w`)
+      .join(', ');
+  };
+  const imageSizes = "(max-width: 640px) 100vw, (max-width: 1024px) 50vw, 320px";
 
   const renderMedia = () => {
     const hasImage = product.image && product.image.trim() !== '';
@@ -47,7 +60,7 @@ const ProductCard = ({ product, onAddToCart }: ProductCardProps) => {
             src={videoUrl}
             className="h-full w-full object-cover"
             controls
-            poster={hasImage ? imageUrl : undefined}
+            poster={hasImage ? imageUrl : posterUrl}
             onError={(e) => console.error('Video load error:', e)}
           />
           {hasImage && (
@@ -66,12 +79,20 @@ const ProductCard = ({ product, onAddToCart }: ProductCardProps) => {
     if (hasImage) {
       return (
         <div className="aspect-square w-full overflow-hidden relative">
-          <img
-            src={imageUrl}
-            alt={product.name}
-            className="h-full w-full object-cover transition-transform duration-300 hover:scale-105"
-            onError={(e) => console.error('Image load error:', e)}
-          />
+          <picture>
+            {product.variants?.webp && (
+              <source type="image/webp" srcSet={srcSet('webp')} sizes={imageSizes} />
+            )}
+            <img
+              src={imageUrl}
+              srcSet={srcSet('jpeg')}
+              sizes={imageSizes}
+              alt={product.name}
+              loading="lazy"
+              className="h-full w-full object-cover transition-transform duration-300 hover:scale-105"
+              onError={(e) => console.error('Image load error:', e)}
+            />
+          </picture>
           {hasVideo && (
             <button
               onClick={() => setShowVideo(true)}
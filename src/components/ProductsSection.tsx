@@ -14,51 +14,67 @@ const ProductsSection = ({ searchQuery, onAddToCart }: ProductsSectionProps) =>
   const [selectedCategory, setSelectedCategory] = useState<string | null>(null);
   const [isLoading, setIsLoading] = useState(true);
   const [products, setProducts] = useState(sampleProducts);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [isLoadingMore, setIsLoadingMore] = useState(false);
 
-  useEffect(() => {
-    const fetchProducts = async () => {
-      try {
-        const response = await fetch('http://localhost:5000/api/products');
-        const data = await response.json();
+  const query = searchQuery.trim();
+
+  const fallbackProducts = () =>
+    selectedCategory ? sampleProducts.filter((product) => product.category === selectedCategory) : sampleProducts;
+
+  // The API returns one page at a time; pass the previous nextCursor to get the next page.
+  // Searches and category filters run on the server so only matching products are downloaded.
+  const fetchProducts = async (cursor: string | null = null) => {
+    try {
+      const params = new URLSearchParams();
+      if (query) params.set('q', query);
+      if (selectedCategory) params.set('category', selectedCategory);
+      if (cursor) params.set('cursor', cursor);
+      const url = `http://localhost:5000/api/products${query ? '/search' : ''}?${params}`;
+      const response = await fetch(url);
+      const data = await response.json();
+      
+      if (data.success) {
+        // Process images in products
+        const processedProducts = data.products.map((product: any) => {
+          if (product.image && product.image.startsWith('/static')) {
+            return {
+              ...product,
+              image: `http://localhost:5000${product.image}`
+            };
+          }
+          return product;
+        });
         
-        if (data.success) {
-          // Process images in products
-          const processedProducts = data.products.map((product: any) => {
-            if (product.image && product.image.startsWith('/static')) {
-              return {
-                ...product,
-                image: `http://localhost:5000${product.image}`
-              };
-            }
-            return product;
-          });
-          
-          setProducts(processedProducts);
-        } else {
-          // Fallback to sample products if API fails
-          setProducts(sampleProducts);
-        }
-      } catch (error) {
-        console.error("Error fetching products:", error);
+        setProducts((current) => cursor ? [...current, ...processedProducts] : processedProducts);
+        setNextCursor(data.nextCursor || null);
+      } else if (!cursor) {
         // Fallback to sample products if API fails
-        setProducts(sampleProducts);
-      } finally {
-        setIsLoading(false);
+        setProducts(query ? [] : fallbackProducts());
       }
-    };
-    
-    fetchProducts();
-  }, []);
+    } catch (error) {
+      console.error("Error fetching products:", error);
+      if (!cursor) {
+        // Fallback to sample products if API fails
+        setProducts(fallbackProducts());
+      }
+    } finally {
+      setIsLoading(false);
+      setIsLoadingMore(false);
+    }
+  };
 
-  // Filter products based on search query and selected category
-  const filteredProducts = products
-    .filter((product) => 
-      (selectedCategory ? product.category === selectedCategory : true) &&
-      (searchQuery
-        ? product.name.toLowerCase().includes(searchQuery.toLowerCase()) ||
-          product.description.toLowerCase().includes(searchQuery.toLowerCase())
-        : true)
-    );
+  // Wait for a pause in typing before searching
+  useEffect(() => {
+    const timer = setTimeout(() => fetchProducts(), query ? 300 : 0);
+    return () => clearTimeout(timer);
+  }, [query, selectedCategory]);
+
+  const loadMore = () => {
+    if (!nextCursor) return;
+    setIsLoadingMore(true);
+    fetchProducts(nextCursor);
+  };
 
   if (isLoading) {
     return (
@@ -105,12 +121,21 @@ const ProductsSection = ({ searchQuery, onAddToCart }: ProductsSectionProps) =>
 
       {/* Products grid */}
       <div className="grid gap-6 sm:grid-cols-2 lg:grid-cols-3 xl:grid-cols-4">
-        {filteredProducts.map((product) => (
+        {products.map((product) => (
           <ProductCard key={product.id} product={product} onAddToCart={onAddToCart} />
         ))}
       </div>
 
-      {filteredProducts.length === 0 && (
+      {nextCursor && (
+        <div className="mt-8 flex justify-center">
+          <Button variant="outline" onClick={loadMore} disabled={isLoadingMore}>
+            {isLoadingMore && <Loader2 className="mr-2 h-4 w-4 animate-spin" />}
+            Load more products
+          </Button>
+        </div>
+      )}
+
+      {products.length === 0 && (
         <div className="flex min-h-[200px] flex-col items-center justify-center rounded-lg border-2 border-dashed border-gray-200 p-8 text-center">
           <p className="mb-2 text-lg font-semibold text-gray-900">No products found</p>
           <p className="text-sm text-gray-500">
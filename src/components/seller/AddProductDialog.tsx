@@ -12,6 +12,7 @@ import { useToast } from "@/hooks/use-toast";
 import { categories, productTypes } from "@/data/products";
 import { useState, useEffect } from "react";
 import { useNavigate } from "react-router-dom";
+import { uploadVideo } from "@/utils/videoUpload";
 
 interface AddProductDialogProps {
   open: boolean;
@@ -177,9 +178,7 @@ const AddProductDialog = ({ open, onOpenChange, onProductAdded }: AddProductDial
       if (formData.image) {
         productFormData.append('image', formData.image);
       }
-      if (formData.video) {
-        productFormData.append('video', formData.video);
-      }
+      // Videos are sent separately in resumable chunks once the product exists
       
       const response = await fetch('http://localhost:5000/api/products/create', {
         method: 'POST',
@@ -190,6 +189,23 @@ const AddProductDialog = ({ open, onOpenChange, onProductAdded }: AddProductDial
       const data = await response.json();
       
       if (data.success) {
+        if (formData.video) {
+          toast({
+            title: "Uploading Video",
+            description: "Your product was saved. Uploading the video...",
+          });
+          try {
+            await uploadVideo(formData.video, data.productId);
+          } catch (error) {
+            console.error("Error uploading video:", error);
+            toast({
+              title: "Video Upload Failed",
+              description: "The product was added, but its video could not be uploaded.",
+              variant: "destructive",
+            });
+          }
+        }
+        
         toast({
           title: "Product Added",
           description: "The product has been added to your inventory.",
@@ -74,6 +74,29 @@ const MessagesDialog = ({ open, onOpenChange, onMessagesLoaded }: MessagesDialog
     }
   }, [open]);
 
+  // While open, new messages and replies are pushed by the server
+  useEffect(() => {
+    if (!open) return;
+    
+    const source = new EventSource('http://localhost:5000/api/seller/messages/stream', {
+      withCredentials: true
+    });
+    
+    const upsert = (event: MessageEvent) => {
+      const incoming: Message = JSON.parse(event.data);
+      setMessages((current) => {
+        const rest = current.filter((msg) => msg.id !== incoming.id);
+        return [incoming, ...rest].sort((a, b) => b.createdAt.localeCompare(a.createdAt));
+      });
+    };
+    
+    source.addEventListener('message', upsert);
+    source.addEventListener('reply', upsert);
+    source.addEventListener('resync', () => fetchMessages());
+    
+    return () => source.close();
+  }, [open]);
+
   const handleReply = (message: Message) => {
     setSelectedMessage(message);
     setShowReplyDialog(true);
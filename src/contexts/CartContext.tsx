@@ -19,6 +19,12 @@ interface CartContextType {
 
 const CartContext = createContext<CartContextType | undefined>(undefined);
 
+const CART_API = 'http://localhost:5000/api/cart';
+
+// Only catalogue products can be stored server side; the offline sample
+// products have slug ids
+const isStoredProduct = (id: string) => /^\d+$/.test(id);
+
 export const CartProvider = ({ children }: { children: ReactNode }) => {
   const [cart, setCart] = useState<CartItem[]>([]);
   const [cartTotal, setCartTotal] = useState(0);
@@ -38,6 +44,92 @@ export const CartProvider = ({ children }: { children: ReactNode }) => {
     }
   }, []);
 
+  const fetchServerCart = async () => {
+    try {
+      const response = await fetch(CART_API, { credentials: 'include' });
+      const data = await response.json();
+      return data.success ? data : null;
+    } catch (error) {
+      console.error("Error fetching cart:", error);
+      return null;
+    }
+  };
+
+  const dropFailedItems = (errors: { id: string; message: string }[]) => {
+    if (!errors || errors.length === 0) return;
+    const failed = errors.map((error) => error.id);
+    setCart((prevCart) => prevCart.filter((item) => !failed.includes(item.id)));
+    toast.error("Some items are no longer available and were removed from your cart");
+  };
+
+  // Signed-in buyers keep their cart on the server. A guest cart is carried
+  // over when the stored cart is empty; otherwise the stored cart wins.
+  useEffect(() => {
+    if (!isAuthenticated || !userId) return;
+
+    const loadCart = async () => {
+      const data = await fetchServerCart();
+      if (!data) return;
+
+      const guestItems = cart.filter((item) => isStoredProduct(item.id));
+      if (data.cart.length > 0 || guestItems.length === 0) {
+        setCart(data.cart);
+        return;
+      }
+
+      try {
+        const response = await fetch(`${CART_API}/update`, {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/json' },
+          body: JSON.stringify({
+            items: guestItems.map((item) => ({ id: item.id, quantity: item.quantity })),
+            version: data.version
+          }),
+          credentials: 'include'
+        });
+        const result = await response.json();
+        if (result.success) {
+          dropFailedItems(result.errors);
+        } else if (result.conflict) {
+          // Changed from another device meanwhile - show what is stored
+          const current = await fetchServerCart();
+          if (current) setCart(current.cart);
+        }
+      } catch (error) {
+        console.error("Error saving cart:", error);
+      }
+    };
+
+    loadCart();
+  }, [isAuthenticated, userId]);
+
+  // Send one change to the stored cart. Each op only touches its own item,
+  // so it is sent without a version and applies on top of any other change.
+  const saveCartOps = async (ops: { op: string; id: string; quantity?: number }[]) => {
+    if (!isAuthenticated) return;
+    const storedOps = ops.filter((op) => isStoredProduct(op.id));
+    if (storedOps.length === 0) return;
+
+    try {
+      const response = await fetch(`${CART_API}/items`, {
+        method: 'PATCH',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ ops: storedOps }),
+        credentials: 'include'
+      });
+      const data = await response.json();
+      if (data.success) {
+        dropFailedItems(data.errors);
+      } else {
+        console.error("Failed to update cart:", data.message);
+        const current = await fetchServerCart();
+        if (current) setCart(current.cart);
+      }
+    } catch (error) {
+      console.error("Error updating cart:", error);
+    }
+  };
+
   // Update cartTotal whenever cart changes and save to localStorage
   useEffect(() => {
     const total = cart.reduce(
@@ -71,6 +163,7 @@ export const CartProvider = ({ children }: { children: ReactNode }) => {
         return [...prevCart, { ...product, quantity: 1 }];
       }
     });
+    saveCartOps([{ op: 'add', id: product.id, quantity: 1 }]);
   };
 
   const updateQuantity = (productId: string, quantity: number) => {
@@ -84,6 +177,7 @@ export const CartProvider = ({ children }: { children: ReactNode }) => {
         item.id === productId ? { ...item, quantity } : item
       )
     );
+    saveCartOps([{ op: 'set', id: productId, quantity }]);
   };
 
   const removeFromCart = (productId: string) => {
@@ -94,11 +188,16 @@ export const CartProvider = ({ children }: { children: ReactNode }) => {
       }
       return prevCart.filter((item) => item.id !== productId);
     });
+    saveCartOps([{ op: 'remove', id: productId }]);
   };
 
   const clearCart = () => {
     setCart([]);
     localStorage.removeItem("cart");
+    if (isAuthenticated) {
+      fetch(`${CART_API}/clear`, { method: 'DELETE', credentials: 'include' })
+        .catch((error) => console.error("Error clearing cart:", error));
+    }
   };
 
   return (
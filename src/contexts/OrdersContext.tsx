@@ -29,6 +29,8 @@ interface OrdersContextType {
   setShowOrders: (show: boolean) => void;
   updateOrderStatus: (orderId: string, status: Order["status"]) => void;
   fetchOrders: () => Promise<void>;
+  hasMoreOrders: boolean;
+  loadMoreOrders: () => Promise<void>;
 }
 
 const OrdersContext = createContext<OrdersContextType | undefined>(undefined);
@@ -36,6 +38,7 @@ const OrdersContext = createContext<OrdersContextType | undefined>(undefined);
 export const OrdersProvider = ({ children }: { children: ReactNode }) => {
   const [orders, setOrders] = useState<Order[]>([]);
   const [showOrders, setShowOrders] = useState(false);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
   const { isAuthenticated, userId } = useAuth();
 
   // Load orders from API when authenticated
@@ -45,11 +48,14 @@ export const OrdersProvider = ({ children }: { children: ReactNode }) => {
     }
   }, [isAuthenticated, userId]);
 
-  const fetchOrders = async () => {
+  // The API returns one page of orders at a time, newest first; pass the
+  // previous nextCursor to append the next page
+  const fetchOrders = async (cursor: string | null = null) => {
     if (!isAuthenticated) return;
     
     try {
-      const response = await fetch('http://localhost:5000/api/orders', {
+      const params = cursor ? `?cursor=${encodeURIComponent(cursor)}` : '';
+      const response = await fetch(`http://localhost:5000/api/orders${params}`, {
         method: 'GET',
         credentials: 'include'
       });
@@ -57,7 +63,7 @@ export const OrdersProvider = ({ children }: { children: ReactNode }) => {
       if (response.ok) {
         const data = await response.json();
         if (data.success && data.orders) {
-          setOrders(data.orders.map((order: any) => ({
+          const page = data.orders.map((order: any) => ({
             id: order.order_id,
             date: order.created_at,
             total: order.total,
@@ -71,7 +77,9 @@ export const OrdersProvider = ({ children }: { children: ReactNode }) => {
               sellerId: String(item.seller_id)
             })),
             userId: order.user_id
-          })));
+          }));
+          setOrders((current) => cursor ? [...current, ...page] : page);
+          setNextCursor(data.nextCursor || null);
         }
       } else {
         console.error("Failed to fetch orders");
@@ -81,6 +89,10 @@ export const OrdersProvider = ({ children }: { children: ReactNode }) => {
     }
   };
 
+  const loadMoreOrders = async () => {
+    if (nextCursor) await fetchOrders(nextCursor);
+  };
+
   const addOrder = async (order: Order) => {
     // Add to local state immediately for better UX
     setOrders((prevOrders) => [order, ...prevOrders]);
@@ -163,7 +175,9 @@ export const OrdersProvider = ({ children }: { children: ReactNode }) => {
         showOrders, 
         setShowOrders, 
         updateOrderStatus,
-        fetchOrders
+        fetchOrders: () => fetchOrders(),
+        hasMoreOrders: nextCursor !== null,
+        loadMoreOrders
       }}
     >
       {children}
@@ -7,7 +7,10 @@ export interface Product {
   description: string;
   image: string;
   video?: string;
+  poster?: string;
   mediaType?: 'image' | 'video' | 'both';
+  // Resized copies of the image, by format and then width in pixels
+  variants?: Record<string, Record<string, string>>;
   stock: number;
   sellerId?: string;
   sellerName?: string;
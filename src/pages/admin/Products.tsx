@@ -27,15 +27,27 @@ export default function Products() {
   
   const fetchProducts = async () => {
     try {
-      const response = await fetch('http://localhost:5000/api/products', {
-        method: 'GET',
-        credentials: 'include'
-      });
+      // The listing is paginated; follow nextCursor so the admin table has every product
+      let allProducts: Product[] = [];
+      let cursor: string | null = null;
+      let data: any;
       
-      const data = await response.json();
+      do {
+        const url = `http://localhost:5000/api/products?limit=100${cursor ? `&cursor=${encodeURIComponent(cursor)}` : ''}`;
+        const response = await fetch(url, {
+          method: 'GET',
+          credentials: 'include'
+        });
+        
+        data = await response.json();
+        if (!data.success) break;
+        
+        allProducts = allProducts.concat(data.products || []);
+        cursor = data.nextCursor || null;
+      } while (cursor);
       
       if (data.success) {
-        setProducts(data.products || []);
+        setProducts(allProducts);
       } else {
         toast({
           title: "Error",
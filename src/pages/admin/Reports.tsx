@@ -118,16 +118,28 @@ const Reports = () => {
 
   const fetchOrders = async () => {
     try {
-      const response = await fetch('http://localhost:5000/api/admin/orders', {
-        method: 'GET',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        credentials: 'include'
-      });
+      // The admin order listing is paginated; collect every page for the report
+      let orders: any[] = [];
+      let page = 1;
       
-      const data = await response.json();
-      return data.orders || [];
+      while (true) {
+        const response = await fetch(`http://localhost:5000/api/admin/orders?page=${page}&pageSize=200`, {
+          method: 'GET',
+          headers: {
+            'Content-Type': 'application/json',
+          },
+          credentials: 'include'
+        });
+        
+        const data = await response.json();
+        if (!data.success) break;
+        
+        orders = orders.concat(data.orders || []);
+        if (orders.length >= data.total || (data.orders || []).length === 0) break;
+        page += 1;
+      }
+      
+      return orders;
     } catch (error) {
       console.error("Error fetching orders:", error);
       return [];
@@ -75,10 +75,12 @@ export const initiateSTKPush = async (phoneNumber: string, amount: number): Prom
       };
     }
     
+    // The push is sent in the background; the job id can be polled with
+    // checkPaymentStatus just like a CheckoutRequestID
     return {
       success: data.success,
       message: data.message || 'STK push initiated successfully',
-      checkoutRequestID: data.checkoutRequestID
+      checkoutRequestID: data.checkoutRequestID || data.jobId
     };
   } catch (error) {
     console.error('M-Pesa STK push error:', error);
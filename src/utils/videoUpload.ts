@@ -0,0 +1,133 @@
+
+// Chunked, resumable video uploads
+
+const API_URL = 'http://localhost:5000/api/uploads/video';
+const STORAGE_KEY = 'videoUploads';
+const CHUNK_ATTEMPTS = 3;
+const ASSEMBLY_POLL_MS = 1000;
+
+const sha256Hex = async (data: ArrayBuffer): Promise<string> => {
+  const digest = await crypto.subtle.digest('SHA-256', data);
+  return Array.from(new Uint8Array(digest))
+    .map((byte) => byte.toString(16).padStart(2, '0'))
+    .join('');
+};
+
+// Uploads in progress are remembered by file, so picking the same file again
+// after a dropped connection or page reload resumes where it stopped
+const fileKey = (file: File, productId?: number | string) =>
+  `${productId ?? ''}:${file.name}:${file.size}:${file.lastModified}`;
+
+const savedUploads = (): Record<string, string> => {
+  try {
+    return JSON.parse(localStorage.getItem(STORAGE_KEY) || '{}');
+  } catch (e) {
+    return {};
+  }
+};
+
+const rememberUpload = (key: string, uploadId: string | null) => {
+  const uploads = savedUploads();
+  if (uploadId) {
+    uploads[key] = uploadId;
+  } else {
+    delete uploads[key];
+  }
+  localStorage.setItem(STORAGE_KEY, JSON.stringify(uploads));
+};
+
+const request = async (url: string, options: RequestInit = {}) => {
+  const response = await fetch(url, { credentials: 'include', ...options });
+  const data = await response.json();
+  if (!data.success) {
+    throw new Error(data.message || `Upload request failed with status ${response.status}`);
+  }
+  return data;
+};
+
+const findUpload = async (key: string) => {
+  const uploadId = savedUploads()[key];
+  if (!uploadId) return null;
+  try {
+    const data = await request(`${API_URL}/${uploadId}`);
+    return ['uploading', 'assembling'].includes(data.upload.status) ? data.upload : null;
+  } catch (e) {
+    rememberUpload(key, null);
+    return null;
+  }
+};
+
+/**
+ * Uploads a video in checksummed chunks and attaches it to a product
+ *
+ * @param file The video file
+ * @param productId Product the video belongs to
+ * @param onProgress Called with the fraction (0-1) uploaded so far
+ * @returns The stored video URL
+ */
+export const uploadVideo = async (
+  file: File,
+  productId?: number | string,
+  onProgress?: (fraction: number) => void
+): Promise<string> => {
+  const key = fileKey(file, productId);
+  let upload = await findUpload(key);
+
+  if (!upload) {
+    const data = await request(API_URL, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({
+        filename: file.name,
+        size: file.size,
+        contentType: file.type,
+        productId
+      })
+    });
+    upload = data.upload;
+    rememberUpload(key, upload.uploadId);
+  }
+
+  // An upload already being assembled has all its chunks
+  const received = new Set<number>(
+    upload.status === 'assembling' ? Array.from({ length: upload.totalChunks }, (_, i) => i) : upload.receivedChunks
+  );
+  for (let index = 0; index < upload.totalChunks; index++) {
+    if (!received.has(index)) {
+      const start = index * upload.chunkSize;
+      const chunk = await file.slice(start, start + upload.chunkSize).arrayBuffer();
+      const checksum = await sha256Hex(chunk);
+      // A failed chunk is simply sent again; the server replaces it
+      for (let attempt = 1; ; attempt++) {
+        try {
+          await request(`${API_URL}/${upload.uploadId}/chunks/${index}`, {
+            method: 'PUT',
+            headers: {
+              'Content-Type': 'application/octet-stream',
+              'X-Chunk-SHA256': checksum
+            },
+            body: chunk
+          });
+          break;
+        } catch (error) {
+          if (attempt >= CHUNK_ATTEMPTS) throw error;
+          await new Promise((resolve) => setTimeout(resolve, 1000 * attempt));
+        }
+      }
+      received.add(index);
+    }
+    onProgress?.(received.size / upload.totalChunks);
+  }
+
+  // The server joins the chunks in the background; wait until it is done
+  let { upload: assembled } = await request(`${API_URL}/${upload.uploadId}/complete`, { method: 'POST' });
+  while (assembled.status === 'assembling') {
+    await new Promise((resolve) => setTimeout(resolve, ASSEMBLY_POLL_MS));
+    ({ upload: assembled } = await request(`${API_URL}/${upload.uploadId}`));
+  }
+  rememberUpload(key, null);
+  if (assembled.status !== 'complete') {
+    throw new Error(assembled.error || 'The video could not be processed, please upload it again');
+  }
+  return assembled.videoUrl;
+};
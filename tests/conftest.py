@@ -0,0 +1,168 @@
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import event
+
+# The app reads its configuration at import. Tests run against a SQLite
+# file in a scratch directory (uploads land there too) unless
+# TEST_DATABASE_URL points at a MySQL test database.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORK_DIR = tempfile.mkdtemp(prefix='kukuhub-tests-')
+DATABASE_URL = os.environ.get('TEST_DATABASE_URL') or f"sqlite:///{os.path.join(WORK_DIR, 'test.db')}"
+os.environ['DATABASE_URL'] = DATABASE_URL
+os.environ['MPESA_CALLBACK_CONSUMER'] = '0'
+sys.path.insert(0, ROOT)
+os.chdir(WORK_DIR)
+
+from app import app as flask_app
+import app_auth
+from cache import cache, init_cache
+from models import db, User, SellerProfile, Product
+
+IS_SQLITE = DATABASE_URL.startswith('sqlite')
+
+# Benchmarks run at a size that keeps the suite quick; raise
+# BENCHMARK_SCALE for numbers worth comparing. Results are printed at the
+# end of the run.
+BENCHMARK_SCALE = float(os.environ.get('BENCHMARK_SCALE', 1))
+_benchmark_lines = []
+
+def _takes_write_lock(statement, context):
+    if not statement.lstrip().upper().startswith('SELECT'):
+        return True
+    compiled = getattr(context, 'compiled', None)
+    return getattr(getattr(compiled, 'statement', None), '_for_update_arg', None) is not None
+
+with flask_app.app_context():
+    if IS_SQLITE:
+        # SQLite has no row locks, only one database-wide write lock. A
+        # transaction starts out reading without it (as InnoDB reads don't
+        # lock); its first write, savepoint or FOR UPDATE select restarts it
+        # with BEGIN IMMEDIATE, so concurrent writers queue up as FOR UPDATE
+        # would make them on MySQL. Nothing it read before needs keeping.
+        @event.listens_for(db.engine, 'connect')
+        def _sqlite_connect(dbapi_connection, connection_record):
+            dbapi_connection.isolation_level = None
+            dbapi_connection.execute('PRAGMA busy_timeout = 30000')
+            # Readers must not block a commit either, as they don't on InnoDB
+            dbapi_connection.execute('PRAGMA journal_mode = WAL')
+            # Enforce foreign keys as InnoDB does
+            dbapi_connection.execute('PRAGMA foreign_keys = ON')
+
+        @event.listens_for(db.engine, 'begin')
+        def _sqlite_begin(connection):
+            connection.info['sqlite_write_lock'] = None
+            connection.exec_driver_sql('BEGIN')
+            connection.info['sqlite_write_lock'] = False
+
+        @event.listens_for(db.engine, 'before_cursor_execute')
+        def _sqlite_write_lock(connection, cursor, statement, parameters, context, executemany):
+            if connection.info.get('sqlite_write_lock') is not False or not _takes_write_lock(statement, context):
+                return
+            connection.info['sqlite_write_lock'] = True
+            cursor.execute('COMMIT')
+            cursor.execute('BEGIN IMMEDIATE')
+
+@pytest.fixture
+def app():
+    """The app with empty tables and empty in-process caches, so no test
+    sees another's data"""
+    with flask_app.app_context():
+        db.drop_all()
+        db.create_all()
+        init_cache(flask_app)
+    cache.counters = dict.fromkeys(cache.counters, 0)
+    app_auth._cache.clear()
+    yield flask_app
+    with flask_app.app_context():
+        db.session.remove()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+class QueryCounter(object):
+    """Records the SQL statements the app sends while active"""
+
+    def __init__(self):
+        self.statements = []
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __len__(self):
+        return len(self.statements)
+
+    def reset(self):
+        del self.statements[:]
+
+    def selects(self, table):
+        return [s for s in self.statements if s.lstrip().upper().startswith('SELECT') and table in s]
+
+@pytest.fixture
+def queries(app):
+    counter = QueryCounter()
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', counter)
+    yield counter
+    event.remove(engine, 'before_cursor_execute', counter)
+
+def make_catalog(n_products, n_sellers=3, stock=5):
+    """Sellers and products spread over them; returns the product ids"""
+    sellers = [
+        SellerProfile(username=f'seller{i}', email=f'seller{i}@example.com', password_hash='x',
+                      business_name=f'Farm {i}', approval_status='approved')
+        for i in range(n_sellers)
+    ]
+    db.session.add_all(sellers)
+    db.session.flush()
+    start = datetime(2026, 1, 1)
+    products = [
+        Product(name=f'Product {i}', description='Healthy birds', price=100 + i, stock=stock,
+                category=('Chicks', 'Eggs', 'Layers')[i % 3], seller_id=sellers[i % n_sellers].seller_id,
+                created_at=start + timedelta(minutes=i))
+        for i in range(n_products)
+    ]
+    db.session.add_all(products)
+    db.session.commit()
+    return [product.product_id for product in products]
+
+def make_buyer(email='buyer@example.com'):
+    buyer = User(username=email.split('@')[0], email=email, password_hash='x')
+    db.session.add(buyer)
+    db.session.commit()
+    return buyer.user_id
+
+def log_in(client, **session_values):
+    with client.session_transaction() as session:
+        session.update(session_values)
+
+def scaled(n):
+    return max(1, int(n * BENCHMARK_SCALE))
+
+def best_time(func, repeat=5):
+    """Fastest of `repeat` runs of func(), in seconds"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+@pytest.fixture
+def benchmark_report(request):
+    """Call with a line of results to have it printed after the run"""
+    def report(line):
+        _benchmark_lines.append(f'{request.node.name}: {line}')
+    return report
+
+def pytest_terminal_summary(terminalreporter):
+    if _benchmark_lines:
+        terminalreporter.section(f'benchmarks ({DATABASE_URL.split(":")[0]}, scale {BENCHMARK_SCALE:g})')
+        for line in _benchmark_lines:
+            terminalreporter.write_line(line)
@@ -0,0 +1,123 @@
+import time
+from threading import Event
+from flask import current_app
+from cache import Cache, LRUCache
+
+TTL = 0.05
+
+class Loader(object):
+    """Numbered values; `gate` holds each load until it is set"""
+
+    def __init__(self):
+        self.calls = 0
+        self.gate = Event()
+        self.gate.set()
+        self.error = None
+
+    def __call__(self):
+        self.calls += 1
+        assert self.gate.wait(10)
+        if self.error:
+            raise self.error
+        return f'value-{self.calls}'
+
+def _wait_for(cache, counter, count=1):
+    deadline = time.monotonic() + 10
+    while cache.counters[counter] < count:
+        assert time.monotonic() < deadline, f'{counter} never reached {count}'
+        time.sleep(0.01)
+
+def test_fresh_value_is_a_hit():
+    cache = Cache()
+    load = Loader()
+
+    assert cache.get_or_load('stats', load, ttl=60) == 'value-1'
+    assert cache.get_or_load('stats', load, ttl=60) == 'value-1'
+
+    assert load.calls == 1
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+    assert cache.stats()['hitRatio'] == 0.5
+
+def test_stale_value_is_served_while_one_refresh_runs():
+    cache = Cache()
+    load = Loader()
+    cache.get_or_load('stats', load, ttl=TTL)
+    time.sleep(TTL * 2)
+
+    # The refresh is held, yet every caller gets the old value at once
+    load.gate.clear()
+    started = time.monotonic()
+    assert [cache.get_or_load('stats', load, ttl=TTL) for _ in range(5)] == ['value-1'] * 5
+    assert time.monotonic() - started < 1
+    assert cache.counters['stale_hits'] == 5
+    load.gate.set()
+    _wait_for(cache, 'refreshes')
+
+    assert load.calls == 2 and cache.counters['refreshes'] == 1
+    assert cache.get_or_load('stats', load, ttl=TTL) == 'value-2'
+    assert cache.counters['hits'] == 1
+
+def test_value_past_its_stale_window_is_reloaded_inline():
+    cache = Cache()
+    load = Loader()
+    cache.get_or_load('stats', load, ttl=TTL, stale_ttl=TTL)
+    time.sleep(TTL * 3)
+
+    assert cache.get_or_load('stats', load, ttl=TTL, stale_ttl=TTL) == 'value-2'
+    assert cache.counters['misses'] == 2 and cache.counters['stale_hits'] == 0
+
+def test_failed_refresh_keeps_the_stale_value():
+    cache = Cache()
+    load = Loader()
+    cache.get_or_load('stats', load, ttl=TTL)
+    time.sleep(TTL * 2)
+
+    load.error = RuntimeError('database is down')
+    assert cache.get_or_load('stats', load, ttl=TTL) == 'value-1'
+    _wait_for(cache, 'errors')
+    assert cache.counters['refreshes'] == 0
+
+    # The next stale read tries again
+    load.error = None
+    assert cache.get_or_load('stats', load, ttl=TTL) == 'value-1'
+    _wait_for(cache, 'refreshes')
+    assert cache.get_or_load('stats', load, ttl=TTL) == 'value-3'
+
+def test_refresh_runs_in_an_app_context(app):
+    cache = Cache()
+    names = []
+
+    def load():
+        names.append(current_app.name)
+        return len(names)
+
+    with app.app_context():
+        cache.get_or_load('stats', load, ttl=TTL, app=app)
+    time.sleep(TTL * 2)
+    # Outside any context, as a request that already returned would be
+    assert cache.get_or_load('stats', load, ttl=TTL, app=app) == 1
+    _wait_for(cache, 'refreshes')
+    assert names == [app.name, app.name]
+
+def test_unreadable_backend_falls_back_to_the_loader():
+    class BrokenBackend(LRUCache):
+        def get(self, key):
+            raise ConnectionError('cache server is down')
+
+    cache = Cache(BrokenBackend())
+    load = Loader()
+
+    assert cache.get_or_load('stats', load) == 'value-1'
+    assert cache.get_or_load('stats', load) == 'value-2'
+    assert cache.counters['errors'] == 2 and cache.counters['misses'] == 2
+
+def test_lru_evicts_the_least_recently_used_entry():
+    store = LRUCache(maxsize=2)
+    far = time.time() + 60
+    store.set('a', 1, far, far)
+    store.set('b', 2, far, far)
+    store.get('a')
+    store.set('c', 3, far, far)
+
+    assert store.get('b') is None
+    assert store.get('a') == (1, far) and store.get('c') == (3, far)
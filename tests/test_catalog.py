@@ -0,0 +1,138 @@
+from sqlalchemy import text
+from conftest import make_buyer, make_catalog, log_in
+from models import db, CartItem, Product
+
+def test_product_listing_query_count_does_not_grow_with_page_size(app, client, queries):
+    with app.app_context():
+        make_catalog(60)
+
+    queries.reset()
+    small = client.get('/api/products?limit=5').get_json()
+    small_count = len(queries)
+
+    queries.reset()
+    large = client.get('/api/products?limit=50').get_json()
+
+    assert len(small['products']) == 5
+    assert len(large['products']) == 50
+    assert len(queries) == small_count
+    # One SELECT loads the products with their sellers
+    assert len(queries.selects('products')) == 1
+    assert all(product['sellerName'].startswith('Farm') for product in large['products'])
+
+def test_product_detail_loads_seller_in_same_query(app, client, queries):
+    with app.app_context():
+        product_ids = make_catalog(3)
+
+    queries.reset()
+    product = client.get(f'/api/products/{product_ids[0]}').get_json()['product']
+
+    assert product['sellerName'] == 'Farm 0'
+    assert len(queries.selects('products')) == 1
+    assert not [s for s in queries.selects('seller_profile') if 'products' not in s]
+
+def test_cart_query_count_does_not_grow_with_items(app, client, queries):
+    with app.app_context():
+        product_ids = make_catalog(20)
+        buyer_id = make_buyer()
+        db.session.add_all(CartItem(user_id=buyer_id, product_id=product_id, quantity=1)
+                           for product_id in product_ids)
+        db.session.commit()
+    log_in(client, user_id=buyer_id)
+
+    queries.reset()
+    cart = client.get('/api/cart').get_json()
+
+    assert cart['success'] and len(cart['cart']) == 20
+    assert len(queries.selects('cart_items')) <= 2
+    assert len(queries.selects('products')) <= 2
+
+def test_products_of_missing_sellers_are_still_listed(app, client):
+    with app.app_context():
+        product_ids = make_catalog(3)
+        if db.engine.dialect.name == 'sqlite':
+            # The pragma can't change inside a transaction, so use a bare
+            # autocommit connection
+            db.session.close()
+            raw = db.engine.raw_connection()
+            try:
+                raw.execute('PRAGMA foreign_keys = OFF')
+                raw.execute('UPDATE products SET seller_id = 9999 WHERE product_id = ?', (product_ids[0],))
+            finally:
+                raw.execute('PRAGMA foreign_keys = ON')
+                raw.close()
+        else:
+            db.session.execute(text('SET FOREIGN_KEY_CHECKS = 0'))
+            try:
+                db.session.execute(text('UPDATE products SET seller_id = 9999 WHERE product_id = :id'),
+                                   {'id': product_ids[0]})
+                db.session.commit()
+            finally:
+                db.session.execute(text('SET FOREIGN_KEY_CHECKS = 1'))
+                db.session.commit()
+
+    products = client.get('/api/products').get_json()['products']
+
+    assert len(products) == 3
+    assert [p['sellerName'] for p in products if p['id'] == str(product_ids[0])] == ['Unknown Seller']
+
+def test_cart_ops_for_missing_products_are_reported(app, client):
+    with app.app_context():
+        product_id = make_catalog(1)[0]
+        buyer_id = make_buyer()
+    log_in(client, user_id=buyer_id)
+
+    result = client.patch('/api/cart/items', json={'ops': [
+        {'op': 'add', 'id': 9999, 'quantity': 1},
+        {'op': 'add', 'id': product_id, 'quantity': 2}
+    ]}).get_json()
+
+    assert result['success']
+    assert result['errors'] == [{'id': '9999', 'message': 'Product not found'}]
+    assert [item['quantity'] for item in client.get('/api/cart').get_json()['cart']] == [2]
+
+def test_unchanged_catalogue_is_answered_with_304(app, client, queries):
+    with app.app_context():
+        make_catalog(10)
+    first = client.get('/api/products')
+    etag = first.headers['ETag']
+    assert etag.startswith('W/') and first.cache_control.no_cache and first.cache_control.public
+
+    queries.reset()
+    again = client.get('/api/products', headers={'If-None-Match': etag})
+
+    assert again.status_code == 304 and again.data == b''
+    assert again.headers['ETag'] == etag
+    # The catalogue version was read, and none of the listing queries ran
+    assert len(queries.selects('catalog_version')) == 1
+    assert not [s for s in queries.statements if 'products' in s or 'seller_profile' in s]
+
+def test_committed_catalogue_changes_move_the_etag(app, client):
+    with app.app_context():
+        product_id = make_catalog(3)[0]
+    etag = client.get('/api/products').headers['ETag']
+
+    with app.app_context():
+        # Rolled back changes, and savepoints, leave it alone
+        db.session.get(Product, product_id).stock = 1
+        db.session.rollback()
+        with db.session.begin_nested():
+            db.session.get(Product, product_id).stock = 2
+        assert client.get('/api/products', headers={'If-None-Match': etag}).status_code == 304
+
+        db.session.commit()
+    changed = client.get('/api/products', headers={'If-None-Match': etag})
+    assert changed.status_code == 200 and changed.headers['ETag'] != etag
+    assert client.get('/api/products', headers={'If-None-Match': changed.headers['ETag']}).status_code == 304
+
+def test_seller_listing_etags_are_private_to_the_seller(app, client):
+    with app.app_context():
+        make_catalog(4, n_sellers=2)
+    log_in(client, seller_id=1, approval_status='approved')
+    mine = client.get('/api/seller/products')
+    log_in(client, seller_id=2, approval_status='approved')
+    theirs = client.get('/api/seller/products')
+
+    assert mine.cache_control.private and 'Cookie' in mine.headers['Vary']
+    assert mine.headers['ETag'] != theirs.headers['ETag']
+    assert client.get('/api/seller/products', headers={'If-None-Match': mine.headers['ETag']}).status_code == 200
@@ -0,0 +1,73 @@
+import gzip
+import json
+import os
+import pytest
+import compression
+from conftest import make_catalog
+from compression import compress_response
+from media import URL_PREFIX, media_root
+
+@pytest.fixture
+def listing(app):
+    with app.app_context():
+        make_catalog(40)
+    return '/api/products?limit=40'
+
+def test_large_json_is_gzipped(client, listing):
+    plain = client.get(listing)
+    response = client.get(listing, headers={'Accept-Encoding': 'gzip, deflate'})
+
+    assert 'Content-Encoding' not in plain.headers
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary'] and 'Accept-Encoding' in plain.headers['Vary']
+    assert len(response.data) < len(plain.data) / 4
+    assert json.loads(gzip.decompress(response.data)) == plain.get_json()
+    # The catalogue ETag is weak, so it is shared by both encodings
+    assert response.headers['ETag'] == plain.headers['ETag']
+
+def test_small_responses_are_sent_as_is(app, client, listing, monkeypatch):
+    monkeypatch.setitem(app.config, 'COMPRESS_MIN_SIZE', 1024 * 1024)
+
+    response = client.get(listing, headers={'Accept-Encoding': 'gzip'})
+
+    assert 'Content-Encoding' not in response.headers
+    assert response.get_json()['success']
+
+def test_gzip_is_chosen_when_brotli_is_not_installed(client, listing, monkeypatch):
+    monkeypatch.setattr(compression, 'brotli', None)
+
+    response = client.get(listing, headers={'Accept-Encoding': 'br, gzip'})
+
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert client.get(listing, headers={'Accept-Encoding': 'br'}).headers.get('Content-Encoding') is None
+
+def test_brotli_is_preferred_when_installed(client, listing):
+    brotli = pytest.importorskip('brotli')
+
+    response = client.get(listing, headers={'Accept-Encoding': 'gzip, br'})
+    refused = client.get(listing, headers={'Accept-Encoding': 'br;q=0, gzip'})
+
+    assert response.headers['Content-Encoding'] == 'br'
+    assert json.loads(brotli.decompress(response.data))['success']
+    assert refused.headers['Content-Encoding'] == 'gzip'
+
+def test_strong_etag_is_renamed_for_the_encoded_body(app):
+    with app.test_request_context(headers={'Accept-Encoding': 'gzip'}):
+        response = app.response_class('x' * 4096, mimetype='text/plain')
+        response.set_etag('abc')
+        compress_response(response, app.config)
+
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.get_etag() == ('abc-gzip', False)
+
+def test_files_and_partial_responses_are_left_alone(app, client):
+    with app.app_context():
+        with open(os.path.join(media_root(), 'price-list.json'), 'w') as f:
+            json.dump({'prices': list(range(2000))}, f)
+
+    whole = client.get(URL_PREFIX + 'price-list.json', headers={'Accept-Encoding': 'gzip'})
+    part = client.get(URL_PREFIX + 'price-list.json', headers={'Accept-Encoding': 'gzip', 'Range': 'bytes=0-99'})
+
+    assert whole.status_code == 200 and 'Content-Encoding' not in whole.headers
+    assert part.status_code == 206 and 'Content-Encoding' not in part.headers
+    assert len(part.data) == 100
@@ -0,0 +1,87 @@
+import time
+from threading import Thread
+import pytest
+from werkzeug.security import generate_password_hash
+import credentials
+from conftest import scaled
+from credentials import VerificationPool
+from models import db, User
+
+# Cheap enough to keep the suite quick; the benchmark measures the pool,
+# not the hash function
+METHOD = 'pbkdf2:sha256:20000'
+
+@pytest.fixture
+def cheap_hashing(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'PASSWORD_HASH_METHOD', METHOD)
+    monkeypatch.setattr(credentials, 'pool', VerificationPool(workers=2, max_pending=32, wait=2.0))
+    return credentials.pool
+
+def _make_user(email, password, method=METHOD):
+    user = User(username=email.split('@')[0], email=email,
+                password_hash=generate_password_hash(password, method=method))
+    db.session.add(user)
+    db.session.commit()
+    return user.user_id
+
+def _login(client, email, password):
+    return client.post('/api/login', json={'email': email, 'password': password})
+
+def test_login_rehashes_an_outdated_hash(app, client, cheap_hashing):
+    with app.app_context():
+        user_id = _make_user('buyer@example.com', 'secret', method='pbkdf2:sha256:1000')
+
+    assert not _login(client, 'buyer@example.com', 'wrong').get_json()['success']
+    with app.app_context():
+        assert db.session.get(User, user_id).password_hash.startswith('pbkdf2:sha256:1000$')
+
+    assert _login(client, 'buyer@example.com', 'secret').get_json()['success']
+    with app.app_context():
+        assert db.session.get(User, user_id).password_hash.startswith(METHOD + '$')
+    assert _login(client, 'buyer@example.com', 'secret').get_json()['success']
+    assert cheap_hashing.stats() == {'verified': 3, 'rehashed': 1, 'busy': 0}
+
+def test_login_is_refused_with_503_when_the_pool_is_full(app, client, monkeypatch):
+    pool = VerificationPool(workers=1, max_pending=1, wait=0.01)
+    monkeypatch.setattr(credentials, 'pool', pool)
+    with app.app_context():
+        _make_user('buyer@example.com', 'secret')
+
+    pool.slots.acquire()
+    try:
+        response = _login(client, 'buyer@example.com', 'secret')
+    finally:
+        pool.slots.release()
+
+    assert response.status_code == 503
+    assert not response.get_json()['success']
+    assert pool.stats()['busy'] == 1
+    assert _login(client, 'buyer@example.com', 'secret').get_json()['success']
+
+def test_login_storm_throughput(app, cheap_hashing, benchmark_report):
+    # As many clients as a worker has request threads; each request holds
+    # a pooled connection and the session store briefly takes another
+    clients = 8
+    count = clients * max(1, scaled(40) // clients)
+    with app.app_context():
+        for i in range(4):
+            _make_user(f'buyer{i}@example.com', 'secret')
+    statuses = []
+
+    def log_in(first):
+        client = app.test_client()
+        for i in range(first, count, clients):
+            statuses.append(_login(client, f'buyer{i % 4}@example.com', 'secret').status_code)
+
+    threads = [Thread(target=log_in, args=(i,)) for i in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    assert statuses == [200] * count
+    assert cheap_hashing.stats()['verified'] == count
+
+    benchmark_report(f'{count} logins from {clients} clients ({METHOD}, 2 workers): {count / elapsed:.0f} logins/s')
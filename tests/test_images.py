@@ -0,0 +1,89 @@
+import io
+import os
+import time
+import images
+from PIL import Image
+from conftest import log_in, make_catalog
+from images import VARIANT_FORMATS, VARIANT_WIDTHS, generate_variants, image_variants
+from media import URL_PREFIX, media_root, media_url, store_stream
+from models import db
+
+def _jpeg(width=1600, height=900, color=(200, 120, 40)):
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), color).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+def _drain(timeout=10):
+    """Wait until image_jobs has finished every queued image"""
+    deadline = time.monotonic() + timeout
+    while images._queued:
+        assert time.monotonic() < deadline, 'image jobs did not finish'
+        time.sleep(0.01)
+
+def _upload(client, data, filename='hen.jpg'):
+    return client.post('/api/upload/product-image', content_type='multipart/form-data',
+                       data={'image': (io.BytesIO(data), filename)}).get_json()
+
+def _path(url):
+    return os.path.join(media_root(), url[len(URL_PREFIX):])
+
+def test_uploaded_image_gets_every_variant(app, client):
+    with app.app_context():
+        make_catalog(0, n_sellers=1)
+    log_in(client, seller_id=1, approval_status='approved')
+
+    result = _upload(client, _jpeg())
+    assert result['success']
+    _drain()
+
+    with app.app_context():
+        variants = image_variants(result['imageUrl'])
+        assert sorted(variants) == ['jpeg', 'webp']
+        for key, ext, _, _ in VARIANT_FORMATS:
+            assert sorted(variants[key], key=int) == [str(width) for width in VARIANT_WIDTHS]
+            for width, url in variants[key].items():
+                assert url.endswith(f'_w{width}{ext}')
+                with Image.open(_path(url)) as variant:
+                    assert variant.width == int(width)
+
+def test_missing_variants_are_queued_on_first_read(app):
+    with app.app_context():
+        url = media_url(store_stream(io.BytesIO(_jpeg(color=(10, 90, 200))), 'hen.jpg'))
+        db.session.commit()
+
+        # Stored without queueing: the first read queues them and falls back
+        assert image_variants(url) == {}
+        _drain()
+        assert sorted(image_variants(url)['webp']) == sorted(str(width) for width in VARIANT_WIDTHS)
+
+def test_small_images_are_not_upscaled(app):
+    with app.app_context():
+        url = media_url(store_stream(io.BytesIO(_jpeg(400, 300, (0, 0, 0))), 'chick.jpg'))
+        db.session.commit()
+        generate_variants(media_root(), url)
+
+        for width in VARIANT_WIDTHS:
+            with Image.open(_path(image_variants(url)['jpeg'][str(width)])) as variant:
+                assert variant.width == min(width, 400)
+
+def test_undecodable_upload_is_not_requeued(app, client, monkeypatch):
+    with app.app_context():
+        make_catalog(0, n_sellers=1)
+    log_in(client, seller_id=1, approval_status='approved')
+    submitted = []
+    submit = images.image_jobs.submit
+
+    def counting_submit(*args, **kwargs):
+        submitted.append(args)
+        return submit(*args, **kwargs)
+    monkeypatch.setattr(images.image_jobs, 'submit', counting_submit)
+
+    url = _upload(client, b'not an image at all', 'egg.jpg')['imageUrl']
+    _drain()
+    assert len(submitted) == 1
+
+    with app.app_context():
+        for _ in range(3):
+            assert image_variants(url) == {}
+    assert len(submitted) == 1
+    assert images.blob_sha(url) in images._failed
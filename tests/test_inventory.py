@@ -0,0 +1,70 @@
+from threading import Barrier, Thread
+from conftest import make_buyer, make_catalog, log_in
+from models import db, AdminProfile, Order, OrderItem, Product
+
+def _checkout_concurrently(app, orders):
+    """Post every (buyer_id, items) order at once; returns the JSON responses"""
+    barrier = Barrier(len(orders))
+    results = [None] * len(orders)
+
+    def checkout(index, buyer_id, items):
+        client = app.test_client()
+        log_in(client, user_id=buyer_id)
+        barrier.wait()
+        results[index] = client.post('/api/orders/create', json={'items': items}).get_json()
+
+    threads = [Thread(target=checkout, args=(i, buyer_id, items)) for i, (buyer_id, items) in enumerate(orders)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def test_concurrent_checkouts_cannot_oversell(app):
+    with app.app_context():
+        product_id = make_catalog(1, n_sellers=1, stock=5)[0]
+        buyer_ids = [make_buyer(f'buyer{i}@example.com') for i in range(12)]
+
+    results = _checkout_concurrently(app, [(buyer_id, [{'id': product_id, 'quantity': 1}]) for buyer_id in buyer_ids])
+
+    succeeded = [r for r in results if r['success']]
+    assert len(succeeded) == 5
+    assert all('left in stock' in r['message'] for r in results if not r['success'])
+    with app.app_context():
+        assert db.session.get(Product, product_id).stock == 0
+        assert Order.query.count() == 5
+        assert db.session.query(db.func.sum(OrderItem.quantity)).scalar() == 5
+
+def test_concurrent_multi_product_checkouts_keep_stock_consistent(app):
+    with app.app_context():
+        first, second = make_catalog(2, n_sellers=1, stock=6)
+        buyer_ids = [make_buyer(f'buyer{i}@example.com') for i in range(8)]
+
+    # Products listed in opposite orders must not deadlock each other
+    items = [[{'id': second, 'quantity': 2}, {'id': first, 'quantity': 1}],
+             [{'id': first, 'quantity': 1}, {'id': second, 'quantity': 2}]]
+    results = _checkout_concurrently(app, [(buyer_id, items[i % 2]) for i, buyer_id in enumerate(buyer_ids)])
+
+    succeeded = len([r for r in results if r['success']])
+    assert succeeded == 3
+    with app.app_context():
+        assert db.session.get(Product, first).stock == 6 - succeeded
+        assert db.session.get(Product, second).stock == 6 - 2 * succeeded
+
+def test_cancelling_an_order_returns_its_stock(app, client):
+    with app.app_context():
+        product_id = make_catalog(1, n_sellers=1, stock=3)[0]
+        buyer_id = make_buyer()
+        admin = AdminProfile(username='admin', email='admin@example.com', password_hash='x')
+        db.session.add(admin)
+        db.session.commit()
+        admin_id = admin.admin_id
+    log_in(client, user_id=buyer_id)
+
+    order_id = client.post('/api/orders/create', json={'items': [{'id': product_id, 'quantity': 3}]}).get_json()['orderId']
+    assert not client.post('/api/orders/create', json={'items': [{'id': product_id, 'quantity': 1}]}).get_json()['success']
+
+    log_in(client, admin_id=admin_id)
+    assert client.put(f'/api/orders/update-status/{order_id}', json={'status': 'Cancelled'}).get_json()['success']
+    with app.app_context():
+        assert db.session.get(Product, product_id).stock == 3
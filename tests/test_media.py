@@ -0,0 +1,154 @@
+import io
+import os
+import time
+from datetime import datetime, timedelta
+from threading import Event, Thread
+import media
+from conftest import log_in, make_catalog
+from media import URL_PREFIX, blob_sha, media_root, purge_orphans
+from models import db, MediaBlob
+
+def _upload(client, data, filename='hen.bin'):
+    return client.post('/api/upload/product-image', content_type='multipart/form-data',
+                       data={'image': (io.BytesIO(data), filename)})
+
+def _path(url):
+    return os.path.join(media_root(), url[len(URL_PREFIX):])
+
+def _product(client, image_url):
+    return client.post('/api/products/create', json={
+        'name': 'Kienyeji hen', 'description': 'Free range', 'price': 800, 'stock': 3,
+        'category': 'Layers', 'image': image_url
+    }).get_json()['productId']
+
+def _refcount(url):
+    return db.session.get(MediaBlob, blob_sha(url)).refcount
+
+def _age(url, days=2):
+    blob = db.session.get(MediaBlob, blob_sha(url))
+    blob.created_at = datetime.utcnow() - timedelta(days=days)
+    if blob.released_at is not None:
+        blob.released_at = blob.created_at
+    db.session.commit()
+
+def _tmp_files():
+    return os.listdir(os.path.join(media_root(), media.TMP_DIR))
+
+def _seller(app, client):
+    with app.app_context():
+        make_catalog(0, n_sellers=1)
+    log_in(client, seller_id=1, approval_status='approved')
+
+def test_identical_uploads_are_stored_once(app, client):
+    _seller(app, client)
+    data = os.urandom(4096)
+
+    first = _upload(client, data, 'a.bin').get_json()['imageUrl']
+    second = _upload(client, data, 'b.bin').get_json()['imageUrl']
+    other = _upload(client, os.urandom(4096), 'a.bin').get_json()['imageUrl']
+
+    assert first == second != other
+    with app.app_context():
+        assert MediaBlob.query.count() == 2
+        with open(_path(first), 'rb') as stored:
+            assert stored.read() == data
+        assert _tmp_files() == []
+
+def test_oversized_upload_is_refused_and_not_kept(app, client, monkeypatch):
+    _seller(app, client)
+    monkeypatch.setitem(app.config, 'MEDIA_MAX_IMAGE_BYTES', 1024 * 1024)
+
+    response = _upload(client, os.urandom(1024 * 1024 + 1))
+
+    assert response.status_code == 413
+    assert response.get_json() == {'success': False, 'message': 'File is larger than 1 MB'}
+    with app.app_context():
+        assert MediaBlob.query.count() == 0
+        assert _tmp_files() == []
+
+def test_request_over_max_content_length_is_refused(app, client, monkeypatch):
+    _seller(app, client)
+    monkeypatch.setitem(app.config, 'MAX_CONTENT_LENGTH', 64 * 1024)
+
+    response = _upload(client, os.urandom(128 * 1024))
+
+    assert response.status_code == 413
+    assert not response.get_json()['success']
+
+def test_references_are_counted_per_product(app, client):
+    _seller(app, client)
+    url = _upload(client, os.urandom(4096)).get_json()['imageUrl']
+
+    first = _product(client, url)
+    second = _product(client, url)
+    with app.app_context():
+        assert _refcount(url) == 2
+
+    assert client.delete(f'/api/products/{first}').get_json()['success']
+    with app.app_context():
+        assert _refcount(url) == 1
+        assert db.session.get(MediaBlob, blob_sha(url)).released_at is None
+
+    assert client.delete(f'/api/products/{second}').get_json()['success']
+    with app.app_context():
+        assert _refcount(url) == 0
+        assert db.session.get(MediaBlob, blob_sha(url)).released_at is not None
+
+def test_purge_removes_only_old_orphans_and_their_derived_files(app, client):
+    _seller(app, client)
+    used, recent, orphan = [_upload(client, os.urandom(4096)).get_json()['imageUrl'] for _ in range(3)]
+    _product(client, used)
+    with app.app_context():
+        for url in (used, orphan):
+            _age(url)
+        derived = _path(orphan).rsplit('.', 1)[0] + '_w320.webp'
+        open(derived, 'wb').close()
+
+        assert purge_orphans() == 1
+
+        assert [blob.sha256 for blob in MediaBlob.query.order_by(MediaBlob.sha256)] == \
+            sorted(blob_sha(url) for url in (used, recent))
+        assert os.path.exists(_path(used)) and os.path.exists(_path(recent))
+        assert not os.path.exists(_path(orphan)) and not os.path.exists(derived)
+
+def test_upload_racing_a_purge_keeps_its_file(app, client, monkeypatch):
+    _seller(app, client)
+    data = os.urandom(4096)
+    url = _upload(client, data).get_json()['imageUrl']
+    with app.app_context():
+        _age(url)
+
+    # Hold the purge after it has locked and deleted the row, just before
+    # it removes the file
+    purging = Event()
+    resume = Event()
+    remove_files = media.remove_files
+
+    def paused_remove_files(paths):
+        purging.set()
+        resume.wait(10)
+        remove_files(paths)
+    monkeypatch.setattr(media, 'remove_files', paused_remove_files)
+
+    def purge():
+        with app.app_context():
+            purge_orphans()
+    purger = Thread(target=purge)
+    purger.start()
+    assert purging.wait(10)
+
+    results = []
+    uploader = Thread(target=lambda: results.append(_upload(client, data).get_json()))
+    uploader.start()
+    time.sleep(0.3)
+    # The re-upload waits for the purge's row lock
+    assert not results
+    resume.set()
+    purger.join()
+    uploader.join()
+
+    assert results[0]['imageUrl'] == url
+    with app.app_context():
+        assert _refcount(url) == 0
+        with open(_path(url), 'rb') as stored:
+            assert stored.read() == data
@@ -0,0 +1,101 @@
+import hashlib
+import os
+import pytest
+from media import TMP_DIR, URL_PREFIX, media_root
+from routes.media_files import IMMUTABLE_MAX_AGE, MUTABLE_MAX_AGE
+
+DATA = bytes(range(256)) * 16
+
+def _store(app, name, data=DATA):
+    with app.app_context():
+        path = os.path.join(media_root(), name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+    return URL_PREFIX + name
+
+@pytest.fixture
+def hashed(app):
+    return _store(app, hashlib.sha256(DATA).hexdigest() + '.jpg')
+
+def test_hashed_file_is_cached_for_good(client, hashed):
+    response = client.get(hashed)
+
+    assert response.status_code == 200 and response.data == DATA
+    assert response.headers['ETag'] == '"%s"' % hashed.rsplit('/', 1)[1]
+    assert response.cache_control.max_age == IMMUTABLE_MAX_AGE
+    assert response.cache_control.immutable and response.cache_control.public
+
+def test_matching_etag_gets_304(client, hashed):
+    etag = client.get(hashed).headers['ETag']
+
+    response = client.get(hashed, headers={'If-None-Match': etag})
+
+    assert response.status_code == 304 and response.data == b''
+    assert response.headers['ETag'] == etag
+    assert client.get(hashed, headers={'If-None-Match': '"other"'}).status_code == 200
+
+def test_range_request_gets_206(client, hashed):
+    response = client.get(hashed, headers={'Range': 'bytes=100-199'})
+
+    assert response.status_code == 206
+    assert response.data == DATA[100:200]
+    assert response.headers['Content-Range'] == f'bytes 100-199/{len(DATA)}'
+
+    # A suffix range, as video players ask for the end of the file
+    tail = client.get(hashed, headers={'Range': 'bytes=-10'})
+    assert tail.status_code == 206 and tail.data == DATA[-10:]
+    beyond = client.get(hashed, headers={'Range': f'bytes={len(DATA)}-'})
+    assert beyond.status_code == 416
+
+def test_if_range_with_a_stale_etag_gets_the_whole_file(client, hashed):
+    etag = client.get(hashed).headers['ETag']
+
+    current = client.get(hashed, headers={'Range': 'bytes=0-9', 'If-Range': etag})
+    stale = client.get(hashed, headers={'Range': 'bytes=0-9', 'If-Range': '"replaced"'})
+
+    assert current.status_code == 206 and current.data == DATA[:10]
+    assert stale.status_code == 200 and stale.data == DATA
+
+def test_other_files_are_revalidated(app, client):
+    url = _store(app, 'legacy-photo.jpg')
+
+    response = client.get(url)
+
+    assert response.status_code == 200
+    assert response.cache_control.max_age == MUTABLE_MAX_AGE and not response.cache_control.immutable
+    # A rewrite under the same name changes the ETag
+    _store(app, 'legacy-photo.jpg', DATA + b'more')
+    assert client.get(url, headers={'If-None-Match': response.headers['ETag']}).status_code == 200
+
+def test_spool_directory_and_missing_files_are_not_served(app, client):
+    spooled = _store(app, f'{TMP_DIR}/upload.part')
+
+    assert client.get(spooled).status_code == 404
+    assert client.get(URL_PREFIX + 'missing.jpg').status_code == 404
+    assert client.get(URL_PREFIX + '../app.py').status_code == 404
+
+def test_accel_redirect_hands_the_file_to_nginx(app, client, hashed, monkeypatch):
+    monkeypatch.setitem(app.config, 'MEDIA_SENDFILE', 'x-accel-redirect')
+    monkeypatch.setitem(app.config, 'MEDIA_ACCEL_PREFIX', '/protected-media/')
+    name = hashed.rsplit('/', 1)[1]
+
+    response = client.get(hashed)
+
+    assert response.status_code == 200 and response.data == b''
+    assert response.headers['X-Accel-Redirect'] == f'/protected-media/{name}'
+    assert response.mimetype == 'image/jpeg'
+    assert response.cache_control.immutable
+    # Conditional requests are still answered here, without handing off
+    again = client.get(hashed, headers={'If-None-Match': response.headers['ETag']})
+    assert again.status_code == 304 and 'X-Accel-Redirect' not in again.headers
+
+def test_sendfile_names_the_file_on_disk(app, client, hashed, monkeypatch):
+    monkeypatch.setitem(app.config, 'MEDIA_SENDFILE', 'x-sendfile')
+
+    response = client.get(hashed)
+
+    with app.app_context():
+        path = os.path.abspath(os.path.join(media_root(), hashed[len(URL_PREFIX):]))
+    assert response.headers['X-Sendfile'] == path
+    assert response.data == b''
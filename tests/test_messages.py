@@ -0,0 +1,68 @@
+import json
+from datetime import timedelta
+from conftest import log_in, make_catalog
+from models import db, Message
+
+def _send(client, content):
+    return client.post('/api/messages/send', json={
+        'sellerId': 1, 'content': content, 'senderName': 'Buyer',
+        'senderEmail': 'buyer@example.com', 'productName': 'Product 0'
+    }).get_json()
+
+def _first_events(response, count):
+    """The first `count` events of a stream as (id, event, data) tuples"""
+    events = []
+    chunks = response.response
+    try:
+        for chunk in chunks:
+            chunk = chunk.decode() if isinstance(chunk, bytes) else chunk
+            fields = dict(line.split(': ', 1) for line in chunk.strip().split('\n') if ': ' in line)
+            if 'event' in fields:
+                events.append((fields.get('id'), fields['event'], json.loads(fields['data'])))
+            if len(events) == count:
+                break
+    finally:
+        response.close()
+    return events
+
+def test_reconnecting_stream_replays_missed_changes(app, client):
+    with app.app_context():
+        make_catalog(1, n_sellers=1)
+    since = client.get('/api/user/messages?email=buyer@example.com').get_json()['since']
+    first = _send(client, 'Is this available?')['messageId']
+    second = _send(client, 'And delivery?')['messageId']
+    with app.app_context():
+        message = db.session.get(Message, first)
+        message.reply = 'Yes'
+        message.replied_at = message.created_at + timedelta(minutes=1)
+        db.session.commit()
+
+    response = client.get('/api/user/messages/stream?email=buyer@example.com',
+                          headers={'Last-Event-ID': since}, buffered=False)
+    events = _first_events(response, 2)
+
+    assert [(event, data['id']) for _, event, data in events] == [('message', str(second)), ('reply', str(first))]
+    # Each id resumes after its own event
+    last_id = events[0][0]
+    response = client.get('/api/user/messages/stream?email=buyer@example.com',
+                          headers={'Last-Event-ID': last_id}, buffered=False)
+    assert [data['id'] for _, _, data in _first_events(response, 1)] == [str(first)]
+
+def test_unreadable_last_event_id_asks_for_a_resync(app, client):
+    response = client.get('/api/user/messages/stream?email=buyer@example.com',
+                          headers={'Last-Event-ID': 'garbage'}, buffered=False)
+
+    assert [event for _, event, _ in _first_events(response, 1)] == ['resync']
+
+def test_rejected_seller_cannot_read_or_answer_messages(app, client):
+    with app.app_context():
+        make_catalog(1, n_sellers=1)
+    message_id = _send(client, 'Is this available?')['messageId']
+
+    log_in(client, seller_id=1, approval_status='rejected')
+    assert not client.get('/api/seller/messages').get_json()['success']
+    assert not client.post(f'/api/messages/{message_id}/reply', json={'reply': 'Yes'}).get_json()['success']
+
+    log_in(client, seller_id=1, approval_status='approved')
+    assert [m['id'] for m in client.get('/api/seller/messages').get_json()['messages']] == [str(message_id)]
+    assert client.post(f'/api/messages/{message_id}/reply', json={'reply': 'Yes'}).get_json()['success']
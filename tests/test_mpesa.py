@@ -0,0 +1,207 @@
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+import pytest
+from jobs import JobQueue
+from models import PaymentTransaction
+from routes import mpesa
+from routes.mpesa import AUTH_ENDPOINT, STK_PUSH_ENDPOINT
+from routes.mpesa_client import CircuitBreaker, CircuitOpenError, MpesaClient
+from routes.mpesa_token import TokenCache
+
+BASE_DELAY = 0.05
+
+class StubMpesa(ThreadingHTTPServer):
+    """Local stand-in for the Daraja API
+
+    STK pushes are answered from `script`, one (status, delay) per request;
+    once it runs out they succeed. Every request is logged with its time.
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        ThreadingHTTPServer.__init__(self, ('127.0.0.1', 0), StubHandler)
+        self.script = []
+        self.log = []
+        self.tokens = 0
+        self.connections = 0
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def calls(self, path):
+        return [entry for entry in self.log if entry[0] == path]
+
+class StubHandler(BaseHTTPRequestHandler):
+    # Keep-alive, like the real API
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        stub = self.server
+        stub.log.append((self.path.split('?')[0], time.monotonic(), None))
+        stub.tokens += 1
+        self._reply(200, {'access_token': f'token-{stub.tokens}', 'expires_in': '3599'})
+
+    def do_POST(self):
+        stub = self.server
+        self.rfile.read(int(self.headers['Content-Length']))
+        stub.log.append((self.path, time.monotonic(), self.headers['Authorization']))
+        status, delay = stub.script.pop(0) if stub.script else (200, 0)
+        time.sleep(delay)
+        if status == 200:
+            self._reply(200, {'ResponseCode': '0', 'MerchantRequestID': 'm-1',
+                              'CheckoutRequestID': f'ws_CO_{len(stub.log)}'})
+        else:
+            self._reply(status, {'errorMessage': f'stub error {status}'})
+
+@pytest.fixture
+def stub(app, monkeypatch):
+    server = StubMpesa()
+    Thread(target=server.serve_forever, daemon=True).start()
+    client = MpesaClient(server.url, connect_timeout=1, read_timeout=0.5, failure_threshold=10)
+    monkeypatch.setattr(mpesa, 'mpesa_client', client)
+    monkeypatch.setattr(mpesa, 'token_cache', TokenCache(mpesa.fetch_access_token))
+    monkeypatch.setattr(mpesa, 'stk_jobs', JobQueue(workers=2, base_delay=BASE_DELAY))
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def _push(client):
+    response = client.post('/api/mpesa/stkpush', json={'phoneNumber': '254700000000', 'amount': 10})
+    assert response.status_code == 202
+    job_id = response.get_json()['jobId']
+    deadline = time.monotonic() + 10
+    while True:
+        status = client.get(f'/api/mpesa/status/{job_id}').get_json()
+        if status['status'] != 'pending' or status.get('checkoutRequestID'):
+            return mpesa.stk_jobs.get(job_id), status
+        assert time.monotonic() < deadline, 'STK push job did not finish'
+        time.sleep(0.02)
+
+def test_push_is_retried_with_backoff_and_a_new_token_after_401(app, client, stub):
+    stub.script = [(500, 0), (401, 0)]
+
+    job, status = _push(client)
+
+    assert job.status == 'done' and job.attempts == 3
+    assert status['checkoutRequestID'] == job.result['checkoutRequestID']
+    pushes = stub.calls(STK_PUSH_ENDPOINT)
+    # One token until M-Pesa rejected it, then a fresh one for the last attempt
+    assert [auth for _, _, auth in pushes] == ['Bearer token-1', 'Bearer token-1', 'Bearer token-2']
+    assert len(stub.calls(AUTH_ENDPOINT)) == 2
+    # Exponential backoff between attempts
+    first, second, third = [at for _, at, _ in pushes]
+    assert second - first >= BASE_DELAY
+    assert third - second >= 2 * BASE_DELAY
+    with app.app_context():
+        assert PaymentTransaction.query.filter_by(checkout_request_id=job.result['checkoutRequestID']).count() == 1
+
+def test_push_gives_up_after_max_attempts(app, client, stub):
+    stub.script = [(503, 0)] * mpesa.MAX_RETRIES
+
+    job, status = _push(client)
+
+    assert job.status == 'failed' and job.attempts == mpesa.MAX_RETRIES
+    assert status['status'] == 'failed'
+    assert len(stub.calls(STK_PUSH_ENDPOINT)) == mpesa.MAX_RETRIES
+
+def test_rejected_push_is_not_retried(app, client, stub):
+    stub.script = [(400, 0)]
+
+    job, _ = _push(client)
+
+    assert job.status == 'failed' and job.attempts == 1
+    assert len(stub.calls(STK_PUSH_ENDPOINT)) == 1
+
+def test_push_that_timed_out_after_sending_is_not_retried(app, client, stub):
+    # M-Pesa got the push but answered after the read timeout
+    stub.script = [(200, 1.0)]
+
+    job, status = _push(client)
+
+    assert job.status == 'failed' and job.attempts == 1
+    assert 'Check your phone' in status['message']
+    time.sleep(1.0)
+    assert len(stub.calls(STK_PUSH_ENDPOINT)) == 1
+
+def test_unreachable_api_is_retried(app, client, stub, monkeypatch):
+    # Nothing listens on the port of a closed server
+    closed = StubMpesa()
+    closed.server_close()
+    monkeypatch.setattr(mpesa, 'mpesa_client', MpesaClient(closed.url, connect_timeout=0.5))
+
+    job, _ = _push(client)
+
+    assert job.status == 'failed' and job.attempts == mpesa.MAX_RETRIES
+    assert 'Could not authenticate' in job.error
+
+def test_circuit_opens_after_repeated_failures_and_probes_once(stub):
+    client = MpesaClient(stub.url, read_timeout=0.5, failure_threshold=3, reset_timeout=0.2)
+    stub.script = [(503, 0)] * 4
+
+    for _ in range(3):
+        assert client.post(STK_PUSH_ENDPOINT, json={}).status_code == 503
+    assert client.breaker.state == 'open'
+
+    # Open: calls fail at once without reaching M-Pesa
+    with pytest.raises(CircuitOpenError):
+        client.post(STK_PUSH_ENDPOINT, json={})
+    assert len(stub.calls(STK_PUSH_ENDPOINT)) == 3
+
+    # Half-open: one trial goes through, and failing it re-opens the circuit
+    time.sleep(0.25)
+    assert client.breaker.state == 'half-open'
+    assert client.post(STK_PUSH_ENDPOINT, json={}).status_code == 503
+    assert client.breaker.state == 'open'
+    with pytest.raises(CircuitOpenError):
+        client.post(STK_PUSH_ENDPOINT, json={})
+
+    # A successful trial closes it again
+    time.sleep(0.25)
+    assert client.post(STK_PUSH_ENDPOINT, json={}).status_code == 200
+    assert client.breaker.state == 'closed'
+    assert client.post(STK_PUSH_ENDPOINT, json={}).status_code == 200
+    stats = client.stats()
+    assert (stats['requests'], stats['failures'], stats['rejectedByCircuit']) == (6, 4, 2)
+    # Every call went over the one kept-alive connection
+    assert stub.connections == stats['connectionsOpened'] == 1 and stats['connectionsReused'] == 5
+
+def test_half_open_circuit_lets_a_single_trial_through():
+    breaker = CircuitBreaker(threshold=2, reset_timeout=0.1)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert not breaker.allow()
+
+    time.sleep(0.15)
+    assert breaker.allow()
+    # Others are turned away while the trial is running
+    assert not breaker.allow() and not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'closed' and breaker.allow()
+    assert breaker.rejected == 3
+
+def test_client_errors_do_not_trip_the_circuit(stub):
+    client = MpesaClient(stub.url, read_timeout=0.5, failure_threshold=2)
+    stub.script = [(400, 0), (400, 0), (400, 0)]
+
+    for _ in range(3):
+        assert client.post(STK_PUSH_ENDPOINT, json={}).status_code == 400
+    assert client.breaker.state == 'closed' and client.failures == 0
@@ -0,0 +1,157 @@
+import time
+from threading import Barrier, Thread, Timer
+import pytest
+from routes.mpesa_token import TokenCache
+
+class FakeFetch(object):
+    """Stands in for the OAuth request: numbered tokens, optionally slow or failing"""
+
+    def __init__(self, expires_in=3600, delay=0):
+        self.expires_in = expires_in
+        self.delay = delay
+        self.calls = 0
+        self.error = None
+
+    def __call__(self):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return f'token-{self.calls}', self.expires_in
+
+class MemoryStore(object):
+    """The RedisTokenStore interface, kept in memory"""
+
+    def __init__(self):
+        self.entry = None
+        self.locked = False
+        self.fail = set()
+
+    def _check(self, name):
+        if name in self.fail:
+            raise ConnectionError(f'store {name} failed')
+
+    def get(self):
+        self._check('get')
+        return self.entry
+
+    def set(self, token, expires_at):
+        self._check('set')
+        self.entry = (token, expires_at)
+
+    def delete(self):
+        self.entry = None
+
+    def acquire_refresh(self, timeout):
+        self._check('acquire_refresh')
+        if self.locked:
+            return False
+        self.locked = True
+        return True
+
+    def release_refresh(self):
+        self.locked = False
+
+def _enter_refresh_window(cache):
+    # Still valid, but inside the refresh margin
+    cache._expires_at = time.time() + cache.refresh_margin / 2
+
+def test_concurrent_callers_share_one_fetch():
+    fetch = FakeFetch(delay=0.1)
+    cache = TokenCache(fetch)
+    barrier = Barrier(8)
+    tokens = []
+
+    def get():
+        barrier.wait()
+        tokens.append(cache.get())
+
+    threads = [Thread(target=get) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert tokens == ['token-1'] * 8
+    assert fetch.calls == cache.fetches == 1
+
+def test_token_is_refreshed_ahead_of_expiry():
+    fetch = FakeFetch()
+    cache = TokenCache(fetch, refresh_margin=300)
+    assert cache.get() == cache.get() == 'token-1'
+
+    _enter_refresh_window(cache)
+    # While another caller is refreshing, the current token is served at once
+    cache._lock.acquire()
+    try:
+        assert cache.get() == 'token-1'
+    finally:
+        cache._lock.release()
+    assert fetch.calls == 1
+
+    assert cache.get() == 'token-2'
+    assert cache.get() == 'token-2'
+    assert fetch.calls == 2
+
+@pytest.mark.parametrize('failure', ['fetch', 'acquire_refresh', 'set'])
+def test_failed_refresh_keeps_serving_a_valid_token(failure):
+    fetch = FakeFetch()
+    store = MemoryStore()
+    cache = TokenCache(fetch, store=store)
+    assert cache.get() == 'token-1'
+
+    _enter_refresh_window(cache)
+    store.entry = None
+    if failure == 'fetch':
+        fetch.error = ConnectionError('daraja is down')
+    else:
+        store.fail.add(failure)
+
+    # A token that was fetched but could not be shared is still used here
+    assert cache.get() == ('token-2' if failure == 'set' else 'token-1')
+    assert not store.locked
+
+def test_failed_refresh_without_a_valid_token_raises():
+    fetch = FakeFetch()
+    cache = TokenCache(fetch)
+    assert cache.get() == 'token-1'
+
+    cache._expires_at = time.time() - 1
+    fetch.error = ConnectionError('daraja is down')
+    with pytest.raises(ConnectionError):
+        cache.get()
+
+    fetch.error = None
+    assert cache.get() == 'token-3'
+
+def test_waits_for_the_token_another_worker_is_fetching():
+    fetch = FakeFetch()
+    store = MemoryStore()
+    store.locked = True  # another worker holds the refresh lock
+    cache = TokenCache(fetch, store=store, wait_timeout=5)
+    publish = Timer(0.2, store.set, args=('shared-token', time.time() + 3600))
+    publish.start()
+
+    assert cache.get() == 'shared-token'
+    assert fetch.calls == 0
+    # Later calls are served from the process without asking the store
+    store.entry = None
+    assert cache.get() == 'shared-token'
+
+def test_fetches_itself_when_the_other_worker_never_publishes():
+    fetch = FakeFetch()
+    store = MemoryStore()
+    store.locked = True
+    cache = TokenCache(fetch, store=store, wait_timeout=0.3)
+
+    assert cache.get() == 'token-1'
+    assert fetch.calls == 1
+
+def test_other_workers_token_is_used_without_fetching():
+    fetch = FakeFetch()
+    store = MemoryStore()
+    store.entry = ('shared-token', time.time() + 3600)
+    cache = TokenCache(fetch, store=store)
+
+    assert cache.get() == 'shared-token'
+    assert fetch.calls == 0
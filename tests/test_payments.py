@@ -0,0 +1,133 @@
+import time
+import uuid
+from conftest import make_buyer, make_catalog, log_in, scaled
+from models import db, MpesaCallback, Order, OrderItem, PaymentTransaction, Product
+import payments
+from payments import process_callback_batch, record_payment
+import routes.mpesa
+
+def _callback(checkout_request_id, result_code=0, amount=None):
+    items = [{'Name': 'MpesaReceiptNumber', 'Value': 'R' + checkout_request_id[:8]}]
+    if amount is not None:
+        items.append({'Name': 'Amount', 'Value': amount})
+    return {'Body': {'stkCallback': {
+        'MerchantRequestID': 'm',
+        'CheckoutRequestID': checkout_request_id,
+        'ResultCode': result_code,
+        'ResultDesc': 'ok' if result_code == 0 else 'Request cancelled by user',
+        'CallbackMetadata': {'Item': items}
+    }}}
+
+def _pending_orders(count, product_id, buyer_id, total=100):
+    """Pending orders for one unit each, with a pending payment per order"""
+    checkout_ids = []
+    for _ in range(count):
+        order_id = str(uuid.uuid4())
+        db.session.add(Order(order_id=order_id, user_id=buyer_id, total=total, status='Pending'))
+        db.session.add(OrderItem(order_id=order_id, product_id=product_id, quantity=1, price=total))
+        checkout_ids.append((order_id, 'ws_CO_' + uuid.uuid4().hex))
+    db.session.commit()
+    for order_id, checkout_id in checkout_ids:
+        record_payment(checkout_id, None, '254700000000', total, order_id)
+    return checkout_ids
+
+def _drain():
+    batches = 0
+    while process_callback_batch():
+        batches += 1
+    return batches
+
+def test_repeated_callbacks_are_applied_once(app, client):
+    with app.app_context():
+        product_id = make_catalog(1, n_sellers=1, stock=0)[0]
+        (order_id, checkout_id), = _pending_orders(1, product_id, make_buyer())
+
+    assert client.post('/api/mpesa/callback', json=_callback(checkout_id, amount=100)).status_code == 200
+    assert client.post('/api/mpesa/callback', json=_callback(checkout_id, result_code=1032)).status_code == 200
+
+    with app.app_context():
+        _drain()
+        assert MpesaCallback.query.count() == 1
+        assert db.session.get(Order, order_id).status == 'Processing'
+        assert PaymentTransaction.query.filter_by(checkout_request_id=checkout_id).one().status == 'completed'
+
+def test_underpaid_order_stays_pending(app, client):
+    with app.app_context():
+        product_id = make_catalog(1, n_sellers=1, stock=0)[0]
+        (order_id, checkout_id), = _pending_orders(1, product_id, make_buyer(), total=250)
+
+    client.post('/api/mpesa/callback', json=_callback(checkout_id, amount=1))
+
+    with app.app_context():
+        _drain()
+        assert db.session.get(Order, order_id).status == 'Pending'
+        assert MpesaCallback.query.one().error == 'Amount does not match order total'
+
+def test_stk_push_charges_the_order_total_for_its_buyer_only(app, client, monkeypatch):
+    submitted = []
+    monkeypatch.setattr(routes.mpesa.stk_jobs, 'submit',
+                        lambda func, *args, **kwargs: submitted.append(args) or type('Job', (), {'id': 'job'}))
+    with app.app_context():
+        product_id = make_catalog(1, n_sellers=1, stock=0)[0]
+        buyer_id = make_buyer()
+        other_id = make_buyer('other@example.com')
+        (order_id, _), = _pending_orders(1, product_id, buyer_id, total=99.5)
+    request = {'phoneNumber': '254700000000', 'orderId': order_id, 'amount': 1}
+
+    assert client.post('/api/mpesa/stkpush', json=request).status_code == 401
+    log_in(client, user_id=other_id)
+    assert client.post('/api/mpesa/stkpush', json=request).status_code == 404
+    log_in(client, user_id=buyer_id)
+    assert client.post('/api/mpesa/stkpush', json=request).status_code == 202
+
+    assert len(submitted) == 1
+    app_arg, phone_number, amount, charged_order = submitted[0]
+    assert (amount, charged_order) == (100, order_id)
+
+def test_waiting_callbacks_do_not_block_the_queue(app):
+    with app.app_context():
+        product_id = make_catalog(1, n_sellers=1, stock=0)[0]
+        (order_id, checkout_id), = _pending_orders(1, product_id, make_buyer())
+        for i in range(20):
+            payments.enqueue_callback(f'unknown-{i}', 0, 'ok')
+        payments.enqueue_callback(checkout_id, 0, 'ok', payload='{"CallbackMetadata": {"Item": [{"Name": "Amount", "Value": 100}]}}')
+
+        process_callback_batch(limit=10)
+        process_callback_batch(limit=10)
+        process_callback_batch(limit=10)
+
+        assert db.session.get(Order, order_id).status == 'Processing'
+        waiting = MpesaCallback.query.filter(MpesaCallback.processed_at.is_(None)).all()
+        assert len(waiting) == 20 and all(c.attempts == 1 for c in waiting)
+
+def test_callback_burst_throughput(app, client, benchmark_report):
+    count = scaled(300)
+    with app.app_context():
+        product_id = make_catalog(1, n_sellers=1, stock=0)[0]
+        checkout_ids = _pending_orders(count, product_id, make_buyer())
+    # One in five payments fails, and one in ten callbacks is delivered twice
+    bodies = [_callback(checkout_id, 0 if i % 5 else 1032, 100) for i, (_, checkout_id) in enumerate(checkout_ids)]
+    bodies += bodies[::10]
+
+    start = time.perf_counter()
+    for body in bodies:
+        assert client.post('/api/mpesa/callback', json=body).status_code == 200
+    ingest = time.perf_counter() - start
+
+    with app.app_context():
+        start = time.perf_counter()
+        batches = _drain()
+        apply = time.perf_counter() - start
+
+        statuses = dict(db.session.query(Order.status, db.func.count(Order.order_id)).group_by(Order.status).all())
+        failed = len(checkout_ids[::5])
+        assert statuses == {'Processing': count - failed, 'Cancelled': failed}
+        # Failed payments put their unit back
+        assert db.session.get(Product, product_id).stock == failed
+        assert MpesaCallback.query.count() == count
+
+    benchmark_report(
+        f'{len(bodies)} callbacks ({len(bodies) - count} duplicates): '
+        f'acknowledged at {len(bodies) / ingest:.0f}/s, '
+        f'applied at {count / apply:.0f}/s in {batches} batches'
+    )
@@ -0,0 +1,112 @@
+from conftest import log_in, make_buyer, make_catalog
+from models import db, AdminProfile, CategoryDailySales, DailyStats, Order, OrderItem, Product, \
+    SellerDailySales, SellerProfile, User
+from reports import backfill_summaries, category_sales, rebuild_summaries, sales_report, top_sellers, user_report
+
+def _from_rollups():
+    total_orders, total_sales, _ = sales_report()
+    total_users, total_sellers, _, _ = user_report()
+    return {
+        'orders': total_orders,
+        'sales': round(total_sales, 2),
+        'users': total_users,
+        'sellers': total_sellers,
+        'by_seller': dict((s['name'], (round(s['sales'], 2), s['products'])) for s in top_sellers(limit=100)),
+        'by_category': dict((c['category'], (round(c['revenue'], 2), c['count'])) for c in category_sales())
+    }
+
+def _live():
+    """The same figures aggregated over the raw tables"""
+    counted = Order.status != 'Cancelled'
+    orders, sales = db.session.query(db.func.count(Order.order_id), db.func.sum(Order.total)).filter(counted).one()
+
+    def sold_by(column):
+        return dict(
+            (group, (round(revenue, 2), int(units))) for group, revenue, units in db.session.query(
+                column, db.func.sum(OrderItem.price * OrderItem.quantity), db.func.sum(OrderItem.quantity)
+            ).join(Order, Order.order_id == OrderItem.order_id).join(
+                Product, Product.product_id == OrderItem.product_id
+            ).join(SellerProfile, SellerProfile.seller_id == Product.seller_id).filter(counted).group_by(column)
+        )
+
+    return {
+        'orders': orders,
+        'sales': round(float(sales or 0), 2),
+        'users': User.query.count(),
+        'sellers': SellerProfile.query.count(),
+        'by_seller': sold_by(SellerProfile.business_name),
+        'by_category': sold_by(Product.category)
+    }
+
+def _place_orders(app, client):
+    """Orders from three buyers, one of them then cancelled"""
+    with app.app_context():
+        product_ids = make_catalog(6, stock=20)
+        buyer_ids = [make_buyer(f'buyer{i}@example.com') for i in range(3)]
+        admin = AdminProfile(username='admin', email='admin@example.com', password_hash='x')
+        db.session.add(admin)
+        db.session.commit()
+        admin_id = admin.admin_id
+
+    order_ids = []
+    for i, buyer_id in enumerate(buyer_ids):
+        log_in(client, user_id=buyer_id)
+        items = [{'id': product_ids[(i + j) % 6], 'quantity': j + 1} for j in range(3)]
+        order_ids.append(client.post('/api/orders/create', json={'items': items}).get_json()['orderId'])
+
+    client.post('/api/logout')
+    log_in(client, admin_id=admin_id)
+    assert client.put(f'/api/orders/update-status/{order_ids[1]}', json={'status': 'Cancelled'}).get_json()['success']
+    return order_ids
+
+def test_rollups_match_live_aggregates(app, client):
+    _place_orders(app, client)
+
+    with app.app_context():
+        expected = _live()
+        assert expected['orders'] == 2 and len(expected['by_category']) == 3
+        assert _from_rollups() == expected
+
+        # Accounts created through registration or directly, then removed
+        assert client.post('/api/register', json={
+            'username': 'new', 'email': 'new@example.com', 'password': 'secret'
+        }).get_json()['success']
+        db.session.add(SellerProfile(username='gone', email='gone@example.com', password_hash='x',
+                                     business_name='Gone Farm'))
+        db.session.commit()
+        assert _from_rollups() == _live()
+
+        db.session.delete(User.query.filter_by(email='new@example.com').one())
+        db.session.delete(SellerProfile.query.filter_by(email='gone@example.com').one())
+        db.session.commit()
+        assert _from_rollups() == _live() == expected
+
+        rebuild_summaries()
+        assert _from_rollups() == expected
+
+def test_reports_endpoint_reads_categories_from_the_rollup(app, client):
+    _place_orders(app, client)
+
+    report = client.get('/api/admin/reports/data').get_json()['data']['productReport']
+
+    with app.app_context():
+        live = _live()['by_category']
+    assert report['totalProducts'] == 6
+    assert dict((c['category'], c['count']) for c in report['topCategories']) == \
+        dict((category, units) for category, (_, units) in live.items())
+    assert sum(c['percentage'] for c in report['topCategories']) in (99, 100, 101)
+
+def test_empty_rollups_are_backfilled_from_history(app, client):
+    _place_orders(app, client)
+
+    with app.app_context():
+        expected = _live()
+        # As on a database that predates the rollup tables
+        for model in (DailyStats, SellerDailySales, CategoryDailySales):
+            model.query.delete()
+        db.session.commit()
+        assert _from_rollups()['users'] == 0
+
+        assert backfill_summaries()
+        assert _from_rollups() == expected
+        assert not backfill_summaries()
@@ -0,0 +1,93 @@
+from datetime import datetime, timedelta
+from conftest import best_time, scaled
+from models import db, Product, SellerProfile
+
+WORDS = ('kienyeji', 'broiler', 'layer', 'rainbow', 'rooster', 'duck', 'turkey', 'quail',
+         'vaccinated', 'organic', 'free', 'range', 'hardy', 'fertile', 'hatching', 'point')
+
+def _fill_catalog(count, first=0):
+    """`count` products with names and descriptions made from WORDS, numbered from `first`"""
+    seller = SellerProfile(username=f'bulk{first}', email=f'bulk{first}@example.com', password_hash='x',
+                           business_name='Bulk Farm', approval_status='approved')
+    db.session.add(seller)
+    db.session.flush()
+    start = datetime(2026, 1, 1)
+    db.session.execute(Product.__table__.insert(), [
+        {
+            'name': f'{WORDS[i % 16].title()} {WORDS[i * 7 % 16]} {i}',
+            'description': f'{WORDS[i * 3 % 16]} {WORDS[i * 5 % 16]} birds from {WORDS[i * 11 % 16]} stock',
+            'price': 100 + i % 900,
+            'stock': i % 20,
+            'category': ('Chicks', 'Eggs', 'Layers', 'Broilers')[i % 4],
+            'seller_id': seller.seller_id,
+            'media_type': 'image',
+            'created_at': start + timedelta(seconds=i)
+        }
+        for i in range(first, first + count)
+    ])
+    db.session.commit()
+
+def test_name_matches_rank_above_description_matches(app, client):
+    with app.app_context():
+        seller = SellerProfile(username='s', email='s@example.com', password_hash='x',
+                               business_name='Farm', approval_status='approved')
+        db.session.add(seller)
+        db.session.flush()
+        db.session.add_all([
+            Product(name='Layer feed', description='Mash for kienyeji hens', price=10, stock=1,
+                    category='Feeds', seller_id=seller.seller_id),
+            Product(name='Kienyeji chicks', description='Two weeks old', price=10, stock=1,
+                    category='Chicks', seller_id=seller.seller_id),
+        ])
+        db.session.commit()
+
+    names = [p['name'] for p in client.get('/api/products/search?q=kienyeji').get_json()['products']]
+
+    assert names == ['Kienyeji chicks', 'Layer feed']
+
+def test_search_pages_through_filtered_results(app, client):
+    with app.app_context():
+        _fill_catalog(200)
+        expected = Product.query.filter(Product.name.like('Rooster%'), Product.category == 'Chicks').count()
+
+    seen = []
+    cursor = ''
+    while cursor is not None:
+        page = client.get(f'/api/products/search?q=rooster&category=Chicks&limit=7&cursor={cursor}').get_json()
+        seen += [p['id'] for p in page['products']]
+        cursor = page['nextCursor']
+        assert all(p['category'] == 'Chicks' for p in page['products'])
+
+    assert expected and len(seen) >= expected
+    assert len(seen) == len(set(seen))
+
+def test_suggestions_match_word_prefixes(app, client):
+    with app.app_context():
+        _fill_catalog(50)
+
+    suggestions = client.get('/api/products/suggest?q=kien').get_json()['suggestions']
+
+    assert suggestions
+    assert all('kienyeji' in s['name'].lower() for s in suggestions)
+
+def test_search_latency_as_catalogue_grows(app, client, benchmark_report):
+    results = []
+    total = 0
+    for size in (scaled(500), scaled(2000), scaled(8000)):
+        with app.app_context():
+            _fill_catalog(size - total, total)
+            total = size
+
+        def search():
+            for q in ('kienyeji', 'vaccinated birds', 'rooster stock'):
+                response = client.get(f'/api/products/search?q={q}&limit=20')
+                assert response.status_code == 200
+                assert response.get_json()['products']
+
+        def suggest():
+            assert client.get('/api/products/suggest?q=rai').get_json()['suggestions']
+
+        results.append(f'{size} products: search {best_time(search, 3) / 3 * 1000:.1f} ms, '
+                       f'suggest {best_time(suggest, 3) * 1000:.1f} ms')
+
+    benchmark_report('; '.join(results))
@@ -0,0 +1,113 @@
+import uuid
+from conftest import best_time, make_buyer, make_catalog, scaled
+from catalog import catalog_query, seller_name
+from images import image_variants
+from models import db, Message, Order, OrderItem, Product
+from serializers import ADMIN_ORDER, ORDER_ITEM, PRODUCT, SELLER_MESSAGE
+from videos import video_poster
+
+# The dicts the routes built by hand before the schemas; the schemas must
+# produce exactly the same payloads
+
+def _product_dict(product):
+    return {
+        'id': str(product.product_id),
+        'name': product.name,
+        'description': product.description,
+        'price': product.price,
+        'stock': product.stock,
+        'category': product.category,
+        'image': product.image_url,
+        'variants': image_variants(product.image_url),
+        'video': product.video_url,
+        'poster': video_poster(product.video_url),
+        'mediaType': product.media_type,
+        'sellerId': str(product.seller_id),
+        'sellerName': seller_name(product),
+        'createdAt': product.created_at.isoformat()
+    }
+
+def _admin_order_dict(order):
+    user = order.user
+    return {
+        'id': str(order.order_id),
+        'user_name': user.username if user else "Unknown User",
+        'user_email': user.email if user else "Unknown Email",
+        'total': order.total,
+        'status': order.status,
+        'created_at': order.created_at.isoformat()
+    }
+
+def _order_item_dict(item):
+    product = item.product
+    return {
+        'id': str(product.product_id),
+        'name': product.name,
+        'price': item.price,
+        'quantity': item.quantity,
+        'image': product.image_url
+    }
+
+def _seller_message_dict(msg):
+    return {
+        'id': str(msg.message_id),
+        'senderName': msg.senderName,
+        'senderEmail': msg.senderEmail,
+        'content': msg.content,
+        'productName': msg.productName,
+        'createdAt': msg.created_at.isoformat(),
+        'reply': msg.reply,
+        'repliedAt': msg.replied_at.isoformat() if msg.replied_at else None
+    }
+
+def test_product_schema_matches_hand_built_dict(app):
+    with app.app_context():
+        make_catalog(6)
+        products = catalog_query().order_by(Product.product_id).all()
+        rows = catalog_query(PRODUCT.columns).order_by(Product.product_id).all()
+
+        expected = [_product_dict(product) for product in products]
+        assert PRODUCT.dump_many(products) == expected
+        assert PRODUCT.dump_rows(rows) == expected
+
+def test_order_and_message_schemas_match_hand_built_dicts(app):
+    with app.app_context():
+        product_ids = make_catalog(2, n_sellers=1)
+        buyer_id = make_buyer()
+        order_id = str(uuid.uuid4())
+        db.session.add(Order(order_id=order_id, user_id=buyer_id, total=250, status='Pending'))
+        db.session.add_all(OrderItem(order_id=order_id, product_id=product_id, quantity=2, price=125)
+                           for product_id in product_ids)
+        db.session.add(Message(seller_id=1, product_id=product_ids[0], senderName='Buyer',
+                               senderEmail='buyer@example.com', content='Still available?',
+                               productName='Product 0'))
+        db.session.commit()
+
+        order = db.session.get(Order, order_id)
+        assert ADMIN_ORDER.dump(order) == _admin_order_dict(order)
+        assert ORDER_ITEM.dump_many(order.items) == [_order_item_dict(item) for item in order.items]
+        message = Message.query.one()
+        assert SELLER_MESSAGE.dump(message) == _seller_message_dict(message)
+
+        # An order whose user is gone falls back to the same placeholders
+        orphan = Order(order_id='orphan', total=10, status='Cancelled', created_at=order.created_at)
+        assert ADMIN_ORDER.dump(orphan) == _admin_order_dict(orphan)
+
+def test_product_serialization_cpu(app, benchmark_report):
+    count = scaled(2000)
+    with app.app_context():
+        make_catalog(count, n_sellers=20)
+        products = catalog_query().all()
+        rows = catalog_query(PRODUCT.columns).all()
+
+        baseline = best_time(lambda: [_product_dict(product) for product in products])
+        objects = best_time(lambda: PRODUCT.dump_many(products))
+        tuples = best_time(lambda: PRODUCT.dump_rows(rows))
+
+    def per_product(seconds):
+        return seconds / count * 1e6
+
+    benchmark_report(
+        f'{count} products: hand-built {per_product(baseline):.2f} us, '
+        f'schema dump {per_product(objects):.2f} us, dump_rows {per_product(tuples):.2f} us per product'
+    )
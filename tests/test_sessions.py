@@ -0,0 +1,50 @@
+from conftest import log_in, make_catalog
+from models import db, AdminProfile, SellerProfile, SessionRecord
+
+def _admin():
+    admin = AdminProfile(username='admin', email='admin@example.com', password_hash='x')
+    db.session.add(admin)
+    db.session.commit()
+    return admin.admin_id
+
+def test_rejected_seller_is_logged_out_of_every_session(app, client):
+    with app.app_context():
+        make_catalog(1, n_sellers=1)
+        admin_id = _admin()
+    seller = app.test_client()
+    log_in(seller, seller_id=1, approval_status='approved')
+    # The same browser logged in as both admin and seller
+    both = app.test_client()
+    log_in(both, admin_id=admin_id, seller_id=1, approval_status='approved')
+    log_in(client, admin_id=admin_id)
+    assert seller.get('/api/seller/products').status_code == 200
+    assert both.get('/api/seller/products').status_code == 200
+
+    assert client.put('/api/admin/sellers/1/approval', json={'status': 'rejected'}).get_json()['success']
+
+    for browser in (seller, both):
+        response = browser.get('/api/seller/products')
+        assert response.status_code in (401, 403)
+        assert not response.get_json()['success']
+    with app.app_context():
+        assert SessionRecord.query.filter_by(seller_id=1).count() == 0
+        assert SessionRecord.query.filter_by(admin_id=admin_id).count() == 1
+
+def test_approval_change_reaches_a_session_holding_several_principals(app, client):
+    with app.app_context():
+        make_catalog(1, n_sellers=1)
+        seller = db.session.get(SellerProfile, 1)
+        seller.approval_status = 'pending'
+        db.session.commit()
+        admin_id = _admin()
+    log_in(client, admin_id=admin_id, seller_id=1, approval_status='pending')
+
+    assert client.put('/api/admin/sellers/1/approval', json={'status': 'approved'}).get_json()['success']
+
+    with app.app_context():
+        record = SessionRecord.query.filter_by(seller_id=1).one()
+        assert (record.admin_id, record.approval_status) == (admin_id, 'approved')
+
+def test_logged_out_requests_are_refused_with_401(app, client):
+    assert client.get('/api/seller/products').status_code == 401
+    assert client.get('/api/admin/reports/data').status_code == 401
@@ -0,0 +1,151 @@
+import hashlib
+import os
+import time
+from threading import Barrier, Thread
+from conftest import log_in, make_catalog
+from media import URL_PREFIX, blob_sha, media_root
+from models import db, MediaBlob, Product, VideoUpload
+from videos import CHUNK_DIR, create_upload, save_chunk
+
+API = '/api/uploads/video'
+CHUNK = 64 * 1024
+
+def _start(client, data, product_id=None):
+    response = client.post(API, json={'filename': 'flock.mp4', 'size': len(data), 'contentType': 'video/mp4',
+                                      'chunkSize': CHUNK, 'productId': product_id})
+    return response.get_json()['upload']
+
+def _put(client, upload_id, data, index, checksum=None):
+    chunk = data[index * CHUNK:(index + 1) * CHUNK]
+    return client.put(f'{API}/{upload_id}/chunks/{index}', data=chunk, headers={
+        'Content-Type': 'application/octet-stream',
+        'X-Chunk-SHA256': checksum or hashlib.sha256(chunk).hexdigest()
+    })
+
+def _wait(client, upload_id, timeout=10):
+    """Poll the upload until its assembly has finished"""
+    deadline = time.monotonic() + timeout
+    while True:
+        upload = client.get(f'{API}/{upload_id}').get_json()['upload']
+        if upload['status'] != 'assembling':
+            return upload
+        assert time.monotonic() < deadline, 'assembly did not finish'
+        time.sleep(0.02)
+
+def _seller(app, client):
+    with app.app_context():
+        product_id = make_catalog(1, n_sellers=1)[0]
+    log_in(client, seller_id=1, approval_status='approved')
+    return product_id
+
+def test_chunks_are_assembled_in_the_background_and_attached(app, client):
+    product_id = _seller(app, client)
+    data = os.urandom(CHUNK * 2 + 1000)
+    upload = _start(client, data, product_id)
+    assert upload['totalChunks'] == 3
+
+    # Chunks may arrive in any order
+    for index in (2, 0, 1):
+        assert _put(client, upload['uploadId'], data, index).get_json()['success']
+
+    response = client.post(f"{API}/{upload['uploadId']}/complete")
+    assert response.status_code == 202
+    assert response.get_json()['upload']['status'] == 'assembling'
+
+    upload = _wait(client, upload['uploadId'])
+    assert upload['status'] == 'complete' and upload['error'] is None
+    with app.app_context():
+        with open(os.path.join(media_root(), upload['videoUrl'][len(URL_PREFIX):]), 'rb') as stored:
+            assert stored.read() == data
+        product = db.session.get(Product, product_id)
+        assert (product.video_url, product.media_type) == (upload['videoUrl'], 'video')
+        assert db.session.get(MediaBlob, blob_sha(upload['videoUrl'])).refcount == 1
+        assert not os.path.exists(os.path.join(media_root(), CHUNK_DIR, upload['uploadId']))
+
+    # Completing again just reports the finished upload
+    again = client.post(f"{API}/{upload['uploadId']}/complete")
+    assert again.status_code == 200 and again.get_json()['upload']['videoUrl'] == upload['videoUrl']
+
+def test_interrupted_upload_resumes_from_received_chunks(app, client):
+    _seller(app, client)
+    data = os.urandom(CHUNK * 3)
+    upload_id = _start(client, data)['uploadId']
+    _put(client, upload_id, data, 0)
+    _put(client, upload_id, data, 2)
+
+    # A corrupted retry is refused and leaves the stored chunk alone
+    bad = _put(client, upload_id, data, 0, checksum='0' * 64)
+    assert bad.status_code == 400 and 'Checksum mismatch' in bad.get_json()['message']
+
+    resumed = client.get(f'{API}/{upload_id}').get_json()['upload']
+    assert resumed['receivedChunks'] == [0, 2]
+    incomplete = client.post(f'{API}/{upload_id}/complete')
+    assert incomplete.status_code == 400 and incomplete.get_json()['message'] == 'Missing chunks: 1'
+
+    _put(client, upload_id, data, 1)
+    client.post(f'{API}/{upload_id}/complete')
+    upload = _wait(client, upload_id)
+    with app.app_context():
+        with open(os.path.join(media_root(), upload['videoUrl'][len(URL_PREFIX):]), 'rb') as stored:
+            assert stored.read() == data
+
+def test_failed_assembly_is_reported(app, client, monkeypatch):
+    _seller(app, client)
+    data = os.urandom(1024 * 1024 + CHUNK)
+    upload_id = _start(client, data)['uploadId']
+    for index in range(len(data) // CHUNK):
+        _put(client, upload_id, data, index)
+    # The limit was lowered while the chunks were being sent
+    monkeypatch.setitem(app.config, 'MEDIA_MAX_VIDEO_BYTES', 1024 * 1024)
+
+    client.post(f'{API}/{upload_id}/complete')
+    upload = _wait(client, upload_id)
+
+    assert upload['status'] == 'failed'
+    assert upload['error'] == 'File is larger than 1 MB'
+    with app.app_context():
+        assert MediaBlob.query.count() == 0
+
+class SlowStream(object):
+    """A request body arriving in small pieces"""
+
+    def __init__(self, data):
+        self.data = data
+
+    def read(self, size):
+        time.sleep(0.01)
+        piece, self.data = self.data[:1024], self.data[1024:]
+        return piece
+
+def test_same_chunk_sent_twice_at_once_is_stored_intact(app):
+    with app.app_context():
+        make_catalog(0, n_sellers=1)
+        upload = create_upload(1, 'flock.mp4', CHUNK * 2, chunk_size=CHUNK)
+        db.session.commit()
+        upload_id = upload.upload_id
+    chunk = os.urandom(CHUNK)
+    checksum = hashlib.sha256(chunk).hexdigest()
+    barrier = Barrier(2)
+    errors = []
+
+    def send():
+        with app.app_context():
+            upload = db.session.get(VideoUpload, upload_id)
+            barrier.wait()
+            try:
+                save_chunk(upload, 0, SlowStream(chunk), checksum)
+            except Exception as e:
+                errors.append(e)
+
+    threads = [Thread(target=send) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    with app.app_context():
+        directory = os.path.join(media_root(), CHUNK_DIR, upload_id)
+        assert os.listdir(directory) == ['0']
+        with open(os.path.join(directory, '0'), 'rb') as stored:
+            assert stored.read() == chunk
@@ -0,0 +1,288 @@
+from datetime import datetime, timedelta
+import hashlib
+import math
+import os
+import shutil
+import subprocess
+import tempfile
+import uuid
+from threading import Lock
+from jobs import JobQueue
+from media import CHUNK_SIZE, URL_PREFIX, MediaError, acquire, blob_sha, mark_pending, media_root, release, store_stream
+from models import db, Product, VideoUpload
+
+CHUNK_DIR = os.path.join('tmp', 'chunks')
+DEFAULT_CHUNK_SIZE = 5 * 1024 * 1024
+MAX_CHUNK_SIZE = 16 * 1024 * 1024
+POSTER_AT = 1  # seconds into the video
+
+FFMPEG = shutil.which('ffmpeg')
+
+# Assembles completed uploads and extracts poster frames
+video_jobs = JobQueue(workers=int(os.environ.get('VIDEO_WORKERS', 2)), max_jobs=1000)
+
+_queued = set()
+_failed = set()
+_lock = Lock()
+
+class UploadError(Exception):
+    """A chunk or upload request that cannot be accepted"""
+
+def total_chunks(upload):
+    return max(1, int(math.ceil(upload.size / float(upload.chunk_size))))
+
+def _chunk_dir(upload_id):
+    return os.path.join(media_root(), CHUNK_DIR, upload_id)
+
+def create_upload(seller_id, filename, size, content_type=None, chunk_size=None, product_id=None, max_bytes=None):
+    """Start a chunked upload; the caller commits"""
+    size = int(size)
+    chunk_size = int(chunk_size or DEFAULT_CHUNK_SIZE)
+    if size <= 0:
+        raise UploadError('File is empty')
+    if max_bytes and size > max_bytes:
+        raise UploadError(f'File is larger than {max_bytes // (1024 * 1024)} MB')
+    if not 0 < chunk_size <= MAX_CHUNK_SIZE:
+        raise UploadError(f'Chunk size must be at most {MAX_CHUNK_SIZE} bytes')
+
+    upload = VideoUpload(
+        upload_id=str(uuid.uuid4()),
+        seller_id=seller_id,
+        product_id=product_id,
+        filename=filename,
+        content_type=content_type,
+        size=size,
+        chunk_size=chunk_size,
+        status='uploading'
+    )
+    db.session.add(upload)
+    os.makedirs(_chunk_dir(upload.upload_id), exist_ok=True)
+    return upload
+
+def received_chunks(upload):
+    """Indexes of the chunks already stored, for resuming an upload"""
+    directory = _chunk_dir(upload.upload_id)
+    if not os.path.isdir(directory):
+        return []
+    return sorted(int(name) for name in os.listdir(directory) if name.isdigit())
+
+def save_chunk(upload, index, stream, checksum):
+    """Stream one chunk to disk and keep it only if its SHA-256 matches
+
+    Re-sending a chunk replaces it, so a client can retry any chunk it is
+    unsure about.
+    """
+    if upload.status != 'uploading':
+        raise UploadError('Upload is already complete')
+    count = total_chunks(upload)
+    if not 0 <= index < count:
+        raise UploadError(f'Chunk index must be between 0 and {count - 1}')
+    expected_size = upload.chunk_size if index < count - 1 else upload.size - upload.chunk_size * (count - 1)
+
+    directory = _chunk_dir(upload.upload_id)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, str(index))
+    # A temp name of its own, so two requests sending the same chunk at once
+    # (a client retrying before its first attempt ended) never write into
+    # the same file
+    handle, tmp_path = tempfile.mkstemp(dir=directory, prefix=f'{index}.', suffix='.part')
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(handle, 'wb') as out:
+            while True:
+                data = stream.read(CHUNK_SIZE)
+                if not data:
+                    break
+                size += len(data)
+                if size > expected_size:
+                    raise UploadError(f'Chunk {index} is larger than {expected_size} bytes')
+                digest.update(data)
+                out.write(data)
+        if size != expected_size:
+            raise UploadError(f'Chunk {index} should be {expected_size} bytes, got {size}')
+        if digest.hexdigest() != (checksum or '').lower():
+            raise UploadError(f'Checksum mismatch for chunk {index}')
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+class _ChunkReader(object):
+    """Reads an upload's chunk files back to back as one stream"""
+
+    def __init__(self, paths):
+        self.paths = list(paths)
+        self.current = None
+
+    def read(self, size):
+        while True:
+            if self.current is None:
+                if not self.paths:
+                    return b''
+                self.current = open(self.paths.pop(0), 'rb')
+            data = self.current.read(size)
+            if data:
+                return data
+            self.current.close()
+            self.current = None
+
+    def close(self):
+        if self.current is not None:
+            self.current.close()
+
+def check_complete(upload):
+    """Raise UploadError unless every chunk of the upload has arrived"""
+    missing = sorted(set(range(total_chunks(upload))) - set(received_chunks(upload)))
+    if missing:
+        raise UploadError(f'Missing chunks: {", ".join(str(index) for index in missing[:20])}')
+
+def assemble(upload, max_bytes=None):
+    """Join the chunks into the media store and return the blob
+
+    The caller commits, then removes the chunks with discard_chunks().
+    """
+    check_complete(upload)
+
+    directory = _chunk_dir(upload.upload_id)
+    reader = _ChunkReader(os.path.join(directory, str(index)) for index in range(total_chunks(upload)))
+    try:
+        blob = store_stream(reader, upload.filename, upload.content_type, max_bytes)
+    except MediaError as e:
+        raise UploadError(str(e))
+    finally:
+        reader.close()
+
+    upload.status = 'complete'
+    upload.video_url = URL_PREFIX + blob.path
+    return blob
+
+def discard_chunks(upload_id):
+    shutil.rmtree(_chunk_dir(upload_id), ignore_errors=True)
+
+def _attach(upload):
+    """Make the assembled video its product's video, if it has one"""
+    product = db.session.get(Product, upload.product_id) if upload.product_id else None
+    if product is None or product.seller_id != upload.seller_id or product.video_url == upload.video_url:
+        return
+    acquire(upload.video_url)
+    release(product.video_url)
+    product.video_url = upload.video_url
+    product.media_type = 'both' if product.image_url else 'video'
+
+def _fail(upload_id, message):
+    upload = db.session.get(VideoUpload, upload_id)
+    if upload is not None and upload.status == 'assembling':
+        upload.status = 'failed'
+        upload.error = message[:255]
+        db.session.commit()
+
+def finish_upload(app, upload_id, max_bytes=None):
+    """Assemble an upload marked 'assembling' and attach it to its product;
+    runs on video_jobs
+
+    The upload row stays locked while its chunks are joined. An upload
+    whose job was lost (the worker stopped) stays 'assembling' until
+    purge_stale_uploads() drops it.
+    """
+    with app.app_context():
+        try:
+            upload = VideoUpload.query.filter_by(upload_id=upload_id).with_for_update().first()
+            if upload is None or upload.status != 'assembling':
+                db.session.commit()
+                return
+            assemble(upload, max_bytes)
+            _attach(upload)
+            video_url = upload.video_url
+            db.session.commit()
+        except UploadError as e:
+            db.session.rollback()
+            _fail(upload_id, str(e))
+            return
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error assembling video upload {upload_id}: {str(e)}")
+            _fail(upload_id, 'The video could not be processed, please upload it again')
+            raise
+
+        discard_chunks(upload_id)
+        # The poster frame is extracted by another job
+        queue_poster(video_url)
+
+def queue_assembly(app, upload_id, max_bytes=None):
+    """Assemble an upload in the background - commit its 'assembling'
+    status first"""
+    return video_jobs.submit(finish_upload, app, upload_id, max_bytes, max_attempts=1)
+
+def _poster_path(root, video_url):
+    source = os.path.join(root, video_url[len(URL_PREFIX):])
+    return source, os.path.join(os.path.dirname(source), blob_sha(video_url) + '_poster.jpg')
+
+def extract_poster(root, video_url):
+    """Grab a frame from a stored video with ffmpeg; runs on video_jobs"""
+    sha256 = blob_sha(video_url)
+    try:
+        source, poster = _poster_path(root, video_url)
+        if os.path.exists(poster):
+            return
+        tmp_path = poster + '.part.jpg'
+        # Seek before the input so ffmpeg jumps straight to the frame; fall
+        # back to the first frame for clips shorter than POSTER_AT
+        for offset in (POSTER_AT, 0):
+            subprocess.run(
+                [FFMPEG, '-y', '-loglevel', 'error', '-ss', str(offset), '-i', source,
+                 '-frames:v', '1', '-q:v', '3', tmp_path],
+                check=True, timeout=120, stdin=subprocess.DEVNULL
+            )
+            if os.path.exists(tmp_path) and os.path.getsize(tmp_path) > 0:
+                os.replace(tmp_path, poster)
+                return
+        raise Exception(f'No frame could be extracted from {video_url}')
+    except Exception:
+        with _lock:
+            _failed.add(sha256)
+        raise
+    finally:
+        with _lock:
+            _queued.discard(sha256)
+
+def queue_poster(video_url, root=None):
+    """Extract a poster frame in the background (needs ffmpeg on the PATH)"""
+    sha256 = blob_sha(video_url)
+    if FFMPEG is None or sha256 is None:
+        return
+    with _lock:
+        if sha256 in _queued or sha256 in _failed:
+            return
+        _queued.add(sha256)
+    video_jobs.submit(extract_poster, root or media_root(), video_url, max_attempts=1)
+
+def video_poster(video_url):
+    """URL of a video's poster frame, or None while there isn't one
+
+    A missing poster is queued for extraction.
+    """
+    if blob_sha(video_url) is None:
+        return None
+    root = media_root()
+    _, poster = _poster_path(root, video_url)
+    if not os.path.exists(poster):
+        queue_poster(video_url, root)
+        if FFMPEG is not None and blob_sha(video_url) not in _failed:
+            mark_pending()
+        return None
+    return URL_PREFIX + os.path.relpath(poster, root).replace(os.sep, '/')
+
+def purge_stale_uploads(max_age=timedelta(days=1)):
+    """Drop chunked uploads that were never completed or assembled"""
+    cutoff = datetime.utcnow() - max_age
+    stale = VideoUpload.query.filter(
+        VideoUpload.status.in_(('uploading', 'assembling', 'failed')), VideoUpload.created_at < cutoff
+    ).all()
+    upload_ids = [upload.upload_id for upload in stale]
+    for upload in stale:
+        db.session.delete(upload)
+    db.session.commit()
+    for upload_id in upload_ids:
+        discard_chunks(upload_id)
+    return len(upload_ids)